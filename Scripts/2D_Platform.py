@@ -3,6 +3,32 @@ Programming's project
 """
 import arcade
 import math
+import os
+import random
+import threading
+import time
+
+from particles import ExplosionPool
+from entities import SpritePool, TileStore, load_layer
+from collision import build_collision_bodies
+from broadphase import BroadPhase
+from simulation_thread import SimulationThread, SnapshotRenderer
+from throttle import FrameThrottle, ACTIVE
+from sprite_lists import SpriteListManager, GcMonitor
+from render_scale import RenderScaler
+from input_latency import InputLatency
+import assets
+import bundle
+import hit_boxes
+from navigation import NavGrid, FlowField, LineOfSight, patrol_segment, read_patrol_areas
+import endless
+import ecs
+import event_log
+import telemetry
+import level_data
+import memory_report
+import quick_save
+import state_stream
 
 # Constants
 # ======================================================================================================================
@@ -36,10 +62,48 @@ UPDATES_PER_FRAME = 4 # speed of the animation
 RIGHT_FACING = 0 # looks to the right at the start
 LEFT_FACING = 1 # looks to the left when walking to the left
 
+# Kind of collider of an entity
+PLAYER_SHOT = 0
+ENEMY_SHOT = 1
+PLAYER_BODY = 2
+PLAYER_KEY = -1 # key of the player in the contact list (entities start at 0)
+
+# Layers each kind of collider is tested against
+COLLISION_MASKS = {
+    PLAYER_BODY: ("coins", "hazards", "trampolines"),
+    PLAYER_SHOT: ("coins", "enemies", "walls"),
+    ENEMY_SHOT: ("walls", "player"),
+}
+
 # Other
 GRAVITY = 0.8
 BULLET_SPEED = 8
-EXPLOSION_TEXTURE_COUNT = 60
+BULLET_IMAGE = ":resources:images/space_shooter/laserBlue01.png"
+BULLET_LIFETIME = 600 # frames before a bullet that hit nothing disappears
+ENEMY_RANGE_X = 600 # enemies shoot when the player is closer than this (horizontally)
+ENEMY_RANGE_Y = 450 # and this (vertically)
+ENEMY_FIRE_RATE = 90 # frames between two shots
+ENEMY_CHASE_CELLS = 12 # enemies chase the player when they are less than this number of moves away (0: never)
+ENEMY_CHASE_SPEED = 1.5 # pixels per frame
+ENEMY_PATROL_SPEED = 1 # pixels per frame, when not chasing (a "speed" property of a Patrol rectangle overrides it)
+EXPLOSION_LOW_MEMORY = False # use a decimated and downscaled explosion animation
+THREADED_SIMULATION = False # run the game logic on its own thread, on_draw renders snapshots of it
+SIMULATION_RATE = 60 # updates per second of the simulation thread
+RENDER_SCALE = 1.0 # draw the scene at this fraction of the window size, the HUD stays at full resolution (1: off)
+RENDER_SCALE_LINEAR = False # smooth upscaling of the scene (False: nearest, sharp pixels)
+RENDER_TARGET_MS = None # dynamic render scale: GPU time of the scene to hold, in milliseconds (None: fixed scale)
+THROTTLE = True # lower the frame rate when nothing moves on the screen, pause when the window loses the focus
+ASSET_BUNDLE = bundle.BUNDLE_NAME # read the assets from this file when it exists (python bundle.py build)
+HIT_BOX_CACHE = hit_boxes.CACHE_NAME # keep the hit boxes of the textures in this file between runs (None: no cache)
+EVENT_LOG = event_log.LOG_NAME # record the events of the game in this file (".bin": binary records, None: no log)
+EVENT_LOG_LEVEL = event_log.INFO # events under this level are not recorded (event_log.DEBUG adds the enemy shots)
+TELEMETRY_DATABASE = telemetry.DATABASE_NAME # statistics of the sessions (python telemetry.py, None: off)
+QUICK_SAVE = quick_save.SAVE_NAME # F5 saves, F9 loads, the game is saved on close and resumes from it (None: off)
+STATE_STREAM_PORT = None # send every update to spectators on this local port (state_stream.STREAM_PORT), None: off
+STATE_STREAM_RECORD = None # record the state stream in this file (python state_stream.py --replay FILE), None: off
+ENDLESS_MODE = True # after the last map, play levels generated around the player forever
+MAP_LEVELS = 6 # levels with a Tiled map (map2_level_1.tmx to map2_level_6.tmx), the endless mode starts after them
+ENDLESS_SEED = None # seed of the generated levels (None: a new one for each run, the "level" event records it)
 # ======================================================================================================================
 
 # Define texture to extract resources from th the arcade library
@@ -49,8 +113,8 @@ def load_texture_pair(filename):
     Load a texture pair, with the second being a mirror image.
     """
     return [
-        arcade.load_texture(filename),
-        arcade.load_texture(filename, flipped_horizontally=True)
+        assets.load_texture(filename),
+        assets.load_texture(filename, flipped_horizontally=True)
     ]
 # ======================================================================================================================
 
@@ -81,6 +145,9 @@ class PlayerCharacter(arcade.Sprite):
             texture = load_texture_pair(f"{main_path}_walk{i}.png")
             self.walk_textures.append(texture)
 
+        # Every texture of the player, the state stream sends the index of the current one
+        self.pose_textures = [*self.idle_texture_pair, *(texture for pair in self.walk_textures for texture in pair)]
+
     def update_animation(self, delta_time: float = 1/60):
 
         # figure out if we need to flip face left or right
@@ -103,25 +170,6 @@ class PlayerCharacter(arcade.Sprite):
         self.texture = self.walk_textures[frame][direction]
 # ======================================================================================================================
 
-#  Create a class for the explosion
-# ======================================================================================================================
-class Explosion(arcade.Sprite):
-
-    def __init__(self, texture_list):
-        # Start at the first frame
-        super().__init__()
-        self.current_texture = 0
-        self.textures = texture_list
-
-    def update(self):
-        # Move to the next frame until the animation is over
-        self.current_texture += 1
-        if self.current_texture < len(self.textures):
-            self.set_texture(self.current_texture)
-        else:
-            self.remove_from_sprite_lists()
-# ======================================================================================================================
-
 # Create a class for the game
 # ======================================================================================================================
 class MyGame(arcade.Window):
@@ -138,37 +186,35 @@ class MyGame(arcade.Window):
         # These are 'lists' that keep track of our sprites
         self.coin_list = None
         self.wall_list = None
+        self.wall_body_list = None
         self.player_list = None
         self.enemy_list = None
-        self.bullet_list = None
-        self.bullet_enemy_list = None
-        self.explosion_list = None
         self.ladder_list = None
         self.background_list = None
         self.foreground_list = None
         self.dont_touch_list = None
         self.trampoline_list = None
 
+        # Layers that are streamed around the camera instead of being kept in memory
+        self.tile_stores = []
+
+        # The sprite lists are kept from one level to the next, what a level leaves is dropped when idle
+        self.sprite_lists = SpriteListManager()
+        self.gc_monitor = GcMonitor()
+
         # Enemies that shoot me
         self.frame_count = 0
 
         # Remove the comment if you don't want to see the mouse cursor
         #self.set_mouse_visible(False)
 
-        # Pre-load the animation frames.
-        self.explosion_texture_list = []
-        columns = 16
-        count = 60
-        sprite_width = 256
-        sprite_height = 256
-        file_name = f":resources:images/spritesheets/explosion.png"
-
-        # Load the explosion from a sprite sheet
-        self.explosion_texture_list = arcade.load_spritesheet(file_name, sprite_width, sprite_height, columns, count)
+        # Pool of explosions, the animation frames are loaded only once
+        self.explosions = ExplosionPool(low_memory=EXPLOSION_LOW_MEMORY)
 
         # Keep track of the score and life
         self.score = 0
         self.life = 5
+        self.deaths = 0
 
         # Separate variable that holds the player sprite
         self.player_sprite = None
@@ -176,6 +222,15 @@ class MyGame(arcade.Window):
         # Our physics engine
         self.physics_engine = None
 
+        # Collisions of the player and the bullets, found once per update
+        self.broad_phase = None
+        self.contacts = None
+
+        # Navigation of the enemies
+        self.nav_grid = None
+        self.flow_field = None
+        self.line_of_sight = None
+
         # Used to keep track of our scrolling
         self.view_bottom = 0
         self.view_left = 0
@@ -183,27 +238,110 @@ class MyGame(arcade.Window):
         # right edge of the map
         self.end_of_map = 0
 
+        # Where the player starts and comes back when he dies
+        self.start_position = (PLAYER_START_X, PLAYER_START_Y)
+
+        # Chunks of the level in endless mode (None when playing a map)
+        self.endless = None
+
+        # Coins and enemies of the map in the order of their layer, a quick save tells which ones are gone
+        self.level_coins = []
+        self.level_enemies = []
+
+        # Background writer of the quick saves, started by the first one
+        self.save_writer = None
+
+        # Events of the game (shots, pickups, deaths, ...), written to a file by a background thread
+        self.events = event_log.current_log()
+
+        # Statistics of the session, counted from the events and the frame times
+        self.telemetry = telemetry.current_telemetry()
+        # Time of the last frame drawn at the full frame rate (None: the next one has nothing to compare to)
+        self.last_draw_time = None
+
+        # State of every update sent to the spectators and recorded (STATE_STREAM_PORT, STATE_STREAM_RECORD)
+        self.state_stream = state_stream.current_publisher()
+
         # Starting level when loading the game
         self.level = 1
 
         # Load sounds
-        self.collect_coin_sound = arcade.load_sound(":resources:sounds/coin1.wav")
-        self.jump_sound = arcade.load_sound(":resources:sounds/jump1.wav")
-        self.game_over = arcade.load_sound(":resources:sounds/gameover1.wav")
-        self.gun_sound = arcade.sound.load_sound(":resources:sounds/laser1.wav")
-        self.hit_sound = arcade.sound.load_sound(":resources:sounds/explosion2.wav")
+        self.collect_coin_sound = assets.load_sound(":resources:sounds/coin1.wav")
+        self.jump_sound = assets.load_sound(":resources:sounds/jump1.wav")
+        self.game_over = assets.load_sound(":resources:sounds/gameover1.wav")
+        self.gun_sound = assets.load_sound(":resources:sounds/laser1.wav")
+        self.hit_sound = assets.load_sound(":resources:sounds/explosion2.wav")
 
         # Put a blue background
         arcade.set_background_color(arcade.csscolor.CORNFLOWER_BLUE)
 
         # Add timer
         self.total_time = 0.0
+
+        # Memory instrumentation (F1: level report, F2: start/stop allocation tracking)
+        self.allocations = memory_report.AllocationTracker()
+
+        # Simulation thread (THREADED_SIMULATION), the lock protects the game state from the input handlers
+        self.state_lock = threading.Lock()
+        self.simulation = None
+        self.snapshot_renderer = None
+
+        # Offscreen framebuffer the scene is drawn in (RENDER_SCALE, RENDER_TARGET_MS)
+        self.render_scaler = None
+        if RENDER_SCALE < 1 or RENDER_TARGET_MS:
+            target_time = RENDER_TARGET_MS / 1000 if RENDER_TARGET_MS else None
+            self.render_scaler = RenderScaler(self.ctx, (SCREEN_WIDTH, SCREEN_HEIGHT), RENDER_SCALE,
+                                              RENDER_SCALE_LINEAR, target_time)
+
+        # Time from each input to the first frame showing it (F3: histograms)
+        self.latency = InputLatency(flag=self.flag_input_lag)
+
+        # Frame rate of the window (THROTTLE, set by main()) and the view at the last update
+        self.throttle = None
+        self.last_view = (0, 0)
+
+        # Bullets and enemies are entities, their components are stored in dense arrays
+        self.world = ecs.World()
+        self.positions = self.world.add_store("position", {"x": 'd', "y": 'd'})
+        self.velocities = self.world.add_store("velocity", {"dx": 'd', "dy": 'd'})
+        self.lifetimes = self.world.add_store("lifetime", {"frames": 'i'})
+        self.colliders = self.world.add_store("collider", {"kind": 'i', "sprite": None})
+        self.enemy_ai = self.world.add_store("ai", {"sprite": None})
+        self.chasers = self.world.add_store("chase", {"speed": 'd'})
+        self.patrols = self.world.add_store("patrol", {"row": 'i', "left": 'd', "right": 'd', "speed": 'd'})
+        self.renders = self.world.add_store("render", {"sprite": None, "pool": None}, on_remove=self.release_sprite)
+
+        # Sprites of the bullets
+        self.bullet_pool = SpritePool(BULLET_IMAGE, SPRITE_LASER_SCALING)
+        self.enemy_bullet_pool = SpritePool(BULLET_IMAGE)
+
+        # on_update runs these systems in this order (F3: order and time of each system)
+        self.view_changed = False
+        self.scheduler = ecs.Scheduler(self.world, after_system=self.allocations.mark)
+        self.scheduler.add("physics", self.physics_system)
+        self.scheduler.add("explosions", self.explosion_system)
+        self.scheduler.add("navigation", self.navigation_system)
+        self.scheduler.add("patrol", self.patrol_system)
+        self.scheduler.add("enemy ai", self.enemy_ai_system)
+        self.scheduler.add("movement", self.movement_system)
+        self.scheduler.add("lifetime", self.lifetime_system)
+        self.scheduler.add("sprite sync", self.sprite_sync_system)
+        self.scheduler.add("contacts", self.contact_system)
+        self.scheduler.add("pickups", self.pickup_system)
+        self.scheduler.add("shots", self.shot_system)
+        self.scheduler.add("hazards", self.hazard_system)
+        self.scheduler.add("level", self.level_system)
+        self.scheduler.add("endless", self.endless_system)
+        self.scheduler.add("camera", self.camera_system)
     # =======================
 
     # Setup the game
     # ====================
-    def setup(self, level):
-        """ Set up the game here. Call this function to restart the game. """
+    def setup(self, level, endless_seed=None, map_name=None):
+        """
+        Set up the game here. Call this function to restart the game.
+        map_name: load this map instead of the one of the level (stress tests)
+        """
 
         # Used to keep track of our scrolling
         self.view_bottom = 0
@@ -212,22 +350,56 @@ class MyGame(arcade.Window):
         # Reset the number of life at the begining of every level
         self.life = 5
 
-        # Create the Sprite lists
-        self.player_list = arcade.SpriteList()
-        self.trampoline_list = arcade.SpriteList()
-        self.wall_list = arcade.SpriteList()
-        self.enemy_list = arcade.SpriteList()
-        self.coin_list = arcade.SpriteList()
-        self.foreground_list = arcade.SpriteList()
-        self.background_list = arcade.SpriteList()
-        self.bullet_list = arcade.SpriteList()
-        self.explosion_list = arcade.SpriteList()
-        self.bullet_enemy_list = arcade.SpriteList()
+        # Empty the Sprite lists in place, the last level is kept until an idle moment
+        self.sprite_lists.reset()
+        self.sprite_lists.retire(self.tile_stores, self.broad_phase, self.physics_engine, self.nav_grid,
+                                 self.flow_field, self.line_of_sight, self.endless, self.level_coins,
+                                 self.level_enemies)
+        self.player_list = self.sprite_lists.get("player_list")
+        self.explosions.clear()
+        self.world.clear()
         self.player_sprite = PlayerCharacter()
-        self.player_sprite.center_x = PLAYER_START_X
-        self.player_sprite.center_y = PLAYER_START_Y
         self.player_list.append(self.player_sprite)
 
+        # Past the last map, the level is generated around the player. A map given by name is always loaded.
+        if map_name is None and ENDLESS_MODE and self.level > MAP_LEVELS:
+            self.load_endless(endless_seed)
+        else:
+            self.load_map(map_name if map_name is not None else self.level_map_name(self.level))
+        self.player_sprite.center_x, self.player_sprite.center_y = self.start_position
+
+        # Layers the player and the bullets can touch
+        self.broad_phase = BroadPhase(COLLISION_MASKS)
+        self.broad_phase.add_layer("coins", self.coin_list)
+        self.broad_phase.add_layer("enemies", self.enemy_list, moving=True)
+        self.broad_phase.add_layer("walls", self.wall_body_list)
+        self.broad_phase.add_layer("hazards", self.dont_touch_list)
+        self.broad_phase.add_layer("trampolines", self.trampoline_list)
+        self.broad_phase.add_layer("player", self.player_list, moving=True)
+
+        # Create "physic engine"
+        self.physics_engine = arcade.PhysicsEnginePlatformer(self.player_sprite, self.wall_body_list, GRAVITY,
+                                                             self.ladder_list)
+
+        # Timers
+        self.total_time = 0.0
+        self.event(event_log.INFO, event_log.LEVEL, level,
+                   self.endless.generator.seed if self.endless is not None else 0)
+
+        # Hit boxes computed for this level are kept for the next runs
+        hit_boxes.save()
+        self.sprite_lists.level_ready()
+    # =======================
+
+    def level_map_name(self, level):
+        """ Tiled map of a level """
+        return f"map2_level_{level}.tmx"
+
+    def load_map(self, map_name):
+        """ Load the layers of a Tiled map """
+        self.endless = None
+        self.start_position = (PLAYER_START_X, PLAYER_START_Y)
+
         # Name of the layer from tiled
         platform_layer_name = "ground"
         coins_layer_name = "Coins" # items you can collect
@@ -238,74 +410,193 @@ class MyGame(arcade.Window):
         enemy_layer_name = "Enemies"
         ladder_layer_name = "Ladder"
 
-        # Map name
-        map_name = f"map2_level_{self.level}.tmx"
-
         # read in the tiled map
-        my_map = arcade.tilemap.read_tmx(str(map_name))
+        my_map = level_data.read_level(map_name)
 
         # calculate the right edge of my_map
-        self.end_of_map = my_map.map_size.width * GRID_PIXEL_SIZE
-
-        # Link the layer from tiled with our game
-        self.background_list = arcade.tilemap.process_layer(my_map, background_layer_name, TILE_SCALING)
-        self.foreground_list = arcade.tilemap.process_layer(my_map, foreground_layer_name, TILE_SCALING)
-        self.coin_list = arcade.tilemap.process_layer(my_map, coins_layer_name, TILE_SCALING, use_spatial_hash=True)
-        self.dont_touch_list = arcade.tilemap.process_layer(my_map, dont_touch_layer_name, TILE_SCALING, use_spatial_hash=True)
-        self.trampoline_list = arcade.tilemap.process_layer(my_map, trampoline_layer_name, TILE_SCALING, use_spatial_hash=True)
-        self.enemy_list = arcade.tilemap.process_layer(my_map, enemy_layer_name, TILE_SCALING)
-        self.ladder_list = arcade.tilemap.process_layer(my_map, ladder_layer_name, TILE_SCALING, use_spatial_hash=True)
-        self.wall_list = arcade.tilemap.process_layer(map_object=my_map,
-                                                      layer_name=platform_layer_name,
-                                                      scaling=TILE_SCALING,
-                                                      use_spatial_hash=True)
+        self.end_of_map = my_map.width * GRID_PIXEL_SIZE
+
+        # Static layers are kept as tile records, sprites are only made for the part of the map around the camera
+        wall_store = TileStore(my_map, platform_layer_name, TILE_SCALING,
+                               sprite_list=self.layer_list("wall_list", my_map, platform_layer_name))
+        background_store = TileStore(my_map, background_layer_name, TILE_SCALING,
+                                     sprite_list=self.layer_list("background_list", my_map, background_layer_name))
+        foreground_store = TileStore(my_map, foreground_layer_name, TILE_SCALING,
+                                     sprite_list=self.layer_list("foreground_list", my_map, foreground_layer_name))
+        dont_touch_store = TileStore(my_map, dont_touch_layer_name, TILE_SCALING,
+                                     sprite_list=self.layer_list("dont_touch_list", my_map, dont_touch_layer_name,
+                                                                 use_spatial_hash=True))
+        trampoline_store = TileStore(my_map, trampoline_layer_name, TILE_SCALING,
+                                     sprite_list=self.layer_list("trampoline_list", my_map, trampoline_layer_name,
+                                                                 use_spatial_hash=True))
+        ladder_store = TileStore(my_map, ladder_layer_name, TILE_SCALING,
+                                 sprite_list=self.layer_list("ladder_list", my_map, ladder_layer_name,
+                                                             use_spatial_hash=True))
+        self.tile_stores = [wall_store, background_store, foreground_store, dont_touch_store, trampoline_store,
+                            ladder_store]
+        self.wall_list = wall_store.sprite_list
+
+        # The ground tiles are drawn one by one but collide as merged rectangles
+        self.wall_body_list, _ = build_collision_bodies(my_map, platform_layer_name, TILE_SCALING,
+                                                        self.sprite_lists.get("wall_body_list", use_spatial_hash=True))
+        self.background_list = background_store.sprite_list
+        self.foreground_list = foreground_store.sprite_list
+        self.dont_touch_list = dont_touch_store.sprite_list
+        self.trampoline_list = trampoline_store.sprite_list
+        self.ladder_list = ladder_store.sprite_list
+        self.stream_tiles()
+
+        # Where the enemies can go, and the way to the player
+        self.nav_grid = NavGrid(my_map, platform_layer_name, ladder_layer_name, TILE_SCALING)
+        self.flow_field = FlowField(self.nav_grid)
+        self.line_of_sight = LineOfSight(self.nav_grid)
+
+        # Coins and enemies can be hit anywhere on the map, they keep their sprites
+        self.coin_list = load_layer(my_map, coins_layer_name, TILE_SCALING,
+                                    sprite_list=self.layer_list("coin_list", my_map, coins_layer_name,
+                                                                use_spatial_hash=True))
+        self.enemy_list = load_layer(my_map, enemy_layer_name, TILE_SCALING,
+                                     sprite_list=self.layer_list("enemy_list", my_map, enemy_layer_name))
+        patrol_areas = read_patrol_areas(my_map, TILE_SCALING)
+        for enemy in self.enemy_list:
+            self.add_enemy(enemy, patrol_areas)
+        self.level_coins = list(self.coin_list)
+        self.level_enemies = list(self.enemy_list)
 
         # Set the background color
         if my_map.background_color:
             arcade.set_background_color(my_map.background_color)
 
-        # Create "physic engine"
-        self.physics_engine = arcade.PhysicsEnginePlatformer(self.player_sprite, self.wall_list, GRAVITY, self.ladder_list)
+    def layer_list(self, name, my_map, layer_name, use_spatial_hash=None):
+        """ Sprite list kept across the levels, with room for every tile of the layer """
+        layer = my_map.layer(layer_name)
+        return self.sprite_lists.get(name, use_spatial_hash, layer.count() if layer is not None else 0)
+
+    def load_endless(self, seed=None):
+        """ Endless mode: the chunks of the level are generated in front of the player and discarded behind him """
+        if seed is None:
+            seed = ENDLESS_SEED if ENDLESS_SEED is not None else random.randrange(2 ** 32)
+        self.tile_stores = []
+        self.level_coins = []
+        self.level_enemies = []
+        self.wall_list = self.sprite_lists.get("wall_list")
+        self.background_list = self.sprite_lists.get("background_list")
+        self.foreground_list = self.sprite_lists.get("foreground_list")
+        self.enemy_list = self.sprite_lists.get("enemy_list")
+        self.dont_touch_list = self.sprite_lists.get("dont_touch_list", use_spatial_hash=True)
+        self.trampoline_list = self.sprite_lists.get("trampoline_list", use_spatial_hash=True)
+        self.ladder_list = self.sprite_lists.get("ladder_list", use_spatial_hash=True)
+        self.coin_list = self.sprite_lists.get("coin_list", use_spatial_hash=True)
+        self.wall_body_list = self.sprite_lists.get("wall_body_list", use_spatial_hash=True)
+        layers = {endless.GROUND: self.wall_list, endless.COINS: self.coin_list,
+                  endless.BACKGROUND: self.background_list, endless.HAZARDS: self.dont_touch_list,
+                  endless.TRAMPOLINES: self.trampoline_list, endless.ENEMIES: self.enemy_list,
+                  endless.LADDERS: self.ladder_list}
+        self.endless = endless.EndlessLevel(seed, TILE_SCALING, layers, self.wall_body_list, self.add_enemy,
+                                           self.discard_enemy)
+        self.end_of_map = float("inf")
+        self.start_position = self.endless_start(0)
+        self.endless.update(self.start_position[0])
+        self.build_endless_navigation()
+
+    def endless_start(self, index):
+        """ Position of the player when he (re)starts in the chunk index """
+        x, ground = self.endless.start_point(index)
+        # The feet of the player on the ground
+        return x, ground + self.player_sprite.center_y - self.player_sprite.bottom + 1
+
+    def build_endless_navigation(self):
+        """ The navigation grid only covers the chunks in memory """
+        level, left = self.endless.window_level()
+        self.nav_grid = NavGrid(level, endless.GROUND, endless.LADDERS, TILE_SCALING, left)
+        self.flow_field = FlowField(self.nav_grid)
+        self.line_of_sight = LineOfSight(self.nav_grid)
+    # =======================
 
-        # Timers
-        self.total_time = 0.0
+    # Create the sprites of the tiles around the camera
+    # ====================
+    def stream_tiles(self):
+        for store in self.tile_stores:
+            if store.update(self.view_left, self.view_bottom, SCREEN_WIDTH, SCREEN_HEIGHT) and self.broad_phase:
+                # Streamed sprites were moved, the layers must be sorted again
+                self.broad_phase.invalidate()
     # =======================
 
     # Draw sprites and information
     # ================
+    def draw_layers(self):
+        """ Sprite lists in drawing order """
+        return [self.wall_list, self.background_list, self.foreground_list, self.dont_touch_list,
+                self.trampoline_list, self.player_list, self.enemy_list, self.ladder_list, self.coin_list,
+                self.explosions.sprite_list, self.bullet_pool.sprite_list, self.enemy_bullet_pool.sprite_list]
+
     def on_draw(self):
         """ Render the screen. """
 
+        self.latency.draw_start()
+
+        # Real time between two frames, only at the full frame rate (the idle rate is slow on purpose)
+        now = time.perf_counter()
+        active = self.throttle is None or self.throttle.state == ACTIVE
+        if active and self.last_draw_time is not None:
+            self.telemetry.frame(now - self.last_draw_time)
+        self.last_draw_time = now if active else None
+
         # Clear the screen to the background color
         arcade.start_render()
 
+        if self.simulation is not None:
+            self.draw_snapshot()
+            return
+
         # Draw our sprites
-        self.wall_list.draw()
-        self.background_list.draw()
-        self.foreground_list.draw()
-        self.dont_touch_list.draw()
-        self.trampoline_list.draw()
-        self.player_list.draw()
-        self.enemy_list.draw()
-        self.ladder_list.draw()
-        self.coin_list.draw()
-        self.explosion_list.draw()
-        self.bullet_list.draw()
-        self.bullet_enemy_list.draw()
+        self.draw_scaled(self.draw_scene)
+
+        # Draw Timer, Score and Life on the screen (don't put it before "draw our sprites")
+        self.draw_hud(self.total_time, self.score, self.life, self.view_left, self.view_bottom)
+
+    def draw_scene(self):
+        for sprite_list in self.draw_layers():
+            sprite_list.draw()
 
+    def draw_scaled(self, draw_scene):
+        """ Draw the scene, at the render scale when there is one """
+        if self.render_scaler is None:
+            draw_scene()
+        else:
+            self.render_scaler.draw(draw_scene, self.background_color)
+
+    def draw_snapshot(self):
+        """ Draw the last state published by the simulation thread """
+        snapshot = self.simulation.buffer.latest()
+        if snapshot is None:
+            return
+        arcade.set_viewport(snapshot.view_left,
+                            SCREEN_WIDTH + snapshot.view_left,
+                            snapshot.view_bottom,
+                            SCREEN_HEIGHT + snapshot.view_bottom)
+        self.snapshot_renderer.update(snapshot)
+        self.draw_scaled(self.snapshot_renderer.draw)
+        self.draw_hud(*snapshot.hud, snapshot.view_left, snapshot.view_bottom)
+
+    def draw_hud(self, total_time, score, life, view_left, view_bottom):
         # Calculates minutes and seconds
-        minutes = int(self.total_time) // 60
-        seconds = int(self.total_time) % 60
+        minutes = int(total_time) // 60
+        seconds = int(total_time) % 60
 
-        # Draw Timer, Score and Life on the screen (don't put it before "draw our sprites")
         time_text = f"Time: {minutes:02d}:{seconds:02d}"
-        arcade.draw_text(time_text, 10 + self.view_left, 30 + self.view_bottom, arcade.color.BLACK, 20)
+        arcade.draw_text(time_text, 10 + view_left, 30 + view_bottom, arcade.color.BLACK, 20)
 
-        score_text = f"Score: {self.score}"
-        arcade.draw_text(score_text, 10 + self.view_left, 10 + self.view_bottom, arcade.csscolor.WHITE, 18)
+        score_text = f"Score: {score}"
+        arcade.draw_text(score_text, 10 + view_left, 10 + view_bottom, arcade.csscolor.WHITE, 18)
 
-        life_text = f"Life: {self.life}"
-        arcade.draw_text(life_text, 10 + self.view_left, 600 + self.view_bottom, arcade.csscolor.WHITE, 18)
+        life_text = f"Life: {life}"
+        arcade.draw_text(life_text, 10 + view_left, 600 + view_bottom, arcade.csscolor.WHITE, 18)
+
+    def flip(self):
+        """ Show the frame drawn by on_draw """
+        super().flip()
+        self.latency.presented()
     # ================================================
 
     # When we use the mouse
@@ -313,97 +604,378 @@ class MyGame(arcade.Window):
     def on_mouse_press(self, x, y, button, modifiers):
         """ Called whenever the mouse button is clicked
         """
+        self.latency.input(event_log.MOUSE_PRESS)
 
-        # create a bullet with sound
-        bullet = arcade.Sprite(":resources:images/space_shooter/laserBlue01.png", SPRITE_LASER_SCALING)
-        arcade.sound.play_sound(self.gun_sound)
-
-        # POSITION THE BULLET
-        start_x = self.player_sprite.center_x
-        start_y = self.player_sprite.center_y
-        bullet.center_x = start_x
-        bullet.center_y = start_y
+        with self.state_lock:
+            self.wake()
+            # shoot with sound
+            arcade.sound.play_sound(self.gun_sound)
 
-        # mouse destination
-        dest_x = x + self.view_left
-        dest_y = y + self.view_bottom
+            # POSITION THE BULLET
+            start_x = self.player_sprite.center_x
+            start_y = self.player_sprite.center_y
 
-        # Compute the correct angle
-        x_diff = dest_x - start_x
-        y_diff = dest_y - start_y
-        angle = math.atan2(y_diff, x_diff)
+            # mouse destination
+            dest_x = x + self.view_left
+            dest_y = y + self.view_bottom
 
-        # Angle the bullet sprite
-        bullet.angle = math.degrees(angle)
-        print(f"Bullet angle: {bullet.angle: .2f}")
+            # Compute the correct angle
+            x_diff = dest_x - start_x
+            y_diff = dest_y - start_y
+            angle = math.atan2(y_diff, x_diff)
 
-        bullet.change_x = math.cos(angle)*BULLET_SPEED
-        bullet.change_y = math.sin(angle)*BULLET_SPEED
-
-        # Add the bullet to the appropriate list
-        self.bullet_list.append(bullet)
+            self.event(event_log.INFO, event_log.SHOT, start_x, start_y, math.degrees(angle))
+            self.spawn_bullet(PLAYER_SHOT, start_x, start_y, angle)
     # =====================================
 
     # When we use the keyboard
     # =====================================
     def on_key_press(self, key, modifiers):
         """Called whenever a key is pressed. """
+        self.latency.input(event_log.KEY_PRESS)
+
+        with self.state_lock:
+            self.wake()
+            # Add jump and climb up the ladder
+            if key == arcade.key.UP or key == arcade.key.W or key == arcade.key.SPACE:
+                if self.physics_engine.is_on_ladder():
+                    self.player_sprite.change_y = PLAYER_MOVEMENT_SPEED
+                elif self.physics_engine.can_jump():
+                    self.player_sprite.change_y = PLAYER_JUMP_SPEED
+                    arcade.play_sound(self.jump_sound)
+            # Climb dow the ladder
+            elif key == arcade.key.DOWN or key == arcade.key.S:
+                if self.physics_engine.is_on_ladder():
+                    self.player_sprite.change_y = -PLAYER_MOVEMENT_SPEED
+            # Add horizontal movement
+            elif key == arcade.key.LEFT or key == arcade.key.A:
+                self.player_sprite.change_x = -PLAYER_MOVEMENT_SPEED
+            elif key == arcade.key.RIGHT or key == arcade.key.D:
+                self.player_sprite.change_x = PLAYER_MOVEMENT_SPEED
+            # Memory reports
+            elif key == arcade.key.F1:
+                print(memory_report.format_report(memory_report.level_report(self)))
+            elif key == arcade.key.F2:
+                if not self.allocations.toggle():
+                    print(self.allocations.report())
+            elif key == arcade.key.F3:
+                print(self.scheduler.report())
+                if hit_boxes.current_cache() is not None:
+                    print(hit_boxes.current_cache().report())
+                if self.simulation is not None:
+                    print(self.simulation.report())
+                if self.render_scaler is not None:
+                    print(self.render_scaler.report())
+                print(self.sprite_lists.report())
+                print(self.gc_monitor.report())
+                print(self.latency.report())
+                print(self.state_stream.report())
+            # Quick save
+            elif key == arcade.key.F5 and QUICK_SAVE:
+                self.quick_save()
+            elif key == arcade.key.F9 and QUICK_SAVE:
+                self.resume()
+    # =========================================================
 
-        # Add jump and climb up the ladder
-        if key == arcade.key.UP or key == arcade.key.W or key == arcade.key.SPACE:
-            if self.physics_engine.is_on_ladder():
-                self.player_sprite.change_y = PLAYER_MOVEMENT_SPEED
-            elif self.physics_engine.can_jump():
-                self.player_sprite.change_y = PLAYER_JUMP_SPEED
-                arcade.play_sound(self.jump_sound)
-        # Climb dow the ladder
-        elif key == arcade.key.DOWN or key == arcade.key.S:
-            if self.physics_engine.is_on_ladder():
-                self.player_sprite.change_y = -PLAYER_MOVEMENT_SPEED
-        # Add horizontal movement
-        elif key == arcade.key.LEFT or key == arcade.key.A:
-            self.player_sprite.change_x = -PLAYER_MOVEMENT_SPEED
-        elif key == arcade.key.RIGHT or key == arcade.key.D:
-            self.player_sprite.change_x = PLAYER_MOVEMENT_SPEED
+    # Focus of the window
+    # =========================================================
+    def on_deactivate(self):
+        if self.throttle is not None:
+            self.throttle.pause()
+            self.last_draw_time = None
+        self.sprite_lists.release()
+
+    def on_hide(self):
+        if self.throttle is not None:
+            self.throttle.pause()
+            self.last_draw_time = None
+
+    def on_activate(self):
+        self.wake()
+
+    def on_show(self):
+        self.wake()
+
+    def wake(self):
+        """ Back to the full frame rate """
+        if self.throttle is not None:
+            self.throttle.wake()
+
+    def on_close(self):
+        """ Save the game before the window closes """
+        if self.simulation is not None:
+            # No update may run while the game is saved and the logs are closed
+            self.simulation.stop()
+            self.simulation.join()
+        if QUICK_SAVE:
+            with self.state_lock:
+                self.quick_save()
+            self.save_writer.stop()
+        self.events.close()
+        self.telemetry.close()
+        super().on_close()
     # =========================================================
 
     # When we release the keyboard
     # =========================================================
     def on_key_release(self, key, modifiers):
         """Called when the user releases a key. """
-        if key == arcade.key.LEFT or key == arcade.key.A:
-            self.player_sprite.change_x = 0
-        elif key == arcade.key.RIGHT or key == arcade.key.D:
-            self.player_sprite.change_x = 0
-        elif key == arcade.key.UP or key == arcade.key.W:
-            if self.physics_engine.is_on_ladder():
-                self.player_sprite.change_y = 0
-        elif key == arcade.key.DOWN or key == arcade.key.S:
-            if self.physics_engine.is_on_ladder():
-                self.player_sprite.change_y = 0
+        self.latency.input(event_log.KEY_RELEASE)
+        with self.state_lock:
+            self.wake()
+            if key == arcade.key.LEFT or key == arcade.key.A:
+                self.player_sprite.change_x = 0
+            elif key == arcade.key.RIGHT or key == arcade.key.D:
+                self.player_sprite.change_x = 0
+            elif key == arcade.key.UP or key == arcade.key.W:
+                if self.physics_engine.is_on_ladder():
+                    self.player_sprite.change_y = 0
+            elif key == arcade.key.DOWN or key == arcade.key.S:
+                if self.physics_engine.is_on_ladder():
+                    self.player_sprite.change_y = 0
+    # =========================================
+
+    # Entities
+    # =========================================
+    def spawn_bullet(self, kind, x, y, angle):
+        """ Create a bullet entity going in direction angle (radians) """
+        pool = self.bullet_pool if kind == PLAYER_SHOT else self.enemy_bullet_pool
+        sprite = pool.acquire(x, y, math.degrees(angle))
+        return self.world.create(position={"x": x, "y": y},
+                                 velocity={"dx": math.cos(angle) * BULLET_SPEED,
+                                           "dy": math.sin(angle) * BULLET_SPEED},
+                                 lifetime={"frames": BULLET_LIFETIME},
+                                 collider={"kind": kind, "sprite": sprite},
+                                 render={"sprite": sprite, "pool": pool})
+
+    def add_enemy(self, enemy, patrol_areas):
+        """ Create the entity of an enemy sprite """
+        enemy.properties["entity"] = self.world.create(position={"x": enemy.center_x, "y": enemy.center_y},
+                                                       ai={"sprite": enemy},
+                                                       chase={"speed": ENEMY_CHASE_SPEED},
+                                                       patrol=self.make_patrol(enemy, patrol_areas),
+                                                       render={"sprite": enemy, "pool": None})
+
+    def discard_enemy(self, enemy):
+        """ Destroy the entity of an enemy (its sprite goes with it) """
+        self.world.destroy(enemy.properties["entity"])
+
+    def make_patrol(self, enemy, patrol_areas):
+        """ Patrol component of an enemy: from a Patrol rectangle of the map around it, or from its platform """
+        for left, bottom, right, top, properties in patrol_areas:
+            if left <= enemy.center_x <= right and bottom <= enemy.center_y <= top:
+                # Row -1: the segment comes from the map and is never recomputed
+                left = min(left + enemy.width / 2, enemy.center_x)
+                right = max(right - enemy.width / 2, enemy.center_x)
+                return {"row": -1, "left": left, "right": right,
+                        "speed": properties.get("speed", ENEMY_PATROL_SPEED)}
+        row, left, right = patrol_segment(self.nav_grid, enemy.center_x, enemy.center_y)
+        return {"row": row, "left": left, "right": right, "speed": ENEMY_PATROL_SPEED}
+
+    def release_sprite(self, entity, components):
+        """ Called when the render component of an entity is removed """
+        sprite = components["sprite"]
+        if components["pool"] is not None:
+            components["pool"].release(sprite)
+        elif sprite.sprite_lists:
+            sprite.remove_from_sprite_lists()
+
+    def player_dies(self, cause):
+        """ Send the player back to the start, lose 3 points (no negative value) and a life """
+        self.deaths += 1
+        self.event(event_log.INFO, event_log.DEATH, self.player_sprite.center_x, self.player_sprite.center_y, cause)
+        self.player_sprite.center_x, self.player_sprite.center_y = self.start_position
+
+        # Set the camera to the start
+        self.view_left = int(self.start_position[0] - PLAYER_START_X)
+        self.view_bottom = 0
+        self.view_changed = True
+        arcade.play_sound(self.game_over)
+
+        # The contacts found before the player moved are no longer true
+        self.contacts.discard(PLAYER_KEY)
+
+        if self.score > 2:
+            self.score -= 3
+        else: self.score = 0
+
+        if self.life > 1:
+            self.life -= 1
+        else: self.life = 0
+    # =========================================
+
+    # Events
+    # =========================================
+    def event(self, level, kind, x=0.0, y=0.0, value=0.0):
+        """ Record an event of the game in the log and in the statistics of the session (see event_log.py) """
+        self.events.emit(level, kind, x, y, value)
+        self.telemetry.emit(level, kind, x, y, value)
+
+    def flag_input_lag(self, kind, latency, phase, phase_time):
+        """ An input reached the screen late because of a phase longer than a frame (called after a flip) """
+        with self.state_lock:
+            self.event(event_log.WARNING, event_log.INPUT_LAG, kind, latency * 1000, phase)
+    # =========================================
+
+    # Quick save
+    # =========================================
+    def quick_save(self):
+        """ Save the game, the file is written in the background """
+        if self.save_writer is None or not self.save_writer.is_alive():
+            self.save_writer = quick_save.SaveWriter(QUICK_SAVE)
+            self.save_writer.start()
+        self.save_writer.write(quick_save.encode(quick_save.capture(self)))
+        self.event(event_log.INFO, event_log.SAVE, self.level)
+
+    def resume(self):
+        """ Go back to the last quick save. Return False when there is none or it can't be used. """
+        if not os.path.exists(QUICK_SAVE):
+            return False
+        start = time.perf_counter()
+        try:
+            quick_save.apply(self, quick_save.load(QUICK_SAVE))
+        except (OSError, ValueError) as error:
+            print(f"Can't resume from {QUICK_SAVE}: {error}")
+            return False
+        milliseconds = (time.perf_counter() - start) * 1000
+        self.event(event_log.INFO, event_log.RESUME, self.level, milliseconds)
+        return True
     # =========================================
 
     # Game changing
     # =========================================
     def on_update(self, delta_time):
         """ Movement and game logic """
+        if self.simulation is not None:
+            return
+        if self.throttle is None:
+            self.simulate(delta_time)
+            return
+        for step in self.throttle.steps(delta_time):
+            self.simulate(step)
+        self.throttle.check(self.is_static(), delta_time)
+        # Nothing moves: time to drop what the last level left
+        if self.throttle.state != ACTIVE:
+            self.sprite_lists.release()
+
+    def is_static(self):
+        """ True when nothing moves on the screen: no bullet, explosion or visible enemy, the player and view still """
+        view = (self.view_left, self.view_bottom)
+        view_moved = view != self.last_view
+        self.last_view = view
+        if view_moved or self.player_sprite.change_x or self.player_sprite.change_y:
+            return False
+        if len(self.colliders) or len(self.explosions):
+            return False
+        left, bottom = view
+        right = left + SCREEN_WIDTH
+        top = bottom + SCREEN_HEIGHT
+        for enemy in self.enemy_list:
+            if enemy.right > left and enemy.left < right and enemy.top > bottom and enemy.bottom < top:
+                return False
+        return True
+
+    def start_simulation_thread(self):
+        """ From now on the game logic runs on its own thread at SIMULATION_RATE """
+        self.simulation = SimulationThread(self, SIMULATION_RATE, SCREEN_WIDTH, SCREEN_HEIGHT)
+        self.snapshot_renderer = SnapshotRenderer(self.simulation.textures)
+        self.simulation.start()
+
+    def simulate(self, delta_time):
+        """ One update of the game """
 
         # update time
         self.total_time += delta_time
+        self.telemetry.tick(delta_time)
+        self.allocations.begin()
+        self.latency.tick_start()
 
+        # Run every system in order
+        self.scheduler.run(delta_time)
+        self.latency.tick_end()
+        self.state_stream.publish(self)
+
+    def physics_system(self, delta_time):
         # Move the player with the physics engine
         self.physics_engine.update()
-        self.explosion_list.update()
-        self.frame_count +=1
 
-        for enemy in self.enemy_list:
-            # Position to start at the enemy current location
-            start_xx = enemy.center_x
-            start_yy = enemy.center_y
+    def explosion_system(self, delta_time):
+        self.explosions.update()
+        self.frame_count += 1
 
-            # Get the destination location for the bullet
-            dest_xx = self.player_sprite.center_x
-            dest_yy = self.player_sprite.center_y
+    def navigation_system(self, delta_time):
+        """ Enemies close to the player follow the flow field toward him """
+        if ENEMY_CHASE_CELLS <= 0:
+            return
+        self.flow_field.update(self.player_sprite.center_x, self.player_sprite.bottom + 1)
+
+        position_index = self.positions.index
+        xs = self.positions.columns["x"]
+        ys = self.positions.columns["y"]
+        for entity, speed in zip(self.chasers.entities, self.chasers.columns["speed"]):
+            slot = position_index[entity]
+            next_cell, distance = self.flow_field.step(xs[slot], ys[slot])
+            if next_cell < 0 or distance > ENEMY_CHASE_CELLS:
+                continue
+
+            # Go straight to the center of the next cell
+            target_x, target_y = self.nav_grid.cell_center(next_cell)
+            x_diff = target_x - xs[slot]
+            y_diff = target_y - ys[slot]
+            length = math.hypot(x_diff, y_diff)
+            if length <= speed:
+                xs[slot] = target_x
+                ys[slot] = target_y
+            else:
+                xs[slot] += x_diff / length * speed
+                ys[slot] += y_diff / length * speed
+
+    def patrol_system(self, delta_time):
+        """ Enemies that aren't chasing the player go back and forth on their patrol segment """
+        position_index = self.positions.index
+        xs = self.positions.columns["x"]
+        ys = self.positions.columns["y"]
+        rows = self.patrols.columns["row"]
+        lefts = self.patrols.columns["left"]
+        rights = self.patrols.columns["right"]
+        speeds = self.patrols.columns["speed"]
+        for i, entity in enumerate(self.patrols.entities):
+            slot = position_index[entity]
+            x = xs[slot]
+            if ENEMY_CHASE_CELLS > 0 and self.flow_field.step(x, ys[slot])[1] <= ENEMY_CHASE_CELLS:
+                continue
+
+            # A chase can leave the enemy on another platform
+            if rows[i] >= 0 and self.nav_grid.cell_at(x, ys[slot]) // self.nav_grid.width != rows[i]:
+                rows[i], lefts[i], rights[i] = patrol_segment(self.nav_grid, x, ys[slot])
+
+            # Turn around at the ends of the segment
+            x += speeds[i]
+            if x > rights[i]:
+                x = rights[i]
+                speeds[i] = -abs(speeds[i])
+            elif x < lefts[i]:
+                x = lefts[i]
+                speeds[i] = abs(speeds[i])
+            xs[slot] = x
+
+    def enemy_ai_system(self, delta_time):
+        """ Enemies face the player and shoot when he is close """
+        sprites = self.enemy_ai.columns["sprite"]
+        position_index = self.positions.index
+        xs = self.positions.columns["x"]
+        ys = self.positions.columns["y"]
+        dest_xx = self.player_sprite.center_x
+        dest_yy = self.player_sprite.center_y
+        shoot = self.frame_count % ENEMY_FIRE_RATE == 0
+        candidates = []
+        angles = {}
+
+        for i, entity in enumerate(self.enemy_ai.entities):
+            # Position to start at the enemy current location
+            slot = position_index[entity]
+            start_xx = xs[slot]
+            start_yy = ys[slot]
 
             # Math to calculate how to get bullet to the destination
             xx_diff = dest_xx - start_xx
@@ -411,161 +983,129 @@ class MyGame(arcade.Window):
             angle = math.atan2(yy_diff, xx_diff)
 
             # Set the enemy to the face of the player
-            enemy.angle = math.degrees(angle) - 180
-
-            # Shoot every 90 frames changes and only if close to the player
-            if abs(xx_diff) < 600 and abs(yy_diff) < 450:
-                if self.frame_count % 90 == 0:
-                    bullet_enemy = arcade.Sprite(":resources:images/space_shooter/laserBlue01.png")
-                    bullet_enemy.center_x = start_xx
-                    bullet_enemy.center_y = start_yy
-
-                    # Angle the bullet sprite
-                    bullet_enemy.angle = math.degrees(angle)
-
-                    # Take into account the angle, calculate our change_x and y
-                    bullet_enemy.change_x = math.cos(angle) * BULLET_SPEED
-                    bullet_enemy.change_y = math.sin(angle) * BULLET_SPEED
-
-                    self.bullet_enemy_list.append(bullet_enemy)
-
-        # See if we reach a coin
-        coin_hit_list = arcade.check_for_collision_with_list(self.player_sprite,
-                                                             self.coin_list)
-
-        # Loop through each coin we hit (if any) and remove it
-        for coin in coin_hit_list:
+            sprites[i].angle = math.degrees(angle) - 180
+
+            # Shoot every 90 frames and only if close to the player
+            if shoot and abs(xx_diff) < ENEMY_RANGE_X and abs(yy_diff) < ENEMY_RANGE_Y:
+                candidates.append((entity, start_xx, start_yy))
+                angles[entity] = angle
+
+        # and only if there is no wall between the enemy and the player
+        if candidates:
+            for entity in self.line_of_sight.visible(candidates, dest_xx, dest_yy):
+                slot = position_index[entity]
+                self.spawn_bullet(ENEMY_SHOT, xs[slot], ys[slot], angles[entity])
+                self.event(event_log.DEBUG, event_log.ENEMY_SHOT, xs[slot], ys[slot], math.degrees(angles[entity]))
+
+    def contact_system(self, delta_time):
+        """ Find every contact of the player and of the bullets at once """
+        colliders = [(PLAYER_KEY, PLAYER_BODY, self.player_sprite)]
+        colliders.extend(zip(self.colliders.entities, self.colliders.columns["kind"], self.colliders.columns["sprite"]))
+        self.contacts = self.broad_phase.collide(colliders)
+
+    def pickup_system(self, delta_time):
+        # Loop through each coin we reach (if any) and remove it
+        for coin in self.contacts.of(PLAYER_KEY, "coins"):
             coin.remove_from_sprite_lists()
             arcade.play_sound(self.collect_coin_sound)
             # Increase the score
             self.score += 1
-
-        # Bullet
-        self.bullet_list.update()
-
-        for bullet in self.bullet_enemy_list:
-            hit_wall_enemy = arcade.check_for_collision_with_list(bullet, self.wall_list)
-            if len(hit_wall_enemy) > 0:
-                arcade.play_sound(self.gun_sound)
-                bullet.remove_from_sprite_lists()
-
-        for bullet in self.bullet_list:
-            hit_list = arcade.check_for_collision_with_list(bullet, self.coin_list)
-            hit_enemy = arcade.check_for_collision_with_list(bullet, self.enemy_list)
-            hit_wall = arcade.check_for_collision_with_list(bullet, self.wall_list)
+            self.event(event_log.INFO, event_log.PICKUP, coin.center_x, coin.center_y, self.score)
+
+    def movement_system(self, delta_time):
+        """ Move every entity that has a velocity """
+        position_index = self.positions.index
+        xs = self.positions.columns["x"]
+        ys = self.positions.columns["y"]
+        dxs = self.velocities.columns["dx"]
+        dys = self.velocities.columns["dy"]
+        for i, entity in enumerate(self.velocities.entities):
+            slot = position_index[entity]
+            xs[slot] += dxs[i]
+            ys[slot] += dys[i]
+
+    def lifetime_system(self, delta_time):
+        """ Destroy the entities whose time is over """
+        frames = self.lifetimes.columns["frames"]
+        for i, entity in enumerate(self.lifetimes.entities):
+            frames[i] -= 1
+            if frames[i] <= 0:
+                self.world.destroy(entity)
+
+    def sprite_sync_system(self, delta_time):
+        """ Copy the positions of the entities to their sprites """
+        position_index = self.positions.index
+        xs = self.positions.columns["x"]
+        ys = self.positions.columns["y"]
+        for entity, sprite in zip(self.renders.entities, self.renders.columns["sprite"]):
+            slot = position_index[entity]
+            sprite.position = (xs[slot], ys[slot])
+
+    def shot_system(self, delta_time):
+        """ Bullets against walls, coins, enemies and the player """
+        for entity, kind, sprite in zip(self.colliders.entities, self.colliders.columns["kind"],
+                                        self.colliders.columns["sprite"]):
+            if kind == ENEMY_SHOT:
+                if self.contacts.of(entity, "walls"):
+                    arcade.play_sound(self.gun_sound)
+                    self.world.destroy(entity)
+
+                # Kill the player if he is touched by an enemy bullet
+                elif self.contacts.of(entity, "player"):
+                    arcade.play_sound(self.gun_sound)
+                    self.world.destroy(entity)
+                    self.player_dies(event_log.ENEMY_BULLET)
+                continue
+
+            # Coins and enemies already removed this update (by the player or another bullet) don't count
+            hit_list = [coin for coin in self.contacts.of(entity, "coins") if coin.sprite_lists]
+            hit_enemy = [enemy for enemy in self.contacts.of(entity, "enemies") if enemy.sprite_lists]
+            hit_wall = self.contacts.of(entity, "walls")
 
             # Collision with the wall for player bullet
-            if len(hit_wall) > 0:
-                arcade.play_sound(self.gun_sound)
-                bullet.remove_from_sprite_lists()
-
-            if len(hit_list) > 0:
+            if len(hit_wall) > 0 or len(hit_list) > 0:
                 arcade.play_sound(self.gun_sound)
-                bullet.remove_from_sprite_lists()
+                self.world.destroy(entity)
 
             for coin in hit_list:
                 coin.remove_from_sprite_lists()
                 arcade.play_sound(self.collect_coin_sound)
                 self.score += 1
+                self.event(event_log.INFO, event_log.PICKUP, coin.center_x, coin.center_y, self.score)
 
             if len(hit_enemy) > 0:
-                # Make an explosion when the enemy is destroyed
-                explosion = Explosion(self.explosion_texture_list)
-                # Move it to the location of the enemy
-                explosion.center_x = hit_enemy[0].center_x
-                explosion.center_y = hit_enemy[0].center_y
-                # Call update
-                explosion.update()
-                self.explosion_list.append(explosion)
+                # Make an explosion at the location of the destroyed enemy
+                self.explosions.emit(hit_enemy[0].center_x, hit_enemy[0].center_y)
 
                 arcade.play_sound(self.gun_sound)
-                bullet.remove_from_sprite_lists()
+                self.world.destroy(entity)
 
             for enemy in hit_enemy:
                 arcade.sound.play_sound(self.hit_sound)
                 enemy.remove_from_sprite_lists()
+                self.world.destroy(enemy.properties["entity"])
+                self.event(event_log.INFO, event_log.KILL, enemy.center_x, enemy.center_y)
 
             # if the bullet flies off screen, remove it
-            if bullet.bottom > self.width+self.view_bottom or bullet.top <0 or bullet.right <0 or bullet.left > self.width+self.view_left:
-                bullet.remove_from_sprite_lists()
-
-        # Manage Scrolling
-        # Track if we need to change the viewport
-        changed = False
+            if sprite.bottom > self.width+self.view_bottom or sprite.top <0 or sprite.right <0 or sprite.left > self.width+self.view_left:
+                self.world.destroy(entity)
 
+    def hazard_system(self, delta_time):
         # Kill the player if he falls out of the map
         if self.player_sprite.center_y < -100:
-            self.player_sprite.center_x = PLAYER_START_X
-            self.player_sprite.center_y = PLAYER_START_Y
-            # set the camera to the start
-            self.view_left = 0
-            self.view_bottom = 0
-            changed = True
-            arcade.play_sound(self.game_over)
-
-            # Lose 3 points if you die (no negative value)
-            if self.score > 2:
-                self.score -= 3
-            else: self.score = 0
-
-            if self.life > 1:
-                self.life -= 1
-            else: self.life = 0
+            self.player_dies(event_log.FALL)
 
         # Kill the player if he touches something dangerous
-        if arcade.check_for_collision_with_list(self.player_sprite, self.dont_touch_list):
+        if self.contacts.of(PLAYER_KEY, "hazards"):
             self.player_sprite.change_x = 0
             self.player_sprite.change_y = 0
-            self.player_sprite.center_x = PLAYER_START_X
-            self.player_sprite.center_y = PLAYER_START_Y
-
-            # Set the camera to the start
-            self.view_left = 0
-            self.view_bottom = 0
-            changed = True
-            arcade.play_sound(self.game_over)
-
-            if self.score > 2:
-                self.score -= 3
-            else: self.score = 0
-
-            if self.life > 1:
-                self.life -= 1
-            else: self.life = 0
+            self.player_dies(event_log.HAZARD)
 
-        if arcade.check_for_collision_with_list(self.player_sprite, self.trampoline_list):
+        if self.contacts.of(PLAYER_KEY, "trampolines"):
             self.player_sprite.change_x = 0
             self.player_sprite.change_y = 20
 
-        # Kill the player if he is touched by an enemy bullet
-        self.bullet_enemy_list.update()
-        for bullet_enemy in self.bullet_enemy_list:
-
-            hit_enemy_player = arcade.check_for_collision_with_list(bullet_enemy, self.player_list)
-
-            if len(hit_enemy_player) > 0:
-                arcade.play_sound(self.gun_sound)
-                bullet_enemy.remove_from_sprite_lists()
-
-                if bullet_enemy.bottom > self.width + self.view_bottom or bullet_enemy.top < 0 or bullet_enemy.right < 0 or bullet_enemy.left > self.width + self.view_left:
-                    bullet_enemy.remove_from_sprite_lists()
-
-                self.player_sprite.center_x = PLAYER_START_X
-                self.player_sprite.center_y = PLAYER_START_Y
-
-                # Set the camera to the start
-                self.view_left = 0
-                self.view_bottom = 0
-                changed = True
-                arcade.play_sound(self.game_over)
-                if self.score > 2:
-                    self.score -= 3
-                else: self.score = 0
-                if self.life > 1:
-                    self.life -= 1
-                else:
-                    self.life = 0
-
+    def level_system(self, delta_time):
         # If you reach a score of 10, consume it to give an extra life point
         if self.score == 10:
             self.life += 1
@@ -573,6 +1113,7 @@ class MyGame(arcade.Window):
 
         # Restart the game when you have no more life
         if self.life == 0:
+            self.event(event_log.INFO, event_log.GAME_OVER, self.level, self.deaths)
             # Restart to the first level
             self.level = 1
             # load the first level
@@ -580,7 +1121,7 @@ class MyGame(arcade.Window):
             # Set the camera to the start
             self.view_left = 0
             self.view_bottom = 0
-            changed = True
+            self.view_changed = True
 
         # See if the user got the end of the level
         if self.player_sprite.center_x >= self.end_of_map:
@@ -591,11 +1132,26 @@ class MyGame(arcade.Window):
             # Set the camera to the start
             self.view_left = 0
             self.view_bottom = 0
-            changed = True
+            self.view_changed = True
+
+    def endless_system(self, delta_time):
+        """ Endless mode: make the chunks in front of the player and discard those behind him """
+        if self.endless is None or not self.endless.update(self.player_sprite.center_x):
+            return
+        # The player restarts at the beginning of the chunk he reached
+        self.start_position = self.endless_start(self.endless.current)
+        self.build_endless_navigation()
+        self.broad_phase.invalidate()
 
+    def camera_system(self, delta_time):
         self.player_list.update()
         self.player_list.update_animation()
 
+        # Manage Scrolling
+        # Track if we need to change the viewport
+        changed = self.view_changed
+        self.view_changed = False
+
         # Scroll left
         left_boundary = self.view_left + LEFT_VIEWPORT_MARGIN
         if self.player_sprite.left < left_boundary:
@@ -625,19 +1181,36 @@ class MyGame(arcade.Window):
             self.view_bottom = int(self.view_bottom)
             self.view_left = int(self.view_left)
 
-            # Do the scrolling
-            arcade.set_viewport(self.view_left,
-                                SCREEN_WIDTH + self.view_left,
-                                self.view_bottom,
-                                SCREEN_HEIGHT + self.view_bottom)
+            # Do the scrolling (the simulation thread can't, on_draw uses the view of the snapshot)
+            if self.simulation is None:
+                arcade.set_viewport(self.view_left,
+                                    SCREEN_WIDTH + self.view_left,
+                                    self.view_bottom,
+                                    SCREEN_HEIGHT + self.view_bottom)
+            self.stream_tiles()
 # ======================================================================================================================
 
 # Main
 # ======================================================================================================================
 def main():
     """ Main method """
+    if os.path.exists(ASSET_BUNDLE):
+        bundle.use_bundle(ASSET_BUNDLE)
+    if HIT_BOX_CACHE:
+        hit_boxes.use_cache(HIT_BOX_CACHE)
+    if EVENT_LOG:
+        event_log.open_log(EVENT_LOG, EVENT_LOG_LEVEL)
+    if TELEMETRY_DATABASE:
+        telemetry.open_database(TELEMETRY_DATABASE)
+    if STATE_STREAM_PORT is not None or STATE_STREAM_RECORD:
+        state_stream.open_stream(STATE_STREAM_PORT, STATE_STREAM_RECORD)
     window = MyGame()
-    window.setup(window.level)
+    if THROTTLE:
+        window.throttle = FrameThrottle(window)
+    if not (QUICK_SAVE and window.resume()):
+        window.setup(window.level)
+    if THREADED_SIMULATION:
+        window.start_simulation_thread()
     arcade.run()
 
 if __name__ == "__main__":
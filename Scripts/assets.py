@@ -0,0 +1,79 @@
+"""
+Textures, sprites and sounds of the game, read from the asset bundle when one is in use (see bundle.py)
+
+Without a bundle (or for an asset that isn't in it) these are the usual arcade loaders.
+When a hit box cache is in use (see hit_boxes.py), the sprites get the hit boxes of their textures from it.
+"""
+import arcade
+import PIL.Image
+import pyglet
+
+import bundle
+import hit_boxes
+
+# Textures and sprites
+# ======================================================================================================================
+def load_texture(file_name, flipped_horizontally=False, flipped_vertically=False, flipped_diagonally=False):
+    """ Same as arcade.load_texture(file_name, flipped_...=...), textures are shared through its cache """
+    if bundle.current_bundle() is None or file_name not in bundle.current_bundle():
+        return arcade.load_texture(file_name, flipped_horizontally=flipped_horizontally,
+                                   flipped_vertically=flipped_vertically, flipped_diagonally=flipped_diagonally)
+
+    # Same cache name as arcade.load_texture, so the textures loaded either way are the same objects
+    cache_name = f"{file_name}-0-0-0-0-{flipped_horizontally}-{flipped_vertically}-{flipped_diagonally}-Simple"
+    cache = arcade.load_texture.texture_cache
+    if cache_name not in cache:
+        image = bundle.load_image(file_name)
+        # Same order as arcade
+        if flipped_diagonally:
+            image = image.transpose(PIL.Image.TRANSPOSE)
+        if flipped_horizontally:
+            image = image.transpose(PIL.Image.FLIP_LEFT_RIGHT)
+        if flipped_vertically:
+            image = image.transpose(PIL.Image.FLIP_TOP_BOTTOM)
+        cache[cache_name] = arcade.Texture(cache_name, image)
+    return cache[cache_name]
+
+
+def make_sprite(file_name, scale=1, flipped_horizontally=False, flipped_vertically=False, flipped_diagonally=False):
+    """ Same as arcade.Sprite(file_name, scale, flipped_...=...) """
+    flips = {"flipped_horizontally": flipped_horizontally, "flipped_vertically": flipped_vertically,
+             "flipped_diagonally": flipped_diagonally}
+    if hit_boxes.current_cache() is not None:
+        # Before the sprite is created: it reads the hit box of the texture (shared with arcade's cache)
+        hit_boxes.apply(load_texture(file_name, **flips))
+    if bundle.current_bundle() is None or file_name not in bundle.current_bundle():
+        return arcade.Sprite(file_name, scale, **flips)
+    sprite = arcade.Sprite(scale=scale)
+    sprite.texture = load_texture(file_name, **flips)
+    return sprite
+
+
+def load_spritesheet(file_name, sprite_width, sprite_height, columns, count):
+    """ Same as arcade.load_spritesheet """
+    if bundle.current_bundle() is None or file_name not in bundle.current_bundle():
+        return arcade.load_spritesheet(file_name, sprite_width, sprite_height, columns, count)
+    source_image = bundle.load_image(file_name)
+    texture_list = []
+    for sprite_no in range(count):
+        start_x = sprite_width * (sprite_no % columns)
+        start_y = sprite_height * (sprite_no // columns)
+        image = source_image.crop((start_x, start_y, start_x + sprite_width, start_y + sprite_height))
+        texture_list.append(arcade.Texture(f"{file_name}-{sprite_no}", image))
+    return texture_list
+# ======================================================================================================================
+
+# Sounds
+# ======================================================================================================================
+def load_sound(file_name):
+    """ Same as arcade.load_sound(file_name) """
+    if bundle.current_bundle() is None or file_name not in bundle.current_bundle():
+        return arcade.load_sound(file_name)
+
+    # arcade.Sound only takes a path, so build it around a source decoded from the bundle
+    sound = arcade.Sound.__new__(arcade.Sound)
+    sound.file_name = file_name
+    sound.source = pyglet.media.load(file_name, file=bundle.open_file(file_name), streaming=False)
+    sound.min_distance = 100000000
+    return sound
+# ======================================================================================================================
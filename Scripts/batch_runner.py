@@ -0,0 +1,194 @@
+"""
+Play many sessions of the levels without display, on several processes
+
+Each worker process runs the game logic headless (see headless.py) with a scripted or random input policy
+and reports the frames simulated per second, deaths, score, completion and the time of each system.
+The results are aggregated per level.
+
+Run it from the directory of the maps:
+    python batch_runner.py --levels 1 2 3 --sessions 100 --workers 8 --policy random --json results.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+import headless
+import hit_boxes
+import arcade
+
+# Constants
+# ======================================================================================================================
+DELTA_TIME = 1 / 60
+DEFAULT_FRAMES = 3600 # one minute of game per session
+# ======================================================================================================================
+
+# Input policies
+# ======================================================================================================================
+class RandomPolicy:
+    """ Presses random keys and shoots at random points of the screen """
+
+    def __init__(self, seed):
+        self.random = random.Random(seed)
+
+    def act(self, game, frame):
+        if frame % 30 == 0:
+            game.on_key_press(self.random.choice([arcade.key.RIGHT, arcade.key.LEFT, arcade.key.UP,
+                                                  arcade.key.RIGHT]), 0)
+        if frame % 37 == 0:
+            game.on_key_release(arcade.key.LEFT, 0)
+        if frame % 45 == 0:
+            game.on_mouse_press(self.random.randint(0, game.width), self.random.randint(0, game.height), 1, 0)
+
+
+class ScriptedPolicy:
+    """ Runs to the right, jumps regularly and shoots in front of the player """
+
+    def __init__(self, seed):
+        # The seed only shifts the rhythm, so the sessions are not all the same
+        self.offset = random.Random(seed).randint(0, 39)
+
+    def act(self, game, frame):
+        if frame == 0:
+            game.on_key_press(arcade.key.RIGHT, 0)
+        if (frame + self.offset) % 40 == 0:
+            game.on_key_press(arcade.key.UP, 0)
+        if (frame + self.offset) % 60 == 0:
+            game.on_mouse_press(game.width * 3 // 4, game.height // 2, 1, 0)
+
+
+POLICIES = {"random": RandomPolicy, "scripted": ScriptedPolicy}
+# ======================================================================================================================
+
+# Worker side
+# ======================================================================================================================
+def init_worker(maps_directory, quiet):
+    os.chdir(maps_directory)
+    if quiet:
+        # The game prints the seed of every endless level
+        sys.stdout = open(os.devnull, "w")
+    hit_boxes.use_cache(hit_boxes.CACHE_NAME)
+    headless.game_class()
+
+
+def play_session(task):
+    """ Play one session and return its statistics. task is (level, seed, frames, policy name). """
+    level, seed, frames, policy_name = task
+    policy = POLICIES[policy_name](seed)
+
+    start = time.perf_counter()
+    game = headless.make_game(level)
+    setup_time = time.perf_counter() - start
+    player = game.player_sprite
+
+    completed = False
+    game_over = False
+    frame = 0
+    start = time.perf_counter()
+    while frame < frames:
+        policy.act(game, frame)
+        game.on_update(DELTA_TIME)
+        frame += 1
+        if game.level != level or game.player_sprite is not player:
+            # setup() was called: the level is finished or the game restarted
+            completed = game.level == level + 1
+            game_over = not completed
+            break
+    seconds = time.perf_counter() - start
+
+    return {
+        "level": level,
+        "seed": seed,
+        "frames": frame,
+        "seconds": seconds,
+        "fps": frame / seconds if seconds else 0.0,
+        "setup_time": setup_time,
+        "deaths": game.deaths,
+        "score": game.score,
+        "completed": completed,
+        "game_over": game_over,
+        "phases": dict(game.scheduler.total_time),
+    }
+# ======================================================================================================================
+
+# Aggregate the results
+# ======================================================================================================================
+def aggregate(results, wall_time):
+    """ Statistics per level (and for the whole batch) """
+    levels = {}
+    for result in results:
+        levels.setdefault(result["level"], []).append(result)
+
+    summary = {"wall_time": wall_time, "sessions": len(results),
+               "frames": sum(result["frames"] for result in results), "levels": {}}
+    summary["fps"] = summary["frames"] / wall_time if wall_time else 0.0
+
+    for level, sessions in sorted(levels.items()):
+        count = len(sessions)
+        frames = sum(session["frames"] for session in sessions)
+        phases = {}
+        for session in sessions:
+            for name, seconds in session["phases"].items():
+                phases[name] = phases.get(name, 0.0) + seconds
+        summary["levels"][level] = {
+            "sessions": count,
+            "frames": frames,
+            "fps_per_worker": sum(session["fps"] for session in sessions) / count,
+            "setup_time": sum(session["setup_time"] for session in sessions) / count,
+            "deaths": sum(session["deaths"] for session in sessions) / count,
+            "score": sum(session["score"] for session in sessions) / count,
+            "completion_rate": sum(session["completed"] for session in sessions) / count,
+            "game_over_rate": sum(session["game_over"] for session in sessions) / count,
+            # Milliseconds per simulated frame
+            "phases": {name: seconds / max(frames, 1) * 1000 for name, seconds in phases.items()},
+        }
+    return summary
+
+
+def format_summary(summary, workers):
+    lines = [f"{summary['sessions']} sessions, {summary['frames']} frames in {summary['wall_time']:.1f} s "
+             f"on {workers} workers: {summary['fps']:.0f} frames/s in total"]
+    for level, stats in summary["levels"].items():
+        lines.append(f"Level {level}: {stats['sessions']} sessions, {stats['fps_per_worker']:.0f} frames/s per worker, "
+                     f"setup {stats['setup_time'] * 1000:.0f} ms")
+        lines.append(f"  completed {stats['completion_rate']:.0%}, game over {stats['game_over_rate']:.0%}, "
+                     f"{stats['deaths']:.2f} deaths, score {stats['score']:.2f}")
+        phases = sorted(stats["phases"].items(), key=lambda item: -item[1])
+        lines.append("  " + ", ".join(f"{name} {ms:.3f}" for name, ms in phases) + " (ms/frame)")
+    return "\n".join(lines)
+# ======================================================================================================================
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play sessions of the levels without display")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 2, 3, 4, 5, 6])
+    parser.add_argument("--sessions", type=int, default=10, help="sessions per level")
+    parser.add_argument("--frames", type=int, default=DEFAULT_FRAMES, help="maximum frames per session")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--policy", choices=sorted(POLICIES), default="random")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--maps", default=".", help="directory of the map2_level_N.tmx files")
+    parser.add_argument("--json", help="also write the sessions and the summary to this file")
+    parser.add_argument("--verbose", action="store_true", help="keep the output of the game")
+    args = parser.parse_args()
+
+    tasks = [(level, args.seed + session, args.frames, args.policy)
+             for level in args.levels for session in range(args.sessions)]
+
+    start = time.perf_counter()
+    with multiprocessing.Pool(args.workers, initializer=init_worker,
+                              initargs=(os.path.abspath(args.maps), not args.verbose)) as pool:
+        results = list(pool.imap_unordered(play_session, tasks))
+    summary = aggregate(results, time.perf_counter() - start)
+
+    print(format_summary(summary, args.workers))
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"summary": summary, "sessions": results}, file, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Broad-phase collision detection
+
+Once per update, every moving collider (player, bullets) is tested against the layers it can touch.
+Each layer is kept sorted by the left edge of its sprites (sweep and prune on the x axis), so a collider
+only looks at the sprites whose x range can overlap its own. Overlapping boxes are then confirmed with
+arcade's polygon test and returned as a list of contacts grouped by layer.
+"""
+import array
+import bisect
+import arcade
+
+# Bounding boxes
+# ======================================================================================================================
+def bounds(sprite):
+    """ (left, bottom, right, top) of the hit box of a sprite """
+    points = sprite.get_adjusted_hit_box()
+    xs = [point[0] for point in points]
+    ys = [point[1] for point in points]
+    return min(xs), min(ys), max(xs), max(ys)
+# ======================================================================================================================
+
+# Sorted layers
+# ======================================================================================================================
+class LayerIndex:
+    """
+    The sprites of one SpriteList sorted by their left edge.
+    A static layer is sorted again only when its size changes or invalidate() is called,
+    a moving layer (enemies, player) at every update.
+    """
+
+    def __init__(self, sprite_list, moving=False):
+        self.sprite_list = sprite_list
+        self.moving = moving
+        self.dirty = True
+        self.size = -1
+        self.lefts = array.array('d')
+        self.boxes = []
+        self.sprites = []
+        self.widest = 0.0
+
+    def invalidate(self):
+        self.dirty = True
+
+    def refresh(self):
+        """ Sort the sprites again if needed. Return True if it was done. """
+        if not (self.dirty or self.moving or len(self.sprite_list) != self.size):
+            return False
+        entries = sorted(((bounds(sprite), sprite) for sprite in self.sprite_list), key=lambda entry: entry[0][0])
+        self.boxes = [box for box, _ in entries]
+        self.sprites = [sprite for _, sprite in entries]
+        self.lefts = array.array('d', (box[0] for box in self.boxes))
+        self.widest = max((box[2] - box[0] for box in self.boxes), default=0.0)
+        self.size = len(self.sprite_list)
+        self.dirty = False
+        return True
+
+    def overlapping(self, left, bottom, right, top):
+        """ Sprites whose bounding box overlaps the box """
+        # Only the sprites starting between left - widest and right can reach the box
+        first = bisect.bisect_left(self.lefts, left - self.widest)
+        last = bisect.bisect_right(self.lefts, right)
+        for i in range(first, last):
+            box = self.boxes[i]
+            if box[2] >= left and box[1] <= top and box[3] >= bottom:
+                yield self.sprites[i]
+# ======================================================================================================================
+
+# Contacts
+# ======================================================================================================================
+class Contacts:
+    """ Contact pairs of one update: for each layer, a list of (collider key, sprite of the layer) """
+
+    def __init__(self):
+        self.pairs = {}
+
+    def __len__(self):
+        return sum(len(pairs) for pairs in self.pairs.values())
+
+    def add(self, layer_name, key, sprite):
+        self.pairs.setdefault(layer_name, []).append((key, sprite))
+
+    def layer(self, layer_name):
+        return self.pairs.get(layer_name, [])
+
+    def of(self, key, layer_name):
+        """ Sprites of a layer touched by the collider key """
+        return [sprite for other, sprite in self.pairs.get(layer_name, ()) if other == key]
+
+    def discard(self, key):
+        """ Forget the contacts of a collider (e.g. the player was sent back to the start) """
+        for layer_name, pairs in self.pairs.items():
+            self.pairs[layer_name] = [pair for pair in pairs if pair[0] != key]
+# ======================================================================================================================
+
+# Broad phase
+# ======================================================================================================================
+class BroadPhase:
+    """
+    masks maps a kind of collider to the names of the layers it collides with.
+    collide() takes the colliders of the update as (key, kind, sprite) and returns the Contacts.
+    """
+
+    def __init__(self, masks):
+        self.masks = masks
+        self.layers = {}
+        self.candidates = 0
+        self.sorts = 0
+
+    def add_layer(self, name, sprite_list, moving=False):
+        self.layers[name] = LayerIndex(sprite_list, moving)
+
+    def invalidate(self, name=None):
+        """ Sort a layer (or all of them) again at the next update, when sprites moved without changing its size """
+        for layer_name, layer in self.layers.items():
+            if name is None or layer_name == name:
+                layer.invalidate()
+
+    def collide(self, colliders):
+        contacts = Contacts()
+        self.candidates = 0
+
+        # Only the layers used by a collider of this update are sorted
+        used = set()
+        for _, kind, _ in colliders:
+            used.update(self.masks.get(kind, ()))
+        for name in used:
+            if self.layers[name].refresh():
+                self.sorts += 1
+
+        # Sweep the colliders from left to right
+        boxes = sorted(((bounds(sprite), key, kind, sprite) for key, kind, sprite in colliders),
+                       key=lambda entry: entry[0][0])
+        for box, key, kind, sprite in boxes:
+            for name in self.masks.get(kind, ()):
+                for other in self.layers[name].overlapping(*box):
+                    self.candidates += 1
+                    if other is not sprite and arcade.check_for_collision(sprite, other):
+                        contacts.add(name, key, other)
+        return contacts
+# ======================================================================================================================
@@ -0,0 +1,361 @@
+"""
+Packed asset bundle
+
+All the maps, tilesets, images and sounds used by the game are packed in one file with an index.
+At runtime the bundle is opened once and memory-mapped: reading an asset is a slice of the mapping
+(no copy, no open() per file). Files that are not in the bundle are still read from the disk.
+
+The index keeps the size and modification time of each file when it was packed, and the modification time of
+their directories. Opening the bundle compares the maps of the game directory and the other directories only
+(a handful of stat calls). When a directory has changed (a file saved by replacing it, added or removed), or
+always with CHECK_FILES, every file is compared. The files edited since the build are read from the disk, with
+a warning to build the bundle again.
+
+Run this file from the game directory (where the maps are):
+    python bundle.py build [assets.bundle]    pack the assets
+    python bundle.py bench [assets.bundle]    compare the loading time with the loose files
+"""
+import glob
+import io
+import json
+import mmap
+import os
+import struct
+import subprocess
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+# Constants
+# ======================================================================================================================
+BUNDLE_NAME = "assets.bundle"
+MAGIC = b"PLTBNDL2"
+
+# Magic, offset and size of the index (JSON at the end of the file)
+HEADER = struct.Struct("<8sQQ")
+
+# Start of each asset in the file
+ALIGNMENT = 16
+
+# Compare every packed file with the disk when the bundle is opened (one stat per file), to find the files edited
+# in place, which doesn't change their directory (development)
+CHECK_FILES = False
+
+# Assets of the arcade package used by the game
+GAME_RESOURCES = (
+    [":resources:images/animated_characters/female_adventurer/femaleAdventurer_idle.png"]
+    + [f":resources:images/animated_characters/female_adventurer/femaleAdventurer_walk{i}.png" for i in range(8)]
+    + [":resources:images/space_shooter/laserBlue01.png",
+       ":resources:images/spritesheets/explosion.png",
+       ":resources:sounds/coin1.wav",
+       ":resources:sounds/jump1.wav",
+       ":resources:sounds/gameover1.wav",
+       ":resources:sounds/laser1.wav",
+       ":resources:sounds/explosion2.wav"]
+)
+# ======================================================================================================================
+
+# Reading
+# ======================================================================================================================
+def asset_name(path):
+    """ Key of a file in the bundle: the normalized path, or the ':resources:' name as is """
+    path = str(path)
+    if path.startswith(":"):
+        return path
+    return os.path.normpath(path)
+
+
+class BundleReader(io.RawIOBase):
+    """ Read-only file object over a slice of the bundle, for the libraries that want a file """
+
+    def __init__(self, data):
+        self.data = data
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), len(self.data) - self.position)
+        buffer[:size] = self.data[self.position:self.position + size]
+        self.position += size
+        return size
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += len(self.data)
+        self.position = max(0, offset)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+
+def file_stamp(path):
+    """ [size, modification time (ns)] of a file on the disk """
+    status = os.stat(path)
+    return [status.st_size, status.st_mtime_ns]
+
+
+def is_stale(name, entry):
+    """ True when the file of an index entry (offset, size, file size, file time) is on the disk and differs """
+    if name.startswith(":"):
+        return False
+    try:
+        return entry[2:] != file_stamp(name)
+    except FileNotFoundError:
+        return False
+
+
+def asset_directories(names):
+    """
+    Directories of the assets, but the game directory: the game writes its saves and logs there, so the files
+    there (the maps) are compared one by one
+    """
+    return sorted({os.path.dirname(name) for name in names if not name.startswith(":")} - {""})
+
+
+def directory_stamps(directories):
+    """ {directory: modification time (ns), None if it is gone} """
+    stamps = {}
+    for directory in directories:
+        try:
+            stamps[directory] = os.stat(directory).st_mtime_ns
+        except FileNotFoundError:
+            stamps[directory] = None
+    return stamps
+
+
+class AssetBundle:
+    """ A bundle file opened with mmap. data(name) returns a memoryview on the asset (zero copy). """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        with open(file_name, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+        magic, index_offset, index_size = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{file_name} is not an asset bundle of this version, run python bundle.py build")
+        index = json.loads(bytes(self.view[index_offset:index_offset + index_size]))
+        self.index = index["assets"]
+
+        # The files changed on the disk since the build are read from the disk: the files of the game directory are
+        # compared one by one, the others only when their directory has changed
+        if CHECK_FILES or directory_stamps(index["directories"]) != index["directories"]:
+            names = self.index
+        else:
+            names = [name for name in self.index if not name.startswith(":") and not os.path.dirname(name)]
+        self.stale = sorted(name for name in names if is_stale(name, self.index[name]))
+        for name in self.stale:
+            del self.index[name]
+        if self.stale:
+            print(f"{file_name}: {len(self.stale)} assets changed since the build are read from the disk "
+                  f"({', '.join(self.stale[:3])}{', ...' if len(self.stale) > 3 else ''}), "
+                  f"run python bundle.py build")
+
+    def __contains__(self, name):
+        return asset_name(name) in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def data(self, name):
+        offset, size = self.index[asset_name(name)][:2]
+        return self.view[offset:offset + size]
+
+    def open(self, name):
+        return io.BufferedReader(BundleReader(self.data(name)))
+
+
+# The bundle used by the game (None: loose files)
+_bundle = None
+
+
+def use_bundle(file_name):
+    """ Read the assets from this bundle from now on """
+    global _bundle
+    _bundle = AssetBundle(file_name)
+    return _bundle
+
+
+def current_bundle():
+    return _bundle
+
+
+def exists(path):
+    """ True if the asset is in the bundle or on the disk """
+    return (_bundle is not None and path in _bundle) or os.path.exists(path)
+
+
+def open_file(path):
+    """ Binary file object of an asset, from the bundle if it is there """
+    if _bundle is not None and path in _bundle:
+        return _bundle.open(path)
+    return open(path, "rb")
+
+
+def load_image(path):
+    """ PIL image (RGBA) of an asset. ':resources:' names are resolved when the bundle doesn't have them. """
+    import PIL.Image
+    if (_bundle is None or path not in _bundle) and str(path).startswith(":resources:"):
+        import arcade
+        path = arcade.resources.resolve_resource_path(path)
+    with open_file(path) as file:
+        return PIL.Image.open(file).convert("RGBA")
+# ======================================================================================================================
+
+# Building
+# ======================================================================================================================
+def collect_assets(map_names):
+    """ {name: path on the disk} for the maps, their tilesets and images, and GAME_RESOURCES """
+    import level_data
+    assets = {}
+    for map_name in map_names:
+        assets[asset_name(map_name)] = map_name
+        directory = os.path.dirname(map_name)
+        for tileset in ET.parse(map_name).getroot().findall("tileset"):
+            if tileset.get("source"):
+                tsx_name = os.path.join(directory, tileset.get("source"))
+                assets[asset_name(tsx_name)] = tsx_name
+        for tile in level_data.read_level(map_name).tiles.values():
+            if os.path.exists(tile.source):
+                assets[asset_name(tile.source)] = tile.source
+
+    import arcade
+    for name in GAME_RESOURCES:
+        assets[name] = arcade.resources.resolve_resource_path(name)
+    return assets
+
+
+def build(file_name, assets):
+    """ Write the bundle. Return the number of assets and the size of the file. """
+    index = {}
+    with open(file_name, "wb") as bundle:
+        bundle.write(HEADER.pack(MAGIC, 0, 0))
+        for name, path in sorted(assets.items()):
+            bundle.write(b"\0" * (-bundle.tell() % ALIGNMENT))
+            with open(path, "rb") as file:
+                data = file.read()
+            index[name] = [bundle.tell(), len(data)] + ([] if name.startswith(":") else file_stamp(path))
+            bundle.write(data)
+
+        index_data = json.dumps({"assets": index, "directories": directory_stamps(asset_directories(index))},
+                                separators=(",", ":")).encode()
+        index_offset = bundle.tell()
+        bundle.write(index_data)
+        bundle.seek(0)
+        bundle.write(HEADER.pack(MAGIC, index_offset, len(index_data)))
+    return len(index), os.path.getsize(file_name)
+# ======================================================================================================================
+
+# Measure the loading time
+# ======================================================================================================================
+def load_everything(map_names):
+    """ What the game reads when it starts and goes through every level: maps, tile images, textures, sounds """
+    import headless
+    import assets
+    import level_data
+
+    for map_name in map_names:
+        level = level_data.read_level(map_name)
+        for tile in level.tiles.values():
+            if exists(tile.source):
+                assets.load_texture(tile.source)
+    for name in GAME_RESOURCES:
+        if name.endswith(".wav"):
+            assets.load_sound(name)
+        else:
+            assets.load_texture(name)
+
+
+def measure(bundle_name):
+    """ Load everything in this process, print the time, the number of files opened and of stat calls (JSON) """
+    # Import the modules first, only the assets are counted
+    import headless
+    import assets
+    import level_data
+
+    opened = []
+
+    def audit(event, args):
+        if event == "open":
+            opened.append(args[0])
+    sys.addaudithook(audit)
+
+    # stat has no audit event, count the calls through the os module (os.path.exists goes through it too)
+    stat_calls = []
+    os_stat = os.stat
+
+    def counted_stat(path, *args, **kwargs):
+        stat_calls.append(path)
+        return os_stat(path, *args, **kwargs)
+    os.stat = counted_stat
+
+    start = time.perf_counter()
+    if bundle_name:
+        use_bundle(bundle_name)
+    load_everything(sorted(glob.glob("*.tmx")))
+    seconds = time.perf_counter() - start
+    os.stat = os_stat
+    print(json.dumps({"seconds": seconds, "files_opened": len(opened), "stat_calls": len(stat_calls)}))
+
+
+def drop_page_cache():
+    """ Empty the page cache of the system (cold start). Needs root on Linux, return False if it can't. """
+    try:
+        os.sync()
+        with open("/proc/sys/vm/drop_caches", "w") as file:
+            file.write("3\n")
+        return True
+    except OSError:
+        return False
+
+
+def run_measure(bundle_name, cold):
+    if cold and not drop_page_cache():
+        return None
+    command = [sys.executable, os.path.abspath(__file__), "measure"] + ([bundle_name] if bundle_name else [])
+    output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def bench(bundle_name, repeat=3):
+    # Each run is a new process, so nothing is cached by arcade or by the imports
+    for label, name in (("loose files", None), ("bundle", bundle_name)):
+        for cold in (True, False):
+            runs = [run_measure(name, cold) for _ in range(repeat)]
+            kind = "cold" if cold else "warm"
+            if None in runs:
+                print(f"{label:<12} {kind}: not measured (dropping the page cache needs root)")
+                continue
+            best = min(run["seconds"] for run in runs)
+            print(f"{label:<12} {kind}: {best * 1000:8.1f} ms (best of {repeat}), "
+                  f"{runs[0]['files_opened']} files opened, {runs[0]['stat_calls']} stat calls")
+# ======================================================================================================================
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else "build"
+    bundle_name = sys.argv[2] if len(sys.argv) > 2 else BUNDLE_NAME
+    if command == "build":
+        import headless
+        count, size = build(bundle_name, collect_assets(sorted(glob.glob("*.tmx"))))
+        print(f"{bundle_name}: {count} assets, {size / 1024:.0f} KB")
+    elif command == "bench":
+        bench(bundle_name)
+    elif command == "measure":
+        # Through the imported module: the game modules use its bundle, not the one of __main__
+        import bundle
+        bundle.measure(sys.argv[2] if len(sys.argv) > 2 else None)
+    else:
+        print(__doc__)
+
+
+if __name__ == "__main__":
+    main()
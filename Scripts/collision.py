@@ -0,0 +1,169 @@
+"""
+Collision bodies for the solid layers
+
+Adjacent solid tiles of the ground layer are merged into the fewest axis-aligned rectangles
+(greedy meshing). The merged bodies are only used for collisions, the tiles are still drawn one by one.
+
+Run this file from the game directory to print the number of bodies before and after merging:
+    python collision.py [map.tmx ...]
+"""
+import sys
+import pyglet
+if __name__ == "__main__":
+    # The report doesn't open a window, so pyglet must not create its hidden one (works without a display)
+    pyglet.options['shadow_window'] = False
+import arcade
+
+import bundle
+import level_data
+from entities import make_tile_sprite, tile_position
+
+# Find the tiles that fill their whole cell
+# ======================================================================================================================
+_opaque_images = {}
+
+
+def is_full_tile(tile):
+    """ True if the tile fills its whole cell: no custom hit box and no transparent border """
+    if tile.hit_box is not None:
+        return False
+    if tile.source not in _opaque_images:
+        try:
+            image = bundle.load_image(tile.source)
+        except FileNotFoundError:
+            _opaque_images[tile.source] = False
+        else:
+            # The hit box of arcade's "Simple" algorithm is the full square when the alpha bounding box is
+            _opaque_images[tile.source] = image.getchannel('A').getbbox() == (0, 0, image.width, image.height)
+    return _opaque_images[tile.source]
+
+
+def solid_grid(level, layer_name):
+    """ bytearray of the layer (row 0 at the top), 1 where the cell is filled by a full tile """
+    layer = level.layer(layer_name)
+    solid = bytearray(level.width * level.height)
+    if layer is None:
+        return solid
+    for column, row, gid in layer.cells():
+        tile = level.tiles.get(gid)
+        if tile is not None and tile.width == level.tile_width and tile.height == level.tile_height \
+                and is_full_tile(tile):
+            solid[row * level.width + column] = 1
+    return solid
+# ======================================================================================================================
+
+# Greedy meshing
+# ======================================================================================================================
+def greedy_mesh(solid, width, height):
+    """
+    Cover the solid cells with as few rectangles as possible.
+    Each rectangle is grown to the right first, then down while the whole span is solid.
+    Returns a list of (column, row, columns, rows), row 0 being the top of the map.
+    """
+    used = bytearray(len(solid))
+    rectangles = []
+    for row in range(height):
+        for column in range(width):
+            index = row * width + column
+            if not solid[index] or used[index]:
+                continue
+
+            # Grow to the right
+            columns = 1
+            while column + columns < width and solid[index + columns] and not used[index + columns]:
+                columns += 1
+
+            # Grow down while the whole span is free
+            rows = 1
+            while row + rows < height:
+                start = (row + rows) * width + column
+                if all(solid[start + i] and not used[start + i] for i in range(columns)):
+                    rows += 1
+                else:
+                    break
+
+            for r in range(row, row + rows):
+                start = r * width + column
+                used[start:start + columns] = b"\x01" * columns
+            rectangles.append((column, row, columns, rows))
+    return rectangles
+# ======================================================================================================================
+
+# Build the bodies
+# ======================================================================================================================
+def make_box_body(left, bottom, width, height):
+    """ Invisible sprite with a rectangular hit box (no texture, never drawn) """
+    body = arcade.Sprite()
+    half_width = width / 2
+    half_height = height / 2
+    body.set_hit_box([[-half_width, -half_height], [half_width, -half_height],
+                      [half_width, half_height], [-half_width, half_height]])
+    # Without a texture the sprite has no size, so give the quick distance pre-check a radius
+    body.collision_radius = max(width, height)
+    body.position = (left + half_width, bottom + half_height)
+    return body
+
+
+def build_collision_bodies(level, layer_name, scaling, bodies=None):
+    """
+    Return (bodies, tile_count): a SpriteList with one box per merged rectangle of full tiles,
+    plus one sprite per remaining tile (slopes, half tiles, ...) with its own hit box.
+    The bodies go in the given (empty) list, or in a new one with a spatial hash.
+    """
+    if bodies is None:
+        bodies = arcade.SpriteList(use_spatial_hash=True)
+    layer = level.layer(layer_name)
+    if layer is None:
+        return bodies, 0
+
+    cell_width = level.tile_width * scaling
+    cell_height = level.tile_height * scaling
+    solid = solid_grid(level, layer_name)
+
+    for column, row, columns, rows in greedy_mesh(solid, level.width, level.height):
+        bottom = (level.height - row - rows) * cell_height
+        bodies.append(make_box_body(column * cell_width, bottom, columns * cell_width, rows * cell_height))
+
+    # Tiles that can't be merged keep their own body
+    tile_count = 0
+    for column, row, gid, flips in layer.cells_with_flips():
+        tile_count += 1
+        if solid[row * level.width + column]:
+            continue
+        tile = level.tiles.get(gid)
+        if tile is None:
+            continue
+        sprite = make_tile_sprite(tile, scaling, flips)
+        if sprite is not None:
+            sprite.position = tile_position(level, tile, column, row, scaling)
+            bodies.append(sprite)
+    return bodies, tile_count
+
+
+def count_bodies(level, layer_name):
+    """ (tiles, bodies after merging) without creating any sprite """
+    layer = level.layer(layer_name)
+    if layer is None:
+        return 0, 0
+    solid = solid_grid(level, layer_name)
+    tiles = 0
+    single = 0
+    for column, row, gid in layer.cells():
+        tiles += 1
+        tile = level.tiles.get(gid)
+        if not solid[row * level.width + column] and tile is not None and bundle.exists(tile.source):
+            single += 1
+    return tiles, len(greedy_mesh(solid, level.width, level.height)) + single
+# ======================================================================================================================
+
+
+def main():
+    """ Print the number of ground bodies before and after merging for each map """
+    maps = sys.argv[1:] or [f"map2_level_{level}.tmx" for level in range(1, 7)]
+    for map_name in maps:
+        tiles, bodies = count_bodies(level_data.read_level(map_name), "ground")
+        print(f"{map_name:<24} {tiles:>6} tiles -> {bodies:>5} bodies")
+
+
+if __name__ == "__main__":
+    main()
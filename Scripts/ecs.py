@@ -0,0 +1,164 @@
+"""
+Entity-component storage and system scheduling
+
+An entity is just an int. Each component type has its own ComponentStore: one dense array per field,
+kept packed (removing an entity moves the last one into its slot), so systems loop over plain arrays.
+"""
+import array
+import time
+
+# Components
+# ======================================================================================================================
+class ComponentStore:
+    """
+    Dense storage of one component type.
+    fields maps each field name to an array typecode ('f', 'i', ...) or None for a Python object column.
+    """
+
+    def __init__(self, name, fields, on_remove=None):
+        self.name = name
+        self.fields = fields
+        self.on_remove = on_remove
+        self.entities = array.array('i')
+        self.index = {}
+        self.columns = {}
+        for field, typecode in fields.items():
+            self.columns[field] = array.array(typecode) if typecode else []
+
+    def __len__(self):
+        return len(self.entities)
+
+    def __contains__(self, entity):
+        return entity in self.index
+
+    def add(self, entity, **values):
+        if entity in self.index:
+            raise ValueError(f"Entity {entity} already has a {self.name} component")
+        self.index[entity] = len(self.entities)
+        self.entities.append(entity)
+        for field, column in self.columns.items():
+            column.append(values[field])
+
+    def get(self, entity, field):
+        return self.columns[field][self.index[entity]]
+
+    def set(self, entity, field, value):
+        self.columns[field][self.index[entity]] = value
+
+    def remove(self, entity):
+        """ Remove the component of entity, the last one takes its place """
+        slot = self.index.pop(entity)
+        if self.on_remove is not None:
+            self.on_remove(entity, {field: column[slot] for field, column in self.columns.items()})
+        last = len(self.entities) - 1
+        if slot != last:
+            moved = self.entities[last]
+            self.entities[slot] = moved
+            self.index[moved] = slot
+            for column in self.columns.values():
+                column[slot] = column[last]
+        self.entities.pop()
+        for column in self.columns.values():
+            column.pop()
+# ======================================================================================================================
+
+# Entities
+# ======================================================================================================================
+class World:
+    """
+    All the entities and their components.
+    destroy() is deferred until flush(), so systems can destroy entities while looping over the arrays.
+    """
+
+    def __init__(self):
+        self.next_entity = 0
+        self.stores = {}
+        self.pending = set()
+
+    def add_store(self, name, fields, on_remove=None):
+        store = ComponentStore(name, fields, on_remove)
+        self.stores[name] = store
+        return store
+
+    def create(self, **components):
+        """ Create an entity, e.g. create(position={"x": 0, "y": 0}, velocity={...}) """
+        entity = self.next_entity
+        self.next_entity += 1
+        for name, values in components.items():
+            self.stores[name].add(entity, **values)
+        return entity
+
+    def destroy(self, entity):
+        self.pending.add(entity)
+
+    def is_alive(self, entity):
+        """ False once the entity has been destroyed (even before the next flush) """
+        return entity not in self.pending and any(entity in store for store in self.stores.values())
+
+    def flush(self):
+        """ Really remove the destroyed entities """
+        for entity in self.pending:
+            for store in self.stores.values():
+                if entity in store:
+                    store.remove(entity)
+        self.pending.clear()
+
+    def clear(self):
+        """ Destroy every entity (used when a level is loaded) """
+        for store in self.stores.values():
+            self.pending.update(store.entities)
+        self.flush()
+
+    def count(self):
+        """ Number of components in each store """
+        return {name: len(store) for name, store in self.stores.items()}
+# ======================================================================================================================
+
+# Systems
+# ======================================================================================================================
+class Scheduler:
+    """
+    Ordered list of systems run once per update.
+    The time spent in each system is kept so the order and the cost can be inspected (report()).
+    after_system(name) is called after each system (allocation tracking, ...).
+    """
+
+    def __init__(self, world, after_system=None):
+        self.world = world
+        self.after_system = after_system
+        self.systems = []
+        self.last_time = {}
+        self.total_time = {}
+        self.runs = 0
+
+    def add(self, name, system):
+        """ Append a system, a function taking delta_time """
+        self.systems.append((name, system))
+        self.last_time[name] = 0.0
+        self.total_time[name] = 0.0
+
+    def order(self):
+        return [name for name, _ in self.systems]
+
+    def run(self, delta_time):
+        self.runs += 1
+        for name, system in self.systems:
+            start = time.perf_counter()
+            system(delta_time)
+            self.world.flush()
+            spent = time.perf_counter() - start
+            self.last_time[name] = spent
+            self.total_time[name] += spent
+            if self.after_system is not None:
+                self.after_system(name)
+
+    def report(self):
+        """ Systems in execution order with their last and average time """
+        lines = [f"Systems ({self.runs} updates)"]
+        for position, name in enumerate(self.order(), start=1):
+            average = self.total_time[name] / max(self.runs, 1)
+            lines.append(f"  {position:>2}. {name:<20} last {self.last_time[name] * 1000:>7.3f} ms"
+                         f"  average {average * 1000:>7.3f} ms")
+        lines.append(f"Entities: {self.world.count()}")
+        return "\n".join(lines)
+# ======================================================================================================================
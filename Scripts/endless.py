@@ -0,0 +1,325 @@
+"""
+Endless mode: level chunks generated ahead of the player and discarded behind him
+
+A chunk is a slice of CHUNK_COLUMNS columns made from a seeded generator: ground with steps and lava gaps,
+spikes, coins, a platform reached by a ladder or a trampoline, and flying enemies. The same seed always gives
+the same chunks, so a run can be reproduced. Only the chunks around the player exist; the sprites of a
+discarded chunk are parked and reused by the next chunks, so memory and per-frame cost don't depend on the
+distance run.
+"""
+import random
+
+import level_data
+from collision import build_collision_bodies
+from entities import PARKED_POSITION, make_tile_sprite, tile_position
+from navigation import PATROL_LAYER_NAME, read_patrol_areas
+
+# Constants
+# ======================================================================================================================
+
+# Size of a chunk (in tiles) and the chunks kept around the player
+CHUNK_COLUMNS = 16
+CHUNK_ROWS = 10
+CHUNKS_BEHIND = 1
+CHUNKS_AHEAD = 2
+
+# Ground height (in tiles) at both ends of every chunk, so chunks always fit together whatever their order
+BASE_HEIGHT = 2
+EDGE_COLUMNS = 2
+
+# Difficulty grows from 0 to 1 over this number of chunks
+DIFFICULTY_CHUNKS = 20
+
+# Enemies patrol up to this number of columns on each side
+PATROL_COLUMNS = 3
+
+# Names of the layers, the same as in the maps
+GROUND = "ground"
+COINS = "Coins"
+BACKGROUND = "Background"
+HAZARDS = "Don't touch"
+TRAMPOLINES = "Trampoline"
+ENEMIES = "Enemies"
+LADDERS = "Ladder"
+
+# Tileset of the generated chunks (gid: image), all the images are 128x128
+TILE_SIZE = 128
+TILE_IMAGES = {
+    1: "images/tiles/grassMid.png",
+    2: "images/tiles/grassCenter.png",
+    3: "images/items/coinGold.png",
+    4: "images/items/gemBlue.png",
+    5: "images/tiles/spikes.png",
+    6: "images/tiles/lavaTop_low.png",
+    7: "images/tiles/Trampoline.png",
+    8: "images/enemies/bee.png",
+    9: "images/enemies/fly.png",
+    10: "images/tiles/ladderMid.png",
+    11: "images/tiles/ladderTop.png",
+    12: "images/tiles/grass_sprout.png",
+    13: "images/tiles/mushroomRed.png",
+}
+GRASS, DIRT, COIN, GEM, SPIKES, LAVA, TRAMPOLINE, BEE, FLY, LADDER, LADDER_TOP, SPROUT, MUSHROOM = range(1, 14)
+# ======================================================================================================================
+
+# Generation
+# ======================================================================================================================
+class ChunkGenerator:
+    """ Make the LevelData of chunk number index (columns counted from the chunk, like a small map) """
+
+    def __init__(self, seed):
+        self.seed = seed
+        self.tiles = {gid: level_data.TileInfo(gid, source, TILE_SIZE, TILE_SIZE)
+                      for gid, source in TILE_IMAGES.items()}
+
+    def generate(self, index):
+        # One generator per chunk: the chunks don't depend on the order they are made in
+        rng = random.Random(f"{self.seed}-{index}")
+        difficulty = min(index / DIFFICULTY_CHUNKS, 1.0)
+        level = level_data.LevelData(f"chunk {index}", CHUNK_COLUMNS, CHUNK_ROWS, TILE_SIZE, TILE_SIZE, None)
+        level.tiles = self.tiles
+        cells = {name: {} for name in (GROUND, COINS, BACKGROUND, HAZARDS, TRAMPOLINES, ENEMIES, LADDERS)}
+
+        # The ground under a platform is flat
+        platform_column = None
+        if index > 0 and rng.random() < 0.6:
+            platform_column = rng.randrange(EDGE_COLUMNS, CHUNK_COLUMNS - EDGE_COLUMNS - 4)
+        busy = range(platform_column, platform_column + 4) if platform_column is not None else range(0)
+        heights = self.ground_heights(rng, difficulty if index > 0 else 0, busy)
+        if platform_column is not None:
+            self.platform(rng, platform_column, heights[platform_column], cells)
+
+        for column, height in enumerate(heights):
+            if height == 0:
+                cells[HAZARDS][column, 0] = LAVA
+                continue
+            for row in range(height):
+                cells[GROUND][column, row] = GRASS if row == height - 1 else DIRT
+            if column < EDGE_COLUMNS or column >= CHUNK_COLUMNS - EDGE_COLUMNS or column in busy:
+                continue
+
+            # Spikes only on flat ground and never two in a row, with a coin above them for those who jump
+            flat = heights[column - 1] == height == heights[column + 1]
+            after_spikes = (column - 1, height) in cells[HAZARDS]
+            if index > 0 and flat and not after_spikes and rng.random() < 0.05 + 0.15 * difficulty:
+                cells[HAZARDS][column, height] = SPIKES
+                cells[COINS][column, height + 2] = COIN
+                continue
+            if rng.random() < 0.2:
+                cells[COINS][column, height] = COIN
+            elif rng.random() < 0.15:
+                cells[BACKGROUND][column, height] = rng.choice((SPROUT, MUSHROOM))
+
+        # Flying enemies in the middle of the chunk
+        if index > 0:
+            for _ in range(rng.randint(0, 1 + round(2 * difficulty))):
+                column = rng.randrange(EDGE_COLUMNS + 2, CHUNK_COLUMNS - EDGE_COLUMNS)
+                row = min(max(heights[column], BASE_HEIGHT) + rng.randint(2, 4), CHUNK_ROWS - 1)
+                if (column, row) not in cells[GROUND]:
+                    cells[ENEMIES][column, row] = rng.choice((BEE, FLY))
+                    level.objects.append(self.patrol_area(column, row, cells[GROUND]))
+
+        # The first chunk starts with a wall, there is nothing behind it
+        if index == 0:
+            for row in range(CHUNK_ROWS):
+                cells[GROUND][0, row] = GRASS if row == CHUNK_ROWS - 1 else DIRT
+
+        for name, layer_cells in cells.items():
+            gids = [0] * (CHUNK_COLUMNS * CHUNK_ROWS)
+            for (column, row), gid in layer_cells.items():
+                # Rows of the LevelData start at the top
+                gids[(CHUNK_ROWS - 1 - row) * CHUNK_COLUMNS + column] = gid
+            level.layers[name] = level_data.TileLayer(name, CHUNK_COLUMNS, CHUNK_ROWS, gids)
+        return level
+
+    def ground_heights(self, rng, difficulty, flat):
+        """
+        Height of the ground of each column, 0 for a lava gap. Steps are one tile so they can be jumped.
+        The columns in flat keep the same height.
+        """
+        heights = [BASE_HEIGHT] * CHUNK_COLUMNS
+        height = BASE_HEIGHT
+        column = EDGE_COLUMNS
+        while column < CHUNK_COLUMNS - EDGE_COLUMNS:
+            if column in flat:
+                heights[column] = height
+                column += 1
+                continue
+            if difficulty and rng.random() < 0.08 + 0.12 * difficulty and column < CHUNK_COLUMNS - EDGE_COLUMNS - 1:
+                # One column gap, same height on both sides
+                heights[column] = 0
+                heights[column + 1] = height
+                column += 2
+                continue
+            if rng.random() < 0.25:
+                height = min(max(height + rng.choice((-1, 1)), BASE_HEIGHT - 1), BASE_HEIGHT + 1)
+            heights[column] = height
+            column += 1
+        return heights
+
+    def patrol_area(self, column, row, ground):
+        """ Patrol rectangle of an enemy (an object of the map, in Tiled coordinates) over the free cells of its row """
+        first = last = column
+        while first > max(column - PATROL_COLUMNS, 0) and (first - 1, row) not in ground:
+            first -= 1
+        while last < min(column + PATROL_COLUMNS, CHUNK_COLUMNS - 1) and (last + 1, row) not in ground:
+            last += 1
+        return {"layer": PATROL_LAYER_NAME, "name": None, "type": None,
+                "x": float(first * TILE_SIZE), "y": float((CHUNK_ROWS - 1 - row) * TILE_SIZE),
+                "width": float((last - first + 1) * TILE_SIZE), "height": float(TILE_SIZE), "properties": {}}
+
+    def platform(self, rng, column, height, cells):
+        """ A floating platform with gems over column + 1 to column + 3, reached by a ladder or a trampoline """
+        row = height + 3
+        if rng.random() < 0.5:
+            for ladder_row in range(height, row):
+                cells[LADDERS][column, ladder_row] = LADDER
+            cells[LADDERS][column, row] = LADDER_TOP
+        else:
+            cells[TRAMPOLINES][column, height] = TRAMPOLINE
+        for platform_column in range(column + 1, column + 4):
+            cells[GROUND][platform_column, row] = GRASS
+            cells[COINS][platform_column, row + 1] = GEM
+# ======================================================================================================================
+
+# Chunks around the player
+# ======================================================================================================================
+class Chunk:
+    """ A generated chunk in the game: its data and the sprites made for it """
+    __slots__ = ("index", "level", "sprites", "bodies", "coins", "enemies")
+
+    def __init__(self, index, level):
+        self.index = index
+        self.level = level
+        self.sprites = []
+        self.bodies = []
+        # Coins and enemies in the order of their layer, the same on every run of the seed
+        self.coins = []
+        self.enemies = []
+
+
+class EndlessLevel:
+    """
+    Keep the chunks from CHUNKS_BEHIND behind the player to CHUNKS_AHEAD in front of him.
+    sprite_lists gives the SpriteList of each layer, ground collisions go in body_list.
+    on_enemy(sprite, patrol_areas) and on_discard_enemy(sprite) are called when an enemy comes in and out.
+    """
+
+    def __init__(self, seed, scaling, sprite_lists, body_list, on_enemy, on_discard_enemy):
+        self.generator = ChunkGenerator(seed)
+        self.scaling = scaling
+        self.sprite_lists = sprite_lists
+        self.body_list = body_list
+        self.on_enemy = on_enemy
+        self.on_discard_enemy = on_discard_enemy
+        self.chunk_pixels = CHUNK_COLUMNS * TILE_SIZE * scaling
+        self.chunks = {}
+        self.parked = {}
+        self.current = None
+        self.generated = 0
+
+    def chunk_at(self, x):
+        return int(x // self.chunk_pixels)
+
+    def start_point(self, index):
+        """ (x, top of the ground) where the player (re)starts in a chunk, the edge columns are always safe """
+        x = index * self.chunk_pixels + (EDGE_COLUMNS - 0.5) * TILE_SIZE * self.scaling
+        return x, BASE_HEIGHT * TILE_SIZE * self.scaling
+
+    def update(self, x):
+        """ Make the chunks around x and discard the others. Return True if the chunks changed. """
+        return self.move_to(self.chunk_at(x))
+
+    def move_to(self, current):
+        """ Make the chunks around chunk number current and discard the others. Return True if they changed. """
+        if current == self.current:
+            return False
+        self.current = current
+        wanted = range(max(current - CHUNKS_BEHIND, 0), current + CHUNKS_AHEAD + 1)
+        for index in [index for index in self.chunks if index not in wanted]:
+            self.discard(self.chunks.pop(index))
+        for index in wanted:
+            if index not in self.chunks:
+                self.chunks[index] = self.load(index)
+        return True
+
+    def load(self, index):
+        chunk = Chunk(index, self.generator.generate(index))
+        self.generated += 1
+        left = index * self.chunk_pixels
+        level = chunk.level
+        patrol_areas = [(area_left + left, bottom, right + left, top, properties)
+                        for area_left, bottom, right, top, properties in read_patrol_areas(level, self.scaling)]
+        for name, layer in level.layers.items():
+            for column, row, gid in layer.cells():
+                x, y = tile_position(level, level.tiles[gid], column, row, self.scaling)
+                if name == ENEMIES:
+                    # Enemies are not reused, the game destroys them with their entity
+                    sprite = make_tile_sprite(level.tiles[gid], self.scaling)
+                    sprite.position = (left + x, y)
+                    self.sprite_lists[name].append(sprite)
+                    chunk.enemies.append(sprite)
+                    self.on_enemy(sprite, patrol_areas)
+                else:
+                    sprite = self.sprite(name, gid, left + x, y)
+                    chunk.sprites.append((name, gid, sprite))
+                    if name == COINS:
+                        chunk.coins.append(sprite)
+
+        # Merged ground bodies, like the maps
+        bodies, _ = build_collision_bodies(level, GROUND, self.scaling)
+        for body in bodies:
+            body.center_x += left
+            self.body_list.append(body)
+            chunk.bodies.append(body)
+        return chunk
+
+    def sprite(self, layer_name, gid, x, y):
+        """ A parked sprite of this tile if there is one, else a new one """
+        sprite_list = self.sprite_lists[layer_name]
+        parked = self.parked.get((layer_name, gid))
+        sprite = parked.pop() if parked else make_tile_sprite(self.generator.tiles[gid], self.scaling)
+        sprite.position = (x, y)
+        # New, or removed by the game (coin picked up)
+        if not sprite.sprite_lists:
+            sprite_list.append(sprite)
+        return sprite
+
+    def discard(self, chunk):
+        for name, gid, sprite in chunk.sprites:
+            sprite.position = PARKED_POSITION
+            self.parked.setdefault((name, gid), []).append(sprite)
+        for body in chunk.bodies:
+            body.remove_from_sprite_lists()
+        # Enemies are entities of the game, it removes their sprites
+        for enemy in chunk.enemies:
+            self.on_discard_enemy(enemy)
+
+        # arcade's spatial hash keeps an empty bucket for every cell it was asked about,
+        # without this its memory would grow with the distance run
+        for sprite_list in list(self.sprite_lists.values()) + [self.body_list]:
+            if sprite_list.spatial_hash is not None:
+                contents = sprite_list.spatial_hash.contents
+                for cell in [cell for cell, sprites in contents.items() if not sprites]:
+                    del contents[cell]
+
+    def window_level(self):
+        """ (LevelData, x of its left side) of the ground and ladders of the chunks in memory, for the navigation """
+        indexes = sorted(self.chunks)
+        width = len(indexes) * CHUNK_COLUMNS
+        level = level_data.LevelData("endless", width, CHUNK_ROWS, TILE_SIZE, TILE_SIZE, None)
+        level.tiles = self.generator.tiles
+        for name in (GROUND, LADDERS):
+            gids = [0] * (width * CHUNK_ROWS)
+            for position, index in enumerate(indexes):
+                chunk_gids = self.chunks[index].level.layers[name].gids
+                for row in range(CHUNK_ROWS):
+                    start = row * width + position * CHUNK_COLUMNS
+                    gids[start:start + CHUNK_COLUMNS] = chunk_gids[row * CHUNK_COLUMNS:(row + 1) * CHUNK_COLUMNS]
+            level.layers[name] = level_data.TileLayer(name, width, CHUNK_ROWS, gids)
+        return level, indexes[0] * self.chunk_pixels
+
+    def sprite_count(self):
+        """ Sprites made so far (in the chunks and parked) """
+        return sum(len(chunk.sprites) for chunk in self.chunks.values()) + sum(map(len, self.parked.values()))
+# ======================================================================================================================
@@ -0,0 +1,221 @@
+"""
+Compact storage for the tiles and the sprites of the entities
+"""
+import array
+import arcade
+
+import assets
+import bundle
+import level_data
+
+# Constants
+# ======================================================================================================================
+
+# Size of a streaming chunk (in tiles) and how many chunks to load around the screen.
+# Chunks are only unloaded one chunk further away, so walking on a chunk border doesn't reload it every frame.
+CHUNK_SIZE = 16
+CHUNK_MARGIN = 1
+
+# Where the sprites of unloaded chunks wait to be reused (far away from everything)
+PARKED_POSITION = (-100000, -100000)
+# ======================================================================================================================
+
+# Create sprites from the level data
+# ======================================================================================================================
+def flip_points(points, horizontally, vertically, diagonally):
+    """ Hit box points of a flipped tile (same order as the image: diagonal flip first) """
+    if diagonally:
+        points = [[-y, -x] for x, y in points]
+    if horizontally:
+        points = [[-x, y] for x, y in points]
+    if vertically:
+        points = [[x, -y] for x, y in points]
+    return points
+
+
+def make_tile_sprite(tile, scaling, flips=0):
+    """
+    Create the sprite of a tile (TileInfo), or None if its image is missing.
+    flips are the FLIPPED_* bits of the cell, they apply to the image and to the hit box.
+    """
+    if not bundle.exists(tile.source):
+        print(f"Warning, can't find image {tile.source} for tile {tile.gid}")
+        return None
+    horizontally = bool(flips & level_data.FLIPPED_HORIZONTALLY_FLAG)
+    vertically = bool(flips & level_data.FLIPPED_VERTICALLY_FLAG)
+    diagonally = bool(flips & level_data.FLIPPED_DIAGONALLY_FLAG)
+    sprite = assets.make_sprite(tile.source, scaling, horizontally, vertically, diagonally)
+    if tile.hit_box is not None:
+        sprite.set_hit_box(flip_points(tile.hit_box, horizontally, vertically, diagonally))
+    return sprite
+
+
+def tile_position(level, tile, column, row, scaling):
+    """ Center of the tile placed at (column, row), same placement as arcade.tilemap """
+    x = column * level.tile_width * scaling + tile.width * scaling / 2
+    y = (level.height - row - 1) * level.tile_height * scaling + tile.height * scaling / 2
+    return x, y
+
+
+def load_layer(level, layer_name, scaling, use_spatial_hash=None, sprite_list=None):
+    """
+    Create a sprite for every tile of a layer (an empty list if the layer doesn't exist).
+    The sprites go in sprite_list when one is given (empty), in a new SpriteList otherwise.
+    """
+    if sprite_list is None:
+        sprite_list = arcade.SpriteList(use_spatial_hash=use_spatial_hash)
+    layer = level.layer(layer_name)
+    if layer is None:
+        return sprite_list
+
+    for column, row, gid, flips in layer.cells_with_flips():
+        tile = level.tiles.get(gid)
+        if tile is None:
+            continue
+        sprite = make_tile_sprite(tile, scaling, flips)
+        if sprite is None:
+            continue
+        sprite.center_x, sprite.center_y = tile_position(level, tile, column, row, scaling)
+        sprite_list.append(sprite)
+    return sprite_list
+# ======================================================================================================================
+
+# Static tiles
+# ======================================================================================================================
+class TileStore:
+    """
+    The tiles of one layer, stored as records in arrays (position, gid with the flip bits of the cell, alive).
+    Sprites are only created for the chunks close to the screen. When the camera moves away they are parked
+    and reused for the next tile with the same gid, because removing sprites from a SpriteList is slow.
+    A tile removed from the sprite list by the game (coin picked up, ...) is remembered and never comes back.
+    The sprites go in sprite_list when one is given (empty), in a new SpriteList otherwise.
+    """
+
+    def __init__(self, level, layer_name, scaling, use_spatial_hash=None, sprite_list=None):
+        self.level = level
+        self.scaling = scaling
+        self.chunk_pixels = CHUNK_SIZE * level.tile_width * scaling
+        if sprite_list is None:
+            sprite_list = arcade.SpriteList(use_spatial_hash=use_spatial_hash)
+        self.sprite_list = sprite_list
+
+        # Tile records
+        self.center_x = array.array('f')
+        self.center_y = array.array('f')
+        self.gids = array.array('I')
+        self.alive = bytearray()
+
+        # Records of each chunk, sprites of the chunks in memory and parked sprites by gid
+        self.chunks = {}
+        self.loaded = {}
+        self.parked = {}
+        self.visible_chunks = None
+
+        layer = level.layer(layer_name)
+        if layer is None:
+            return
+        for column, row, gid, flips in layer.cells_with_flips():
+            tile = level.tiles.get(gid)
+            if tile is None:
+                continue
+            x, y = tile_position(level, tile, column, row, scaling)
+            index = len(self.gids)
+            self.center_x.append(x)
+            self.center_y.append(y)
+            self.gids.append(gid | flips)
+            self.alive.append(1)
+            chunk = (column // CHUNK_SIZE, (level.height - row - 1) // CHUNK_SIZE)
+            self.chunks.setdefault(chunk, []).append(index)
+
+    def __len__(self):
+        """ Number of tiles still in the level """
+        return self.alive.count(1)
+
+    def load_chunk(self, chunk):
+        sprites = []
+        for index in self.chunks.get(chunk, ()):
+            if not self.alive[index]:
+                continue
+            gid = self.gids[index]
+            parked = self.parked.get(gid)
+            if parked:
+                sprite = parked.pop()
+                sprite.position = (self.center_x[index], self.center_y[index])
+            else:
+                sprite = make_tile_sprite(self.level.tiles[gid & level_data.GID_MASK], self.scaling,
+                                          gid & ~level_data.GID_MASK)
+                if sprite is None:
+                    self.alive[index] = 0
+                    continue
+                sprite.position = (self.center_x[index], self.center_y[index])
+                self.sprite_list.append(sprite)
+            sprites.append((index, sprite))
+        self.loaded[chunk] = sprites
+
+    def unload_chunk(self, chunk):
+        for index, sprite in self.loaded.pop(chunk):
+            if sprite.sprite_lists:
+                sprite.position = PARKED_POSITION
+                self.parked.setdefault(self.gids[index], []).append(sprite)
+            else:
+                # Removed by the game while it was loaded
+                self.alive[index] = 0
+
+    def update(self, view_left, view_bottom, view_width, view_height):
+        """ Load the chunks around the screen and unload the others. Return True if the sprites changed. """
+        first_x = int(view_left // self.chunk_pixels) - CHUNK_MARGIN
+        last_x = int((view_left + view_width) // self.chunk_pixels) + CHUNK_MARGIN
+        first_y = int(view_bottom // self.chunk_pixels) - CHUNK_MARGIN
+        last_y = int((view_bottom + view_height) // self.chunk_pixels) + CHUNK_MARGIN
+        visible = (first_x, last_x, first_y, last_y)
+        if visible == self.visible_chunks:
+            return False
+        self.visible_chunks = visible
+
+        for chunk in list(self.loaded):
+            if not (first_x - 1 <= chunk[0] <= last_x + 1 and first_y - 1 <= chunk[1] <= last_y + 1):
+                self.unload_chunk(chunk)
+        for chunk_x in range(first_x, last_x + 1):
+            for chunk_y in range(first_y, last_y + 1):
+                chunk = (chunk_x, chunk_y)
+                if chunk in self.chunks and chunk not in self.loaded:
+                    self.load_chunk(chunk)
+        return True
+# ======================================================================================================================
+
+# Sprites of the entities
+# ======================================================================================================================
+class SpritePool:
+    """
+    Sprites of one image (bullets, ...) drawn with a single SpriteList.
+    Sprites are recycled instead of being created for every new entity.
+    """
+
+    def __init__(self, file_name, scaling=1):
+        self.file_name = file_name
+        self.scaling = scaling
+        self.spare_sprites = []
+        self.sprite_list = arcade.SpriteList()
+
+    def __len__(self):
+        return len(self.sprite_list)
+
+    def acquire(self, x, y, angle=0):
+        """ Get a sprite placed at (x, y), angle in degrees """
+        if self.spare_sprites:
+            sprite = self.spare_sprites.pop()
+        else:
+            sprite = assets.make_sprite(self.file_name, self.scaling)
+        sprite.position = (x, y)
+        sprite.angle = angle
+        self.sprite_list.append(sprite)
+        return sprite
+
+    def release(self, sprite):
+        """ Give a sprite back to the pool """
+        self.sprite_list.remove(sprite)
+        self.spare_sprites.append(sprite)
+
+    def draw(self):
+        self.sprite_list.draw()
+# ======================================================================================================================
@@ -0,0 +1,247 @@
+"""
+Event log of the game
+
+The game records what happens (shots, pickups, kills, deaths, levels, ...) as typed events: a kind, a level and
+up to three numbers, no text. emit() puts them in a preallocated ring buffer and returns, a background thread
+takes them out in batches and writes them to a file: JSON lines, or binary records when the file name ends with
+".bin". Events under the level of the log are dropped before anything is stored, and when no log is open the
+game uses NULL_LOG, whose emit() does nothing.
+
+Convert a binary log to JSON lines (optionally keeping only the events from a level up):
+    python event_log.py game_events.bin [--level warning]
+"""
+import array
+import atexit
+import json
+import struct
+import threading
+import time
+
+# Constants
+# ======================================================================================================================
+LOG_NAME = "game_events.jsonl"
+
+# Levels
+DEBUG = 10
+INFO = 20
+WARNING = 30
+LEVEL_NAMES = {DEBUG: "debug", INFO: "info", WARNING: "warning"}
+
+# Events: kind: (name, names of the three values, None for the unused ones)
+SHOT = 1
+ENEMY_SHOT = 2
+PICKUP = 3
+KILL = 4
+DEATH = 5
+LEVEL = 6
+GAME_OVER = 7
+SAVE = 8
+RESUME = 9
+INPUT_LAG = 10
+EVENTS = {
+    SHOT: ("shot", ("x", "y", "angle")),
+    ENEMY_SHOT: ("enemy shot", ("x", "y", "angle")),
+    PICKUP: ("pickup", ("x", "y", "score")),
+    KILL: ("kill", ("x", "y", None)),
+    DEATH: ("death", ("x", "y", "cause")),
+    LEVEL: ("level", ("level", "seed", None)),
+    GAME_OVER: ("game over", ("level", "deaths", None)),
+    SAVE: ("save", ("level", None, None)),
+    RESUME: ("resume", ("level", "ms", None)),
+    INPUT_LAG: ("input lag", ("input", "ms", "phase")),
+}
+
+# Value of a death event
+FALL = 0
+HAZARD = 1
+ENEMY_BULLET = 2
+DEATH_CAUSES = ("fall", "hazard", "enemy bullet")
+
+# Values of an input lag event: the input, and the phase that took too long
+KEY_PRESS = 0
+KEY_RELEASE = 1
+MOUSE_PRESS = 2
+INPUTS = ("key press", "key release", "mouse press")
+LAG_WAIT = 0
+LAG_UPDATE = 1
+LAG_DRAW = 2
+LAG_PHASES = ("wait", "update", "draw")
+
+# Fields whose value is the index of a name
+VALUE_NAMES = {"cause": DEATH_CAUSES, "input": INPUTS, "phase": LAG_PHASES}
+
+# Events the ring buffer holds, when the writer is this late the new events are dropped (and counted)
+RING_CAPACITY = 4096
+
+# The writer empties the buffer at this interval (seconds), or sooner when it is half full
+FLUSH_INTERVAL = 0.5
+
+# Binary file: magic, then one record per event (time, level, kind, three values)
+MAGIC = b"PLTEVTS1"
+RECORD = struct.Struct("<dBBddd")
+# ======================================================================================================================
+
+# Formatting
+# ======================================================================================================================
+def event_dict(event_time, level, kind, values):
+    """ Readable form of an event (one JSON line) """
+    name, fields = EVENTS[kind]
+    event = {"time": round(event_time, 6), "severity": LEVEL_NAMES.get(level, level), "event": name}
+    for field, value in zip(fields, values):
+        if field in VALUE_NAMES:
+            event[field] = VALUE_NAMES[field][int(value)]
+        elif field is not None:
+            event[field] = int(value) if value == int(value) else round(value, 3)
+    return event
+
+
+def read_binary(file_name):
+    """ Yield (time, level, kind, (x, y, value)) of a binary log """
+    with open(file_name, "rb") as file:
+        data = file.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{file_name} is not a binary event log")
+    for event_time, level, kind, x, y, value in RECORD.iter_unpack(data[len(MAGIC):]):
+        yield event_time, level, kind, (x, y, value)
+# ======================================================================================================================
+
+# Logs
+# ======================================================================================================================
+class EventLog:
+    """
+    Ring buffer of events written to file_name by a background thread.
+    emit() is called by one thread at a time (the game holds state_lock), the writer only reads the events
+    between its position and the one of the game.
+    """
+
+    def __init__(self, file_name, level=INFO, capacity=RING_CAPACITY):
+        self.file_name = file_name
+        self.level = level
+        self.capacity = capacity
+        self.binary = file_name.endswith(".bin")
+
+        # One column per field, allocated once
+        self.times = array.array('d', bytes(8 * capacity))
+        self.levels = array.array('B', bytes(capacity))
+        self.kinds = array.array('B', bytes(capacity))
+        self.xs = array.array('d', bytes(8 * capacity))
+        self.ys = array.array('d', bytes(8 * capacity))
+        self.values = array.array('d', bytes(8 * capacity))
+
+        # Number of events emitted and written since the start, the slot of an event is its number % capacity
+        self.head = 0
+        self.tail = 0
+        self.dropped = 0
+
+        self.start_time = time.perf_counter()
+        self.file = open(file_name, "wb" if self.binary else "w")
+        if self.binary:
+            self.file.write(MAGIC)
+        self.wake = threading.Event()
+        self.stopping = False
+        self.thread = threading.Thread(target=self.run, name="event log", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def emit(self, level, kind, x=0.0, y=0.0, value=0.0):
+        """ Record an event (never blocks, no I/O) """
+        if level < self.level:
+            return
+        head = self.head
+        waiting = head - self.tail
+        if waiting >= self.capacity:
+            self.dropped += 1
+            return
+        slot = head % self.capacity
+        self.times[slot] = time.perf_counter() - self.start_time
+        self.levels[slot] = level
+        self.kinds[slot] = kind
+        self.xs[slot] = x
+        self.ys[slot] = y
+        self.values[slot] = value
+        # Published once the slot is complete
+        self.head = head + 1
+        if waiting == self.capacity // 2:
+            self.wake.set()
+
+    def run(self):
+        while not self.stopping:
+            self.wake.wait(FLUSH_INTERVAL)
+            self.wake.clear()
+            self.write_events()
+        self.write_events()
+
+    def write_events(self):
+        """ Write the events emitted since the last call in one batch """
+        head = self.head
+        if head == self.tail:
+            return
+        slots = [number % self.capacity for number in range(self.tail, head)]
+        if self.binary:
+            batch = b"".join(RECORD.pack(self.times[slot], self.levels[slot], self.kinds[slot], self.xs[slot],
+                                         self.ys[slot], self.values[slot]) for slot in slots)
+        else:
+            batch = "".join(json.dumps(event_dict(self.times[slot], self.levels[slot], self.kinds[slot],
+                                                  (self.xs[slot], self.ys[slot], self.values[slot]))) + "\n"
+                            for slot in slots)
+        # The slots can be used again
+        self.tail = head
+        self.file.write(batch)
+        self.file.flush()
+
+    def close(self):
+        """ Write the last events and close the file """
+        if self.stopping:
+            return
+        self.stopping = True
+        self.wake.set()
+        self.thread.join()
+        self.file.close()
+        if self.dropped:
+            print(f"{self.file_name}: {self.dropped} events dropped (the ring buffer was full)")
+
+
+class NullLog:
+    """ Log used when there is none: emit() returns at once """
+    level = WARNING + 1
+
+    def emit(self, level, kind, x=0.0, y=0.0, value=0.0):
+        pass
+
+    def close(self):
+        pass
+
+
+NULL_LOG = NullLog()
+
+# The log of the game (NULL_LOG: no log)
+_log = NULL_LOG
+
+
+def open_log(file_name, level=INFO):
+    """ Record the events of the games created from now on in this file """
+    global _log
+    _log = EventLog(file_name, level)
+    return _log
+
+
+def current_log():
+    return _log
+# ======================================================================================================================
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Print a binary event log as JSON lines")
+    parser.add_argument("log")
+    parser.add_argument("--level", choices=list(LEVEL_NAMES.values()), default="debug")
+    args = parser.parse_args()
+
+    level = {name: value for value, name in LEVEL_NAMES.items()}[args.level]
+    for event_time, event_level, kind, values in read_binary(args.log):
+        if event_level >= level:
+            print(json.dumps(event_dict(event_time, event_level, kind, values)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Run the game logic without a display
+
+Import this module before arcade: pyglet must not open its hidden window and sounds go to a silent driver.
+HeadlessWindow takes the place of arcade.Window, so MyGame runs unchanged on a machine without display or GPU.
+Nothing is drawn: on_draw must not be called.
+"""
+import importlib
+import pyglet
+pyglet.options['shadow_window'] = False
+pyglet.options['audio'] = ('silent',)
+import arcade
+
+# Stand-in for the window
+# ======================================================================================================================
+class _Framebuffer:
+    """ What arcade.set_viewport() reads from the window framebuffer """
+    is_default = False
+
+    def __init__(self, width, height):
+        self.size = (width, height)
+        self.viewport = (0, 0, width, height)
+
+
+class _Context:
+    def __init__(self, width, height):
+        self.fbo = _Framebuffer(width, height)
+        self.projection_2d = (0, width, 0, height)
+
+
+class HeadlessWindow(arcade.Window):
+    """ Window without OpenGL: keeps the size, background color and viewport, and becomes arcade's window """
+
+    def __init__(self, width=800, height=600, title=None, *args, **kwargs):
+        self._headless_size = (width, height)
+        self._headless_context = _Context(width, height)
+        self._background_color = arcade.color.BLACK
+        self._current_view = None
+        arcade.set_window(self)
+
+    width = property(lambda self: self._headless_size[0])
+    height = property(lambda self: self._headless_size[1])
+    ctx = property(lambda self: self._headless_context)
+
+    def close(self):
+        pass
+# ======================================================================================================================
+
+# The game without window
+# ======================================================================================================================
+_game_class = None
+
+
+def game_class():
+    """ MyGame running in a HeadlessWindow (the game module is imported on the first call) """
+    global _game_class
+    if _game_class is None:
+        game_module = importlib.import_module("2D_Platform")
+
+        # MyGame calls super().__init__(), which now reaches HeadlessWindow before arcade.Window
+        _game_class = type("HeadlessGame", (game_module.MyGame, HeadlessWindow), {})
+    return _game_class
+
+
+def make_game(level=1, map_name=None):
+    """ A headless game with level loaded (or the map map_name) """
+    game = game_class()()
+    game.level = level
+    game.setup(level, map_name=map_name)
+    return game
+# ======================================================================================================================
@@ -0,0 +1,200 @@
+"""
+Hit boxes of the textures, kept on the disk between runs
+
+arcade works out the hit box of a texture from its alpha channel, pixel by pixel, the first time a sprite uses it
+(about 1 s for the whole tileset). The points are stored in a cache file keyed by a hash of the image pixels and
+the hit box algorithm, so each image is only worked out once, whatever the level or the run.
+The points don't depend on the scale of the sprite: arcade scales them when it uses them.
+When the corners of the visible part of an image are opaque (full tiles, ...), the hit box is its bounding box
+and is taken straight from PIL, without scanning the image.
+
+Run this file from the game directory to fill the cache and see what it saves on each map:
+    python hit_boxes.py [map.tmx ...]
+"""
+import hashlib
+import json
+import os
+import time
+
+# Constants
+# ======================================================================================================================
+CACHE_NAME = "hit_boxes.cache"
+
+# Increase when the format of the entries changes, older files are ignored
+CACHE_VERSION = 1
+# ======================================================================================================================
+
+# Computing the hit boxes
+# ======================================================================================================================
+def bounding_box_points(image):
+    """
+    Same points as arcade's "Simple" algorithm when the four corners of the alpha bounding box are opaque
+    (no corner to cut), else None
+    """
+    alpha = image.getchannel("A")
+    box = alpha.getbbox()
+    if box is None:
+        return None
+    left, top, right, bottom = box
+    if bottom - 1 == 0 or any(alpha.getpixel(corner) == 0 for corner in
+                              ((left, top), (right - 1, top), (left, bottom - 1), (right - 1, bottom - 1))):
+        return None
+    width, height = image.size
+    # Bottom left, bottom right, top right, top left, relative to the center with y going up
+    return ((left - width / 2, height / 2 - bottom), (right - width / 2, height / 2 - bottom),
+            (right - width / 2, height / 2 - top), (left - width / 2, height / 2 - top))
+
+
+def compute_points(image, algorithm, detail):
+    """ Hit box of an image, as arcade would compute it """
+    import arcade
+    if algorithm == "Simple":
+        return bounding_box_points(image) or arcade.calculate_hit_box_points_simple(image)
+    return arcade.calculate_hit_box_points_detailed(image, detail)
+
+
+def image_key(image, algorithm, detail):
+    digest = hashlib.sha1(f"{image.mode}{image.size}".encode())
+    digest.update(image.tobytes())
+    key = f"{digest.hexdigest()}-{algorithm}"
+    return key + f"-{detail}" if algorithm == "Detailed" else key
+# ======================================================================================================================
+
+# Cache
+# ======================================================================================================================
+class HitBoxCache:
+    """ Hit box points by image hash and algorithm, read from and saved to file_name """
+
+    def __init__(self, file_name=None):
+        self.file_name = file_name
+        self.entries = {}
+        self.changed = False
+
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+        self.bounding_boxes = 0
+        self.saved_time = 0.0
+        self.compute_time = 0.0
+
+        if file_name and os.path.exists(file_name):
+            try:
+                with open(file_name) as file:
+                    data = json.load(file)
+            except (OSError, ValueError):
+                data = {}
+            if data.get("version") == CACHE_VERSION:
+                self.entries = data["entries"]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def points(self, image, algorithm="Simple", detail=4.5):
+        """ Hit box points of an image, from the cache or computed (and added to the cache) """
+        start = time.perf_counter()
+        key = image_key(image, algorithm, detail)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            # Time it took to compute, minus the time of the lookup
+            self.saved_time += entry["seconds"] - (time.perf_counter() - start)
+            return tuple(tuple(point) for point in entry["points"])
+
+        points = compute_points(image, algorithm, detail)
+        seconds = time.perf_counter() - start
+        self.misses += 1
+        self.compute_time += seconds
+        if algorithm == "Simple" and len(points) == 4 and bounding_box_points(image) is not None:
+            self.bounding_boxes += 1
+        self.entries[key] = {"points": [list(point) for point in points], "seconds": seconds}
+        self.changed = True
+        return tuple(tuple(point) for point in points)
+
+    def apply(self, texture):
+        """ Give the texture its hit box before a sprite asks arcade for it """
+        if texture._hit_box_points is None and texture._hit_box_algorithm in ("Simple", "Detailed"):
+            texture._hit_box_points = self.points(texture.image, texture._hit_box_algorithm,
+                                                  texture._hit_box_detail)
+
+    def save(self):
+        """ Write the file if new hit boxes were computed """
+        if not self.changed or not self.file_name:
+            return
+        temporary_name = f"{self.file_name}.{os.getpid()}.tmp"
+        with open(temporary_name, "w") as file:
+            json.dump({"version": CACHE_VERSION, "entries": self.entries}, file, separators=(",", ":"))
+        # Several processes (batch runner) can save at the same time, the file is replaced in one step
+        os.replace(temporary_name, self.file_name)
+        self.changed = False
+
+    def report(self):
+        return (f"Hit boxes: {self.hits} from the cache (saved {self.saved_time * 1000:.1f} ms), "
+                f"{self.misses} computed in {self.compute_time * 1000:.1f} ms "
+                f"({self.bounding_boxes} bounding boxes), {len(self.entries)} in {self.file_name}")
+
+
+# The cache used by the game (None: arcade computes the hit boxes)
+_cache = None
+
+
+def use_cache(file_name):
+    """ Use this cache file from now on (it is created when the first hit box is saved) """
+    global _cache
+    _cache = HitBoxCache(file_name)
+    return _cache
+
+
+def current_cache():
+    return _cache
+
+
+def apply(texture):
+    if _cache is not None:
+        _cache.apply(texture)
+
+
+def save():
+    if _cache is not None:
+        _cache.save()
+# ======================================================================================================================
+
+# Report per map
+# ======================================================================================================================
+def map_images(map_name):
+    """ Images of the tiles used by the layers of a map """
+    import bundle
+    import level_data
+    level = level_data.read_level(map_name)
+    sources = set()
+    for layer in level.layers.values():
+        for _, _, gid in layer.cells():
+            tile = level.tiles.get(gid)
+            if tile is not None and bundle.exists(tile.source):
+                sources.add(tile.source)
+    return sorted(sources)
+
+
+def main():
+    import sys
+    import glob
+    import headless
+    import bundle
+
+    cache = use_cache(CACHE_NAME)
+    print(f"{CACHE_NAME}: {len(cache)} hit boxes")
+    for map_name in sys.argv[1:] or sorted(glob.glob("map2_level_*.tmx")):
+        images = [bundle.load_image(source) for source in map_images(map_name)]
+        hits, saved = cache.hits, cache.saved_time
+        misses, computed = cache.misses, cache.compute_time
+        for image in images:
+            cache.points(image)
+        print(f"{map_name}: {len(images)} images, {cache.hits - hits} from the cache "
+              f"(saved {(cache.saved_time - saved) * 1000:.1f} ms), "
+              f"{cache.misses - misses} computed in {(cache.compute_time - computed) * 1000:.1f} ms")
+    cache.save()
+    print(cache.report())
+# ======================================================================================================================
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Latency from an input to the screen
+
+The input handlers only set velocities or spawn bullets, the effect is seen once an update has run and a frame
+has been drawn and presented. Each input is timestamped when its handler is called, then followed through:
+- wait: until the start of the first update after it (an update or a draw in progress, the idle frame rate, ...)
+- update: that update, which consumes the input
+- draw: from the end of that update to the first frame presented after it (window flip)
+The latency (input to presented frame) goes in a histogram per input type. When one of the phases takes longer
+than a frame the input is flagged: kept in the last flagged list and sent to the flag callback (the game logs
+an input lag event).
+"""
+import bisect
+import collections
+import time
+
+import event_log
+
+# Constants
+# ======================================================================================================================
+
+# A phase longer than this delays the input by a frame or more (seconds)
+LONG_PHASE = 1 / 60
+
+# Upper edges of the histogram buckets (milliseconds), the last bucket has everything above
+BUCKETS_MS = (8, 16, 24, 33, 50, 66, 100, 150, 250)
+
+# Flagged inputs kept for the report
+FLAGGED_KEPT = 20
+
+# Inputs followed at once, the oldest are dropped when nothing is drawn (headless runs)
+MAX_PENDING = 64
+# ======================================================================================================================
+
+# Latency tracker
+# ======================================================================================================================
+class InputLatency:
+    """
+    Call input(kind) in the input handlers, tick_start() and tick_end() around each update, draw_start() at
+    the start of on_draw and presented() after the flip. The updates can run on another thread.
+    """
+
+    def __init__(self, long_phase=LONG_PHASE, flag=None):
+        self.long_phase = long_phase
+        # flag(kind, latency, phase, phase time), called for each flagged input
+        self.flag = flag
+
+        # (kind, input time) not consumed yet, (kind, input time, tick start, tick end) not presented yet
+        self.waiting = collections.deque(maxlen=MAX_PENDING)
+        self.consumed = collections.deque(maxlen=MAX_PENDING)
+        self.tick_time = 0.0
+        self.draw_time = 0.0
+
+        # Per input type: histogram, number of samples, sum and worst latency (seconds)
+        self.histograms = [[0] * (len(BUCKETS_MS) + 1) for _ in event_log.INPUTS]
+        self.counts = [0] * len(event_log.INPUTS)
+        self.totals = [0.0] * len(event_log.INPUTS)
+        self.worst = [0.0] * len(event_log.INPUTS)
+
+        # (frame, kind, latency, phase, phase time) of the last flagged inputs
+        self.flagged = collections.deque(maxlen=FLAGGED_KEPT)
+        self.flag_count = 0
+        self.frames = 0
+
+    def input(self, kind):
+        self.waiting.append((kind, time.perf_counter()))
+
+    def tick_start(self):
+        self.tick_time = time.perf_counter()
+
+    def tick_end(self):
+        """ The update that ends consumed every input waiting """
+        if not self.waiting:
+            return
+        end = time.perf_counter()
+        while self.waiting:
+            kind, input_time = self.waiting.popleft()
+            self.consumed.append((kind, input_time, self.tick_time, end))
+
+    def draw_start(self):
+        self.draw_time = time.perf_counter()
+
+    def presented(self):
+        """ A frame is on the screen: the inputs consumed before its draw started are done """
+        self.frames += 1
+        if not self.consumed:
+            return
+        now = time.perf_counter()
+        while self.consumed and self.consumed[0][3] <= self.draw_time:
+            kind, input_time, tick_start, tick_end = self.consumed.popleft()
+            latency = now - input_time
+            self.histograms[kind][bisect.bisect_left(BUCKETS_MS, latency * 1000)] += 1
+            self.counts[kind] += 1
+            self.totals[kind] += latency
+            self.worst[kind] = max(self.worst[kind], latency)
+
+            # The longest phase, when it took more than a frame
+            phase_times = (tick_start - input_time, tick_end - tick_start, now - tick_end)
+            phase = max(range(len(phase_times)), key=phase_times.__getitem__)
+            if phase_times[phase] > self.long_phase:
+                self.flag_count += 1
+                self.flagged.append((self.frames, kind, latency, phase, phase_times[phase]))
+                if self.flag is not None:
+                    self.flag(kind, latency, phase, phase_times[phase])
+
+    def report(self):
+        edges = ("<" + str(edge) for edge in BUCKETS_MS)
+        lines = ["Input latency (ms)    count   mean  worst  " + " ".join(f"{edge:>4}" for edge in edges)
+                 + f" {'more':>4}"]
+        for kind, name in enumerate(event_log.INPUTS):
+            count = self.counts[kind]
+            mean = self.totals[kind] / count * 1000 if count else 0.0
+            lines.append(f"  {name:<18} {count:>6} {mean:>6.1f} {self.worst[kind] * 1000:>6.1f}  "
+                         + " ".join(f"{bucket:>4}" for bucket in self.histograms[kind]))
+        lines.append(f"  {self.flag_count} inputs delayed by a phase over {self.long_phase * 1000:.1f} ms"
+                     f" in {self.frames} frames")
+        for frame, kind, latency, phase, phase_time in self.flagged:
+            lines.append(f"    frame {frame:>7} {event_log.INPUTS[kind]:<12} {latency * 1000:>6.1f} ms,"
+                         f" {event_log.LAG_PHASES[phase]} {phase_time * 1000:.1f} ms")
+        return "\n".join(lines)
+# ======================================================================================================================
@@ -0,0 +1,254 @@
+"""
+Lightweight reader for the Tiled maps (.tmx)
+
+Only the data the game needs is kept: the size of the map, the tiles of the tileset and one flat
+array of tile ids (gids) per layer. Nothing here creates sprites or textures.
+"""
+import array
+import base64
+import gzip
+import os
+import sys
+import zlib
+import xml.etree.ElementTree as ET
+
+import bundle
+
+# Bits used by Tiled to flip a tile, they are not part of the tile id
+FLIPPED_HORIZONTALLY_FLAG = 0x80000000
+FLIPPED_VERTICALLY_FLAG = 0x40000000
+FLIPPED_DIAGONALLY_FLAG = 0x20000000
+GID_MASK = 0x1FFFFFFF
+
+# Decode the layers
+# ======================================================================================================================
+def decode_layer_data(data, width, height):
+    """
+    Return the gids of a <data> element as a flat array (row by row, top row first).
+    Supports csv and base64 (uncompressed, zlib, gzip and zstd when the zstandard module is installed).
+    """
+    encoding = data.get("encoding")
+    compression = data.get("compression")
+    text = (data.text or "").strip()
+
+    if encoding == "csv":
+        gids = array.array('I', (int(value) for value in text.replace("\n", "").split(",") if value))
+    elif encoding == "base64":
+        raw = base64.b64decode(text)
+        if compression == "zlib":
+            raw = zlib.decompress(raw)
+        elif compression == "gzip":
+            raw = gzip.decompress(raw)
+        elif compression == "zstd":
+            import zstandard
+            raw = zstandard.ZstdDecompressor().decompress(raw, max_output_size=width * height * 4)
+        elif compression:
+            raise ValueError(f"Unsupported layer compression '{compression}'")
+        gids = array.array('I')
+        gids.frombytes(raw)
+        if gids.itemsize != 4:
+            raise ValueError("array('I') must be 32 bits to decode the layers")
+        if sys.byteorder == "big":
+            gids.byteswap()
+    else:
+        # Plain XML <tile gid=".."/> elements
+        gids = array.array('I', (int(tile.get("gid", 0)) for tile in data.findall("tile")))
+
+    if len(gids) != width * height:
+        raise ValueError(f"Layer has {len(gids)} tiles, expected {width * height}")
+    return gids
+# ======================================================================================================================
+
+# Tiles of the tileset
+# ======================================================================================================================
+class TileInfo:
+    """ Image and optional hit box of one tile of the tileset """
+    __slots__ = ("gid", "source", "width", "height", "hit_box")
+
+    def __init__(self, gid, source, width, height, hit_box=None):
+        self.gid = gid
+        self.source = source
+        self.width = width
+        self.height = height
+        # Points relative to the center of the unscaled image (y going up), like arcade's hit boxes
+        self.hit_box = hit_box
+
+
+def _read_hit_box(tile, width, height):
+    """ Read the first collision object of a tile, converted the same way arcade.tilemap does """
+    group = tile.find("objectgroup")
+    if group is None:
+        return None
+    for hit_box in group.findall("object"):
+        x = float(hit_box.get("x", 0))
+        y = float(hit_box.get("y", 0))
+        shape = hit_box.find("polygon")
+        if shape is None:
+            shape = hit_box.find("polyline")
+        if shape is not None:
+            points = []
+            for pair in shape.get("points").split():
+                px, py = (float(value) for value in pair.split(","))
+                points.append([px + x - width / 2, -(py + y - height / 2)])
+            if len(points) > 1 and points[0] == points[-1]:
+                points.pop()
+            return points
+        if hit_box.get("width") and hit_box.get("height"):
+            sx = x - width / 2
+            sy = -(y - height / 2)
+            ex = x + float(hit_box.get("width")) - width / 2
+            ey = -(y + float(hit_box.get("height")) - height / 2)
+            return [[sx, sy], [ex, sy], [ex, ey], [sx, ey]]
+    return None
+
+
+def _resolve_image(directory, source):
+    """
+    Path of a tile image. Some maps were saved with paths pointing to another project
+    (../../PycharmProjects/.../images/tiles/x.png): those fall back to the images folder next to the map.
+    """
+    path = os.path.normpath(os.path.join(directory, source))
+    if not bundle.exists(path) and "images/" in source:
+        fallback = os.path.normpath(os.path.join(directory, "images", source.rsplit("images/", 1)[1]))
+        if bundle.exists(fallback):
+            return fallback
+    return path
+
+
+def _read_tileset(tileset, first_gid, directory, tiles):
+    """ Add the tiles of a <tileset> element to tiles (gid -> TileInfo) """
+    for tile in tileset.findall("tile"):
+        image = tile.find("image")
+        if image is None:
+            continue
+        gid = first_gid + int(tile.get("id"))
+        width = int(image.get("width", tileset.get("tilewidth")))
+        height = int(image.get("height", tileset.get("tileheight")))
+        source = _resolve_image(directory, image.get("source"))
+        tiles[gid] = TileInfo(gid, source, width, height, _read_hit_box(tile, width, height))
+# ======================================================================================================================
+
+# Layers and maps
+# ======================================================================================================================
+class TileLayer:
+    """ One tile layer: a flat array of gids, row 0 is the top of the map """
+
+    def __init__(self, name, width, height, gids):
+        self.name = name
+        self.width = width
+        self.height = height
+        self.gids = gids
+
+    def gid(self, column, row):
+        return self.gids[row * self.width + column] & GID_MASK
+
+    def cells(self):
+        """ Yield (column, row, gid) for every non-empty cell """
+        width = self.width
+        for index, gid in enumerate(self.gids):
+            if gid:
+                yield index % width, index // width, gid & GID_MASK
+
+    def cells_with_flips(self):
+        """ Yield (column, row, gid, flips) for every non-empty cell, flips are its FLIPPED_* bits """
+        width = self.width
+        for index, gid in enumerate(self.gids):
+            if gid:
+                yield index % width, index // width, gid & GID_MASK, gid & ~GID_MASK
+
+    def count(self):
+        """ Number of non-empty cells """
+        return len(self.gids) - self.gids.count(0)
+
+
+class LevelData:
+    """ Everything read from a .tmx file """
+
+    def __init__(self, file_name, width, height, tile_width, tile_height, background_color):
+        self.file_name = file_name
+        self.width = width
+        self.height = height
+        self.tile_width = tile_width
+        self.tile_height = tile_height
+        self.background_color = background_color
+        self.tiles = {}
+        self.layers = {}
+        self.objects = []
+
+    def layer(self, name):
+        """ Return the layer called name, or None if the map doesn't have it """
+        return self.layers.get(name)
+
+
+def _parse_color(value):
+    """ '#rrggbb' or '#aarrggbb' -> (r, g, b) or (r, g, b, a) """
+    if not value:
+        return None
+    value = value.lstrip("#")
+    if len(value) == 8:
+        return int(value[2:4], 16), int(value[4:6], 16), int(value[6:8], 16), int(value[0:2], 16)
+    return int(value[0:2], 16), int(value[2:4], 16), int(value[4:6], 16)
+
+
+def _read_properties(element):
+    properties = {}
+    group = element.find("properties")
+    if group is not None:
+        for item in group.findall("property"):
+            value = item.get("value", item.text)
+            kind = item.get("type", "string")
+            if kind == "int":
+                value = int(value)
+            elif kind == "float":
+                value = float(value)
+            elif kind == "bool":
+                value = value == "true"
+            properties[item.get("name")] = value
+    return properties
+
+
+def read_level(file_name):
+    """ Read a .tmx file and return a LevelData """
+    with bundle.open_file(file_name) as file:
+        root = ET.parse(file).getroot()
+    directory = os.path.dirname(file_name)
+
+    level = LevelData(file_name,
+                      int(root.get("width")),
+                      int(root.get("height")),
+                      int(root.get("tilewidth")),
+                      int(root.get("tileheight")),
+                      _parse_color(root.get("backgroundcolor")))
+
+    # Tilesets (embedded or in a .tsx file)
+    for tileset in root.findall("tileset"):
+        first_gid = int(tileset.get("firstgid"))
+        if tileset.get("source"):
+            tsx_name = os.path.join(directory, tileset.get("source"))
+            with bundle.open_file(tsx_name) as file:
+                _read_tileset(ET.parse(file).getroot(), first_gid, os.path.dirname(tsx_name), level.tiles)
+        else:
+            _read_tileset(tileset, first_gid, directory, level.tiles)
+
+    # Tile layers
+    for layer in root.iter("layer"):
+        width = int(layer.get("width"))
+        height = int(layer.get("height"))
+        gids = decode_layer_data(layer.find("data"), width, height)
+        level.layers[layer.get("name")] = TileLayer(layer.get("name"), width, height, gids)
+
+    # Objects placed on the map (not the hit boxes of the tiles)
+    for group in root.findall("objectgroup"):
+        for item in group.findall("object"):
+            level.objects.append({
+                "layer": group.get("name"),
+                "name": item.get("name"),
+                "type": item.get("type") or item.get("class"),
+                "x": float(item.get("x", 0)),
+                "y": float(item.get("y", 0)),
+                "width": float(item.get("width", 0)),
+                "height": float(item.get("height", 0)),
+                "properties": _read_properties(item),
+            })
+    return level
+# ======================================================================================================================
@@ -0,0 +1,200 @@
+"""
+Offline analysis of the maps with performance budgets
+
+For each map: size, encoding and tile count of every layer, unique tiles, estimated sprites, memory and
+setup time, and the layers setup() expects but the map doesn't have. Maps over a budget are flagged and
+the exit code is 1, so an expensive level is caught before it ships.
+
+Run this file from the game directory:
+    python map_analysis.py [map.tmx ...] [--budget sprites=3000 --budget setup_ms=500 ...] [--json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+import headless
+import bundle
+import level_data
+from collision import count_bodies
+from entities import CHUNK_SIZE, CHUNK_MARGIN
+
+# Constants
+# ======================================================================================================================
+
+# Layers read by MyGame.setup()
+EXPECTED_LAYERS = ["ground", "Coins", "Foreground", "Background", "Don't touch", "Trampoline", "Enemies", "Ladder"]
+
+# Layers streamed around the camera (TileStore), the others get a sprite per tile
+STREAMED_LAYERS = ["ground", "Background", "Foreground", "Don't touch", "Trampoline", "Ladder"]
+GROUND_LAYER = "ground"
+
+# Same as the game
+TILE_SCALING = 0.5
+VIEW_WIDTH = 1000
+VIEW_HEIGHT = 650
+
+# Measured on the game: heap of one tile sprite and time to create it and add it to its list
+ESTIMATED_SPRITE_BYTES = 2600
+ESTIMATED_SPRITE_SECONDS = 150e-6
+ESTIMATED_RECORD_SECONDS = 2e-6
+
+# Default budgets (override with --budget name=value)
+DEFAULT_BUDGETS = {
+    "tiles": 10000,
+    "unique_tiles": 150,
+    "sprites": 4000,
+    "memory_mb": 40,
+    "setup_ms": 1000,
+}
+# ======================================================================================================================
+
+# Analysis
+# ======================================================================================================================
+def layer_encodings(file_name):
+    """ {layer name: 'csv', 'base64', 'base64+zlib', ...} read from the XML """
+    encodings = {}
+    with bundle.open_file(file_name) as file:
+        root = ET.parse(file).getroot()
+    for layer in root.iter("layer"):
+        data = layer.find("data")
+        encoding = data.get("encoding") or "xml"
+        if data.get("compression"):
+            encoding += "+" + data.get("compression")
+        encodings[layer.get("name")] = encoding
+    return encodings
+
+
+def peak_streamed(level, layer):
+    """ Most tiles of a streamed layer loaded at the same time (chunks around the worst screen position) """
+    chunk_pixels = CHUNK_SIZE * level.tile_width * TILE_SCALING
+    counts = {}
+    for column, row, gid in layer.cells():
+        chunk = (column // CHUNK_SIZE, (level.height - row - 1) // CHUNK_SIZE)
+        counts[chunk] = counts.get(chunk, 0) + 1
+
+    # Chunks loaded around the screen, as in TileStore.update (+1 when the screen straddles a chunk border)
+    columns = int(VIEW_WIDTH // chunk_pixels) + 2 + 2 * CHUNK_MARGIN
+    rows = int(VIEW_HEIGHT // chunk_pixels) + 2 + 2 * CHUNK_MARGIN
+    peak = 0
+    for first_x, first_y in counts:
+        for start_x in range(first_x - columns + 1, first_x + 1):
+            for start_y in range(first_y - rows + 1, first_y + 1):
+                total = sum(counts.get((x, y), 0) for x in range(start_x, start_x + columns)
+                            for y in range(start_y, start_y + rows))
+                peak = max(peak, total)
+    return peak
+
+
+def analyze(file_name):
+    """ Return a dict describing the cost of a map """
+    start = time.perf_counter()
+    level = level_data.read_level(file_name)
+    parse_time = time.perf_counter() - start
+    encodings = layer_encodings(file_name)
+
+    layers = {}
+    used_gids = set()
+    sprites = 0
+    records = 0
+    for name, layer in level.layers.items():
+        gids = {gid for _, _, gid in layer.cells()}
+        used_gids |= gids
+        count = layer.count()
+        if name in STREAMED_LAYERS:
+            layer_sprites = peak_streamed(level, layer)
+            records += count
+        else:
+            layer_sprites = count
+        sprites += layer_sprites
+        layers[name] = {"encoding": encodings.get(name), "tiles": count, "unique_tiles": len(gids),
+                        "sprites": layer_sprites}
+
+    # The ground also gets its merged collision bodies
+    bodies = count_bodies(level, GROUND_LAYER)[1]
+    sprites += bodies
+
+    # Each unique tile image is decoded once (RGBA)
+    texture_bytes = sum(level.tiles[gid].width * level.tiles[gid].height * 4 for gid in used_gids
+                        if gid in level.tiles)
+    memory = sprites * ESTIMATED_SPRITE_BYTES + texture_bytes
+    setup_time = parse_time + sprites * ESTIMATED_SPRITE_SECONDS + records * ESTIMATED_RECORD_SECONDS
+
+    return {
+        "map": file_name,
+        "width": level.width,
+        "height": level.height,
+        "file_kb": os.path.getsize(file_name) / 1024 if os.path.exists(file_name) else None,
+        "layers": layers,
+        "missing_layers": [name for name in EXPECTED_LAYERS if name not in level.layers],
+        "tiles": sum(layer["tiles"] for layer in layers.values()),
+        "unique_tiles": len(used_gids),
+        "collision_bodies": bodies,
+        "sprites": sprites,
+        "memory_mb": memory / 1024 ** 2,
+        "parse_ms": parse_time * 1000,
+        "setup_ms": setup_time * 1000,
+    }
+
+
+def check_budgets(report, budgets):
+    """ List of the budgets a map exceeds, plus its missing layers """
+    problems = [f"{name} {report[name]:.0f} > {limit:g}" for name, limit in budgets.items() if report[name] > limit]
+    problems += [f"missing layer '{name}'" for name in report["missing_layers"]]
+    return problems
+# ======================================================================================================================
+
+# Output
+# ======================================================================================================================
+def format_report(report, problems):
+    lines = [f"{report['map']}: {report['width']}x{report['height']} tiles, {report['file_kb']:.0f} KB, "
+             f"parsed in {report['parse_ms']:.1f} ms"]
+    for name, layer in report["layers"].items():
+        lines.append(f"  {name:<14} {layer['encoding']:<12} {layer['tiles']:>6} tiles {layer['unique_tiles']:>4} unique"
+                     f" {layer['sprites']:>6} sprites")
+    lines.append(f"  total: {report['tiles']} tiles, {report['unique_tiles']} unique, "
+                 f"{report['collision_bodies']} collision bodies")
+    lines.append(f"  estimated: {report['sprites']} sprites, {report['memory_mb']:.1f} MB, "
+                 f"setup {report['setup_ms']:.0f} ms")
+    for problem in problems:
+        lines.append(f"  OVER BUDGET: {problem}" if "missing" not in problem else f"  WARNING: {problem}")
+    return "\n".join(lines)
+
+
+def parse_budget(text):
+    name, _, value = text.partition("=")
+    if name not in DEFAULT_BUDGETS:
+        raise argparse.ArgumentTypeError(f"unknown budget '{name}', use one of {', '.join(DEFAULT_BUDGETS)}")
+    return name, float(value)
+# ======================================================================================================================
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyze the maps and check their performance budgets")
+    parser.add_argument("maps", nargs="*")
+    parser.add_argument("--budget", type=parse_budget, action="append", default=[], metavar="NAME=VALUE")
+    parser.add_argument("--json", action="store_true", help="print the reports as JSON")
+    args = parser.parse_args()
+
+    budgets = dict(DEFAULT_BUDGETS, **dict(args.budget))
+    maps = args.maps or [f"map2_level_{level}.tmx" for level in range(1, 7)]
+
+    reports = []
+    over_budget = False
+    for map_name in maps:
+        report = analyze(map_name)
+        report["problems"] = check_budgets(report, budgets)
+        over_budget |= any("missing" not in problem for problem in report["problems"])
+        reports.append(report)
+        if not args.json:
+            print(format_report(report, report["problems"]))
+
+    if args.json:
+        print(json.dumps({"budgets": budgets, "maps": reports}, indent=1))
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == "__main__":
+    main()
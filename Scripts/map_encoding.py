@@ -0,0 +1,170 @@
+"""
+Re-encode the tile layers of the maps
+
+Rewrites every layer of a map to one encoding (csv, base64, base64+zlib, base64+gzip, or base64+zstd when
+the zstandard module is installed). Nothing else in the file changes. Before a map is written, its layers
+are decoded again and compared with the original gids (flip bits included).
+The report command gives the file size and the parse time of each map in every encoding.
+
+Run this file from the directory of the maps:
+    python map_encoding.py report [map.tmx ...]
+    python map_encoding.py convert base64+zlib [map.tmx ...] [--output DIRECTORY]
+"""
+import argparse
+import array
+import base64
+import glob
+import gzip
+import os
+import re
+import sys
+import time
+import zlib
+import xml.etree.ElementTree as ET
+
+from level_data import decode_layer_data
+
+# Constants
+# ======================================================================================================================
+
+# Encoding name: (encoding attribute, compression attribute)
+ENCODINGS = {
+    "csv": ("csv", None),
+    "base64": ("base64", None),
+    "base64+zlib": ("base64", "zlib"),
+    "base64+gzip": ("base64", "gzip"),
+}
+try:
+    import zstandard
+    ENCODINGS["base64+zstd"] = ("base64", "zstd")
+except ImportError:
+    zstandard = None
+
+# A <data> element of a tile layer in the file
+DATA_ELEMENT = re.compile(rb"<data\b[^>]*>.*?</data>", re.DOTALL)
+
+# Parse time: best of this number of runs
+PARSE_RUNS = 5
+# ======================================================================================================================
+
+# Encoding
+# ======================================================================================================================
+def encode_layer_data(gids, width, encoding, compression):
+    """ Text of a <data> element for these gids, formatted the way Tiled writes it """
+    if encoding == "csv":
+        rows = [",".join(str(gid) for gid in gids[start:start + width]) for start in range(0, len(gids), width)]
+        return "\n" + ",\n".join(rows) + "\n"
+
+    gids = array.array('I', gids)
+    if sys.byteorder == "big":
+        gids.byteswap()
+    raw = gids.tobytes()
+    if compression == "zlib":
+        raw = zlib.compress(raw, 9)
+    elif compression == "gzip":
+        raw = gzip.compress(raw, 9, mtime=0)
+    elif compression == "zstd":
+        raw = zstandard.ZstdCompressor(level=19).compress(raw)
+    return "\n   " + base64.b64encode(raw).decode("ascii") + "\n  "
+
+
+def read_layers(root):
+    """ [(<data> element, width, height, gids)] of the tile layers of a map """
+    if root.get("infinite") == "1":
+        raise ValueError("infinite maps (chunked layers) are not supported")
+    layers = []
+    for layer in root.iter("layer"):
+        width = int(layer.get("width"))
+        height = int(layer.get("height"))
+        data = layer.find("data")
+        layers.append((data, width, height, decode_layer_data(data, width, height)))
+    return layers
+
+
+def reencode(source, encoding_name):
+    """ Bytes of the map in source (bytes) with every layer in this encoding. Raise ValueError if it doesn't verify. """
+    encoding, compression = ENCODINGS[encoding_name]
+    layers = read_layers(ET.fromstring(source))
+    if len(DATA_ELEMENT.findall(source)) != len(layers):
+        raise ValueError("the <data> elements don't match the layers")
+
+    # Only the <data> elements are replaced, the rest of the file is kept byte for byte
+    attributes = f' encoding="{encoding}"' + (f' compression="{compression}"' if compression else "")
+    texts = iter(encode_layer_data(gids, width, encoding, compression) for _, width, _, gids in layers)
+    result = DATA_ELEMENT.sub(lambda match: f"<data{attributes}>{next(texts)}</data>".encode("ascii"), source)
+
+    # Verification: the new file decodes to the same grids
+    decoded = [gids for _, _, _, gids in read_layers(ET.fromstring(result))]
+    if decoded != [gids for _, _, _, gids in layers]:
+        raise ValueError(f"{encoding_name}: the decoded layers differ from the original")
+    return result
+
+
+def parse_time(source):
+    """ Best time to parse the XML and decode every layer (what read_level does with the layers) """
+    best = None
+    for _ in range(PARSE_RUNS):
+        start = time.perf_counter()
+        read_layers(ET.fromstring(source))
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+# ======================================================================================================================
+
+# Commands
+# ======================================================================================================================
+def report(map_names):
+    for map_name in map_names:
+        with open(map_name, "rb") as file:
+            source = file.read()
+        encodings = sorted({f"{data.get('encoding') or 'xml'}" + (f"+{data.get('compression')}"
+                                                                  if data.get("compression") else "")
+                            for data, _, _, _ in read_layers(ET.fromstring(source))})
+        print(f"{map_name}: {len(source) / 1024:.1f} KB, {parse_time(source) * 1000:.2f} ms "
+              f"(now {', '.join(encodings)})")
+        for name in ENCODINGS:
+            try:
+                data = reencode(source, name)
+            except ValueError as error:
+                print(f"  {name:<12} FAILED: {error}")
+                continue
+            print(f"  {name:<12} {len(data) / 1024:8.1f} KB {parse_time(data) * 1000:8.2f} ms  verified")
+    if zstandard is None:
+        print("base64+zstd not available (pip install zstandard)")
+
+
+def convert(map_names, encoding_name, output_directory):
+    for map_name in map_names:
+        with open(map_name, "rb") as file:
+            source = file.read()
+        data = reencode(source, encoding_name)
+        output_name = os.path.join(output_directory, os.path.basename(map_name)) if output_directory else map_name
+        with open(output_name, "wb") as file:
+            file.write(data)
+        print(f"{map_name} -> {output_name}: {len(source) / 1024:.1f} KB -> {len(data) / 1024:.1f} KB, "
+              f"parse {parse_time(source) * 1000:.2f} ms -> {parse_time(data) * 1000:.2f} ms")
+# ======================================================================================================================
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-encode the tile layers of the maps")
+    commands = parser.add_subparsers(dest="command", required=True)
+    report_parser = commands.add_parser("report", help="size and parse time of the maps in every encoding")
+    report_parser.add_argument("maps", nargs="*")
+    convert_parser = commands.add_parser("convert", help="rewrite the maps in one encoding")
+    convert_parser.add_argument("encoding", choices=list(ENCODINGS))
+    convert_parser.add_argument("maps", nargs="*")
+    convert_parser.add_argument("--output", help="write the maps in this directory instead of replacing them")
+    args = parser.parse_args()
+
+    map_names = args.maps or sorted(glob.glob("*.tmx"))
+    if args.command == "report":
+        report(map_names)
+    else:
+        if args.output:
+            os.makedirs(args.output, exist_ok=True)
+        convert(map_names, args.encoding, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Memory and object-count reporting
+"""
+import sys
+import tracemalloc
+import arcade
+
+# Collect the sprite lists of the game
+# ======================================================================================================================
+def sprite_lists(game):
+    """ Return {name: SpriteList} for every sprite list held by the game """
+    lists = {}
+    for name, value in vars(game).items():
+        if isinstance(value, arcade.SpriteList):
+            lists[name] = value
+        elif isinstance(getattr(value, "sprite_list", None), arcade.SpriteList):
+            # Pools (explosions, ...) keep their sprites in a sprite_list attribute
+            lists[name] = value.sprite_list
+    return lists
+# ======================================================================================================================
+
+# Estimate the size of the objects
+# ======================================================================================================================
+def deep_size(value, seen):
+    """ Size of a value and of the containers it holds. Textures and sprite lists are shared, so not counted. """
+    if id(value) in seen or isinstance(value, (arcade.Texture, arcade.SpriteList, arcade.Sprite)):
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += deep_size(key, seen) + deep_size(item, seen)
+    elif isinstance(value, (list, tuple, set)):
+        for item in value:
+            size += deep_size(item, seen)
+    return size
+
+
+def sprite_size(sprite, seen):
+    """ Estimated Python heap used by one sprite (the object, its attributes and its hit box points) """
+    seen.add(id(sprite))
+    return sys.getsizeof(sprite) + deep_size(vars(sprite), seen)
+
+
+def sprite_textures(sprite):
+    """ Every texture referenced by a sprite, including animation frames (walk cycles, texture pairs) """
+    stack = list(vars(sprite).values())
+    while stack:
+        value = stack.pop()
+        if isinstance(value, arcade.Texture):
+            yield value
+        elif isinstance(value, (list, tuple)):
+            stack.extend(value)
+
+
+def texture_size(texture):
+    """ Decoded size of a texture in bytes (RGBA) """
+    if texture is None or texture.image is None:
+        return 0
+    width, height = texture.image.size
+    return width * height * 4
+# ======================================================================================================================
+
+# Build the report of a level
+# ======================================================================================================================
+def level_report(game):
+    """
+    Return a dict describing the memory used by the current level:
+    sprites per list, heap per sprite type, texture memory and unique textures.
+    """
+    lists = sprite_lists(game)
+    seen = set()
+    textures = {}
+    counts = {}
+    types = {}
+
+    for name, sprite_list in lists.items():
+        counts[name] = len(sprite_list)
+        for sprite in sprite_list:
+            # Heap used by the sprite, grouped by its class
+            entry = types.setdefault(type(sprite).__name__, [0, 0])
+            if id(sprite) not in seen:
+                entry[0] += 1
+                entry[1] += sprite_size(sprite, seen)
+
+            # Textures in use (animated sprites keep more than one)
+            for texture in sprite_textures(sprite):
+                textures[id(texture)] = texture
+
+    # Animation frames held by the explosion pool
+    for texture in getattr(getattr(game, "explosions", None), "textures", []):
+        textures[id(texture)] = texture
+
+    return {
+        "level": getattr(game, "level", None),
+        "sprite_count": counts,
+        "total_sprites": sum(counts.values()),
+        "tile_records": sum(len(store) for store in getattr(game, "tile_stores", [])),
+        "sprite_types": {name: {"count": count, "bytes": size} for name, (count, size) in types.items()},
+        "unique_textures": len(textures),
+        "texture_bytes": sum(texture_size(texture) for texture in textures.values()),
+    }
+
+
+def format_report(report):
+    """ Text version of level_report() """
+    lines = [f"Level {report['level']}: {report['total_sprites']} sprites, {report['tile_records']} streamed tiles"]
+    for name, count in sorted(report["sprite_count"].items(), key=lambda item: -item[1]):
+        lines.append(f"  {name:<20} {count:>7}")
+    lines.append("Python heap per sprite type")
+    for name, entry in sorted(report["sprite_types"].items(), key=lambda item: -item[1]["bytes"]):
+        average = entry["bytes"] // max(entry["count"], 1)
+        lines.append(f"  {name:<20} {entry['count']:>7} sprites {entry['bytes'] / 1024:>10.1f} KB"
+                     f" ({average} B each)")
+    lines.append(f"Textures: {report['unique_textures']} unique, {report['texture_bytes'] / 1024 ** 2:.1f} MB decoded")
+    return "\n".join(lines)
+# ======================================================================================================================
+
+# Track allocations during on_update
+# ======================================================================================================================
+class AllocationTracker:
+    """
+    Attribute memory growth to the phases of on_update.
+    Call begin() at the start of the update and mark(name) at the end of each phase.
+    When disabled, begin() and mark() return immediately.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        # True when start() turned tracemalloc on, another tracer (python -X tracemalloc) is left running
+        self.started_tracing = False
+        self.last = 0
+        self.frames = 0
+        self.growth = {}
+        self.peak = {}
+
+    def start(self):
+        """ Start tracking and reset the statistics """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+        self.enabled = True
+        self.frames = 0
+        self.growth = {}
+        self.peak = {}
+
+    def stop(self):
+        """ Stop tracking (the statistics are kept for report()) """
+        self.enabled = False
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    def toggle(self):
+        if self.enabled:
+            self.stop()
+        else:
+            self.start()
+        return self.enabled
+
+    def begin(self):
+        if not self.enabled:
+            return
+        self.frames += 1
+        self.last = tracemalloc.get_traced_memory()[0]
+
+    def mark(self, phase):
+        """ Attribute the memory allocated since the previous mark to phase """
+        if not self.enabled:
+            return
+        current = tracemalloc.get_traced_memory()[0]
+        delta = current - self.last
+        self.last = current
+        self.growth[phase] = self.growth.get(phase, 0) + delta
+        if delta > self.peak.get(phase, 0):
+            self.peak[phase] = delta
+
+    def report(self):
+        """ Net growth per phase since start(). A phase that keeps growing is leaking. """
+        lines = [f"Allocations over {self.frames} updates"]
+        for phase, growth in sorted(self.growth.items(), key=lambda item: -item[1]):
+            per_frame = growth / max(self.frames, 1)
+            lines.append(f"  {phase:<16} net {growth / 1024:>9.1f} KB  ({per_frame:>8.1f} B/update,"
+                         f" peak {self.peak.get(phase, 0)} B)")
+        return "\n".join(lines)
+# ======================================================================================================================
@@ -0,0 +1,322 @@
+"""
+Navigation of the enemies on the tile grid
+
+The cells where an enemy can stand and the moves between them (walk, fall, jump, climb a ladder)
+are worked out once when the level is loaded. One flow field toward the player is recomputed only when
+the player changes cell, then every enemy reads its next cell with a single array lookup.
+Line of sight is checked by walking the cells crossed by the line (DDA) and caching the result.
+Patrol segments (the span of platform an enemy walks on) are also worked out from the grid, or read from the map.
+"""
+import array
+from collections import deque
+
+# Constants
+# ======================================================================================================================
+
+# How far an enemy can jump (in cells)
+JUMP_ROWS = 2
+JUMP_COLUMNS = 3
+
+# Cells further than this from the player are not part of the flow field
+FLOW_FIELD_RANGE = 24
+
+# Value of a cell that can't reach the player
+NO_PATH = 0xFFFF
+
+# An enemy that isn't on a platform patrols at most this number of cells on each side
+PATROL_MAX_CELLS = 8
+
+# Rectangles of this object layer (or objects of this type) set the patrol of the enemies inside them
+PATROL_LAYER_NAME = "Patrol"
+# ======================================================================================================================
+
+# Walkable cells and moves
+# ======================================================================================================================
+class NavGrid:
+    """
+    Cells of the level, row 0 at the top like the Tiled layers.
+    A cell is walkable when it is free and there is ground or a ladder under it (or it is a ladder).
+    left is the x of the first column (not 0 when the grid only covers a window of the level).
+    """
+
+    def __init__(self, level, ground_layer_name, ladder_layer_name, scaling, left=0):
+        self.width = level.width
+        self.height = level.height
+        self.cell_size = level.tile_width * scaling
+        self.left = left
+        size = self.width * self.height
+
+        self.blocked = bytearray(size)
+        self.ladder = bytearray(size)
+        ground = level.layer(ground_layer_name)
+        if ground is not None:
+            for column, row, gid in ground.cells():
+                if gid in level.tiles:
+                    self.blocked[row * self.width + column] = 1
+        ladders = level.layer(ladder_layer_name)
+        if ladders is not None:
+            for column, row, gid in ladders.cells():
+                self.ladder[row * self.width + column] = 1
+
+        self.walkable = bytearray(size)
+        for index in range(size):
+            if self.blocked[index]:
+                continue
+            below = index + self.width
+            if self.ladder[index] or (below < size and (self.blocked[below] or self.ladder[below])):
+                self.walkable[index] = 1
+
+        # For each cell, the cells from which it can be reached (the flow field is searched backward)
+        self.sources = [None] * size
+        for index in range(size):
+            if self.walkable[index]:
+                for target in self.moves(index):
+                    if self.sources[target] is None:
+                        self.sources[target] = array.array('i')
+                    self.sources[target].append(index)
+
+    def is_free(self, column, row):
+        return 0 <= column < self.width and 0 <= row < self.height and not self.blocked[row * self.width + column]
+
+    def landing(self, column, row):
+        """ First walkable cell when falling from (column, row), or -1 """
+        while self.is_free(column, row):
+            index = row * self.width + column
+            if self.walkable[index]:
+                return index
+            row += 1
+        return -1
+
+    def moves(self, index):
+        """ Cells reachable in one move from the walkable cell index """
+        column, row = index % self.width, index // self.width
+        targets = set()
+
+        for step in (-1, 1):
+            # Walk, or fall from the edge of the platform
+            if self.is_free(column + step, row):
+                landing = self.landing(column + step, row)
+                if landing >= 0:
+                    targets.add(landing)
+
+            # Jump up and/or across a gap: the cells over the head and along the top of the jump must be free
+            for rows in range(0, JUMP_ROWS + 1):
+                if not self.is_free(column, row - rows):
+                    break
+                for columns in range(1, JUMP_COLUMNS + 1):
+                    target_column = column + step * columns
+                    if not self.is_free(target_column, row - rows):
+                        break
+                    target = (row - rows) * self.width + target_column
+                    if (rows or columns > 1) and self.walkable[target]:
+                        targets.add(target)
+
+        # Climb a ladder
+        if self.ladder[index] and self.is_free(column, row - 1) and self.walkable[index - self.width]:
+            targets.add(index - self.width)
+        below = index + self.width
+        if below < len(self.ladder) and self.ladder[below]:
+            targets.add(below)
+
+        targets.discard(index)
+        return targets
+
+    def cell_at(self, x, y):
+        """ Index of the cell containing the point (x, y), or -1 outside of the map """
+        column = int((x - self.left) // self.cell_size)
+        row = self.height - 1 - int(y // self.cell_size)
+        if 0 <= column < self.width and 0 <= row < self.height:
+            return row * self.width + column
+        return -1
+
+    def standing_cell(self, x, y):
+        """ Walkable cell under the point (x, y) (the cell where a jumping sprite will land), or -1 """
+        index = self.cell_at(x, y)
+        if index < 0:
+            return -1
+        return self.landing(index % self.width, index // self.width)
+
+    def cell_center(self, index):
+        column, row = index % self.width, index // self.width
+        return self.left + (column + 0.5) * self.cell_size, (self.height - row - 0.5) * self.cell_size
+# ======================================================================================================================
+
+# Flow field toward the player
+# ======================================================================================================================
+class FlowField:
+    """
+    next_cell[index] is the cell to move to from index to get closer to the target,
+    distance[index] the number of moves left (NO_PATH when the target can't be reached).
+    """
+
+    def __init__(self, grid, max_distance=FLOW_FIELD_RANGE):
+        self.grid = grid
+        self.max_distance = max_distance
+        size = grid.width * grid.height
+        self.next_cell = array.array('i', [-1]) * size
+        self.distance = array.array('H', [NO_PATH]) * size
+        self.reached = []
+        self.target = -1
+        self.updates = 0
+
+    def update(self, x, y):
+        """ Aim at the point (x, y), recompute only if it is in another cell. Return True if recomputed. """
+        target = self.grid.standing_cell(x, y)
+        if target == self.target:
+            return False
+        self.target = target
+
+        # Only the cells of the previous search need to be reset
+        for index in self.reached:
+            self.next_cell[index] = -1
+            self.distance[index] = NO_PATH
+        self.reached = []
+        if target < 0:
+            return True
+        self.updates += 1
+
+        # Breadth-first search backward from the target
+        self.distance[target] = 0
+        self.reached.append(target)
+        queue = deque((target,))
+        sources = self.grid.sources
+        while queue:
+            index = queue.popleft()
+            distance = self.distance[index] + 1
+            if distance > self.max_distance or sources[index] is None:
+                continue
+            for source in sources[index]:
+                if self.distance[source] == NO_PATH:
+                    self.distance[source] = distance
+                    self.next_cell[source] = index
+                    self.reached.append(source)
+                    queue.append(source)
+        return True
+
+    def step(self, x, y):
+        """ (next cell, moves left) for a sprite at (x, y), next cell is -1 if it can't get closer """
+        index = self.grid.cell_at(x, y)
+        if index < 0:
+            return -1, NO_PATH
+        return self.next_cell[index], self.distance[index]
+# ======================================================================================================================
+
+# Line of sight
+# ======================================================================================================================
+class LineOfSight:
+    """
+    Tell which enemies can see the player through the ground tiles.
+    The result for an enemy is cached until the enemy or the player changes cell.
+    """
+
+    def __init__(self, grid):
+        self.grid = grid
+        self.cache = {}
+        self.rays = 0
+        self.cache_hits = 0
+
+    def is_clear(self, x0, y0, x1, y1):
+        """ True if no blocked cell is crossed by the segment from (x0, y0) to (x1, y1) """
+        grid = self.grid
+        self.rays += 1
+
+        # Work in cell units, y going up
+        x0 = (x0 - grid.left) / grid.cell_size
+        y0 /= grid.cell_size
+        x1 = (x1 - grid.left) / grid.cell_size
+        y1 /= grid.cell_size
+        column, cell_y = int(x0 // 1), int(y0 // 1)
+        last_column, last_y = int(x1 // 1), int(y1 // 1)
+        dx = x1 - x0
+        dy = y1 - y0
+        step_x = 1 if dx > 0 else -1
+        step_y = 1 if dy > 0 else -1
+
+        # Distance along the segment (0 to 1) to the next vertical/horizontal cell border, and between two borders
+        if dx:
+            next_x = ((column + (step_x > 0)) - x0) / dx
+            delta_x = abs(1 / dx)
+        else:
+            next_x = delta_x = float("inf")
+        if dy:
+            next_y = ((cell_y + (step_y > 0)) - y0) / dy
+            delta_y = abs(1 / dy)
+        else:
+            next_y = delta_y = float("inf")
+
+        for _ in range(abs(last_column - column) + abs(last_y - cell_y) + 1):
+            row = grid.height - 1 - cell_y
+            if 0 <= column < grid.width and 0 <= row < grid.height and grid.blocked[row * grid.width + column]:
+                return False
+            if next_x < next_y:
+                next_x += delta_x
+                column += step_x
+            else:
+                next_y += delta_y
+                cell_y += step_y
+        return True
+
+    def visible(self, candidates, target_x, target_y):
+        """
+        candidates is a list of (key, x, y). Return the keys of those with a clear line to the target.
+        """
+        target_cell = self.grid.cell_at(target_x, target_y)
+        result = []
+        for key, x, y in candidates:
+            cell = self.grid.cell_at(x, y)
+            cached = self.cache.get(key)
+            if cached is not None and cached[0] == cell and cached[1] == target_cell:
+                self.cache_hits += 1
+                clear = cached[2]
+            else:
+                clear = self.is_clear(x, y, target_x, target_y)
+                self.cache[key] = (cell, target_cell, clear)
+            if clear:
+                result.append(key)
+        return result
+# ======================================================================================================================
+
+# Patrol segments
+# ======================================================================================================================
+def patrol_segment(grid, x, y):
+    """
+    (row, left, right): the span of x where an enemy at (x, y) can go back and forth.
+    On a platform it is the walkable cells of its row around it, otherwise the free cells (up to PATROL_MAX_CELLS).
+    """
+    index = grid.cell_at(x, y)
+    if index < 0 or grid.blocked[index]:
+        return -1, x, x
+    row = index // grid.width
+    on_platform = grid.walkable[index]
+
+    def can_go(column):
+        if not grid.is_free(column, row):
+            return False
+        return grid.walkable[row * grid.width + column] if on_platform else True
+
+    column = index % grid.width
+    first = last = column
+    while can_go(first - 1) and (on_platform or column - first < PATROL_MAX_CELLS):
+        first -= 1
+    while can_go(last + 1) and (on_platform or last - column < PATROL_MAX_CELLS):
+        last += 1
+    return row, grid.left + (first + 0.5) * grid.cell_size, grid.left + (last + 0.5) * grid.cell_size
+
+
+def read_patrol_areas(level, scaling):
+    """
+    Patrol rectangles drawn in Tiled: objects of the PATROL_LAYER_NAME layer or of type "patrol".
+    Return a list of (left, bottom, right, top, properties) in game coordinates.
+    """
+    areas = []
+    map_height = level.height * level.tile_height
+    for item in level.objects:
+        if item["layer"] != PATROL_LAYER_NAME and (item["type"] or "").lower() != "patrol":
+            continue
+        left = item["x"] * scaling
+        right = (item["x"] + item["width"]) * scaling
+        top = (map_height - item["y"]) * scaling
+        bottom = (map_height - item["y"] - item["height"]) * scaling
+        areas.append((left, bottom, right, top, item["properties"]))
+    return areas
+# ======================================================================================================================
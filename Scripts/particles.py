@@ -0,0 +1,141 @@
+"""
+Particle and effect system (pooled explosions)
+"""
+import array
+import arcade
+import PIL.Image
+
+import assets
+import bundle
+
+# Constants
+# ======================================================================================================================
+
+# Explosion spritesheet
+EXPLOSION_SHEET = ":resources:images/spritesheets/explosion.png"
+EXPLOSION_COLUMNS = 16
+EXPLOSION_COUNT = 60
+EXPLOSION_FRAME_SIZE = 256
+
+# Low memory mode: keep one frame out of EXPLOSION_FRAME_STEP and shrink them by EXPLOSION_LOW_MEMORY_SCALE
+EXPLOSION_FRAME_STEP = 2
+EXPLOSION_LOW_MEMORY_SCALE = 0.5
+
+# Number of explosions that can be on screen at the same time
+EXPLOSION_POOL_SIZE = 16
+# ======================================================================================================================
+
+# Load the animation frames
+# ======================================================================================================================
+def load_explosion_frames(low_memory=False):
+    """
+    Load the explosion frames from the spritesheet.
+    In low memory mode only one frame out of EXPLOSION_FRAME_STEP is kept and each frame is downscaled.
+    """
+    if not low_memory:
+        return assets.load_spritesheet(EXPLOSION_SHEET, EXPLOSION_FRAME_SIZE, EXPLOSION_FRAME_SIZE,
+                                       EXPLOSION_COLUMNS, EXPLOSION_COUNT)
+
+    file_name = EXPLOSION_SHEET
+    source_image = bundle.load_image(file_name)
+    size = int(EXPLOSION_FRAME_SIZE * EXPLOSION_LOW_MEMORY_SCALE)
+
+    texture_list = []
+    for frame in range(0, EXPLOSION_COUNT, EXPLOSION_FRAME_STEP):
+        row = frame // EXPLOSION_COLUMNS
+        column = frame % EXPLOSION_COLUMNS
+        start_x = EXPLOSION_FRAME_SIZE * column
+        start_y = EXPLOSION_FRAME_SIZE * row
+        image = source_image.crop((start_x, start_y, start_x + EXPLOSION_FRAME_SIZE, start_y + EXPLOSION_FRAME_SIZE))
+        image = image.resize((size, size), PIL.Image.BILINEAR)
+        texture_list.append(arcade.Texture(f"{file_name}-small-{frame}", image))
+    return texture_list
+# ======================================================================================================================
+
+# Create a class for the explosions
+# ======================================================================================================================
+class ExplosionPool:
+    """
+    Fixed pool of explosion emitters.
+    The state of every emitter lives in arrays and all the explosions are drawn with a single SpriteList.
+    """
+
+    def __init__(self, capacity=EXPLOSION_POOL_SIZE, low_memory=False):
+        self.capacity = capacity
+        self.low_memory = low_memory
+        self.textures = load_explosion_frames(low_memory)
+
+        # Each texture is shown for frame_step updates so the effect lasts as long in both modes
+        self.frame_step = EXPLOSION_FRAME_STEP if low_memory else 1
+        self.lifetime = len(self.textures) * self.frame_step
+        scale = 1 / EXPLOSION_LOW_MEMORY_SCALE if low_memory else 1
+
+        # Emitter state (age < 0 means the slot is free)
+        self.age = array.array('i', [-1] * capacity)
+        self.center_x = array.array('f', [0.0] * capacity)
+        self.center_y = array.array('f', [0.0] * capacity)
+        self.free_slots = list(range(capacity - 1, -1, -1))
+        self.active_slots = []
+
+        # One sprite per slot, created once and reused
+        self.sprite_list = arcade.SpriteList()
+        for _ in range(capacity):
+            sprite = arcade.Sprite()
+            sprite.texture = self.textures[0]
+            sprite.scale = scale
+            sprite.alpha = 0
+            self.sprite_list.append(sprite)
+
+    def __len__(self):
+        return len(self.active_slots)
+
+    def emit(self, x, y):
+        """ Start an explosion at (x, y). The oldest explosion is recycled if the pool is full. """
+        if self.free_slots:
+            slot = self.free_slots.pop()
+        else:
+            slot = self.active_slots.pop(0)
+        self.active_slots.append(slot)
+
+        self.age[slot] = 0
+        self.center_x[slot] = x
+        self.center_y[slot] = y
+
+        sprite = self.sprite_list[slot]
+        sprite.center_x = x
+        sprite.center_y = y
+        sprite.texture = self.textures[0]
+        sprite.alpha = 255
+
+    def update(self):
+        """ Move every active explosion to its next frame """
+        finished = []
+        for slot in self.active_slots:
+            age = self.age[slot] + 1
+            if age >= self.lifetime:
+                finished.append(slot)
+                continue
+            self.age[slot] = age
+            if age % self.frame_step == 0:
+                self.sprite_list[slot].texture = self.textures[age // self.frame_step]
+
+        # Give the finished slots back to the pool
+        for slot in finished:
+            self.age[slot] = -1
+            self.sprite_list[slot].alpha = 0
+            self.active_slots.remove(slot)
+            self.free_slots.append(slot)
+
+    def clear(self):
+        """ Stop every explosion (used when a level is loaded) """
+        for slot in self.active_slots:
+            self.age[slot] = -1
+            self.sprite_list[slot].alpha = 0
+        self.free_slots = list(range(self.capacity - 1, -1, -1))
+        self.active_slots = []
+
+    def draw(self):
+        """ Draw all the explosions in one batch """
+        if self.active_slots:
+            self.sprite_list.draw()
+# ======================================================================================================================
@@ -0,0 +1,277 @@
+"""
+Quick save and resume
+
+A save only holds what changes while playing: the level, the player (position and velocity), the score, the
+lives, the time, the coins and enemies already removed (one bit per sprite of their map layer, in the order of
+the layer), the place and patrol direction of the enemies left, and the bullets in flight.
+Everything else comes back from the map when the level is set up again, with the asset bundle and the hit box
+cache, and the save is applied on top of it.
+
+The state is packed on the game thread (a few microseconds), the file is written by a background thread,
+so saving never delays a frame. The file is replaced in one step, a crash while writing keeps the last save.
+
+In endless mode the save keeps the seed of the level: the chunks around the player are generated again,
+with all their coins and enemies.
+"""
+import math
+import os
+import struct
+import threading
+import zlib
+
+import level_data
+
+# Constants
+# ======================================================================================================================
+SAVE_NAME = "quick_save.sav"
+MAGIC = b"PLTSAVE2"
+
+# Magic, level, endless (0/1), endless seed, score, life, deaths, frame count, total time,
+# player x, y, change x, change y, view left, view bottom, number of coins, enemies and bullets
+HEADER = struct.Struct("<8sHBQiiIIdddddiiHHH")
+
+# Enemy left, in the order of the layer: x, y, patrol row, left, right, speed (its sign is the direction),
+# chase speed
+ENEMY = struct.Struct("<ddidddd")
+
+# Kind, x, y, dx, dy, frames left
+BULLET = struct.Struct("<Bddddi")
+
+# CRC32 of everything before it, at the end of the file
+CHECKSUM = struct.Struct("<I")
+
+# Layers of the map whose sprites are in the bitsets of removed coins and enemies
+COINS_LAYER = "Coins"
+ENEMIES_LAYER = "Enemies"
+# ======================================================================================================================
+
+# Bitsets
+# ======================================================================================================================
+def pack_bits(flags):
+    """ bytes with bit i set when flags[i] is true """
+    data = bytearray((len(flags) + 7) // 8)
+    for i, flag in enumerate(flags):
+        if flag:
+            data[i >> 3] |= 1 << (i & 7)
+    return bytes(data)
+
+
+def unpack_bits(data, count):
+    return [bool(data[i >> 3] & (1 << (i & 7))) for i in range(count)]
+# ======================================================================================================================
+
+# Saved state
+# ======================================================================================================================
+class SaveState:
+    """ What a save holds, see HEADER for the fields """
+    __slots__ = ("level", "endless_seed", "score", "life", "deaths", "frame_count", "total_time", "player",
+                 "view", "removed_coins", "removed_enemies", "enemies", "bullets")
+
+    def __init__(self, level, endless_seed, score, life, deaths, frame_count, total_time, player, view,
+                 removed_coins, removed_enemies, enemies, bullets):
+        self.level = level
+        # None when playing a map
+        self.endless_seed = endless_seed
+        self.score = score
+        self.life = life
+        self.deaths = deaths
+        self.frame_count = frame_count
+        self.total_time = total_time
+        # (x, y, change x, change y)
+        self.player = player
+        # (view left, view bottom)
+        self.view = view
+        # One bool per sprite of the Coins and Enemies layers
+        self.removed_coins = removed_coins
+        self.removed_enemies = removed_enemies
+        # (x, y, patrol row, left, right, speed, chase speed) of each enemy left, see ENEMY
+        self.enemies = enemies
+        # (kind, x, y, dx, dy, frames left) of each bullet
+        self.bullets = bullets
+
+
+def capture(game):
+    """ SaveState of a game, between two updates """
+    player = game.player_sprite
+    endless_seed = game.endless.generator.seed if game.endless is not None else None
+
+    position_index = game.positions.index
+    xs = game.positions.columns["x"]
+    ys = game.positions.columns["y"]
+    bullets = []
+    for entity, kind in zip(game.colliders.entities, game.colliders.columns["kind"]):
+        if not game.world.is_alive(entity):
+            continue
+        slot = position_index[entity]
+        bullets.append((kind, xs[slot], ys[slot], game.velocities.get(entity, "dx"), game.velocities.get(entity, "dy"),
+                        game.lifetimes.get(entity, "frames")))
+
+    # Enemies move from their spawn tile (patrol and chase), their place and direction are kept
+    enemies = []
+    for enemy in game.level_enemies:
+        if not enemy.sprite_lists:
+            continue
+        entity = enemy.properties["entity"]
+        slot = position_index[entity]
+        enemies.append((xs[slot], ys[slot], game.patrols.get(entity, "row"), game.patrols.get(entity, "left"),
+                        game.patrols.get(entity, "right"), game.patrols.get(entity, "speed"),
+                        game.chasers.get(entity, "speed")))
+
+    return SaveState(game.level, endless_seed, game.score, game.life, game.deaths, game.frame_count,
+                     game.total_time, (player.center_x, player.center_y, player.change_x, player.change_y),
+                     (game.view_left, game.view_bottom),
+                     [not coin.sprite_lists for coin in game.level_coins],
+                     [not enemy.sprite_lists for enemy in game.level_enemies],
+                     enemies, bullets)
+
+
+def encode(state):
+    """ bytes of the save file """
+    header = HEADER.pack(MAGIC, state.level, state.endless_seed is not None, state.endless_seed or 0,
+                         state.score, state.life, state.deaths, state.frame_count, state.total_time,
+                         *state.player, *state.view, len(state.removed_coins), len(state.removed_enemies),
+                         len(state.bullets))
+    data = b"".join([header, pack_bits(state.removed_coins), pack_bits(state.removed_enemies)]
+                    + [ENEMY.pack(*enemy) for enemy in state.enemies]
+                    + [BULLET.pack(*bullet) for bullet in state.bullets])
+    return data + CHECKSUM.pack(zlib.crc32(data))
+
+
+def decode(data):
+    """ SaveState of a save file. Raise ValueError if it isn't one or it is damaged. """
+    if len(data) < HEADER.size + CHECKSUM.size:
+        raise ValueError("the save is too short")
+    data, (checksum,) = data[:-CHECKSUM.size], CHECKSUM.unpack(data[-CHECKSUM.size:])
+    if zlib.crc32(data) != checksum:
+        raise ValueError("the save is damaged")
+    (magic, level, endless, endless_seed, score, life, deaths, frame_count, total_time, x, y, change_x, change_y,
+     view_left, view_bottom, coins, enemies, bullets) = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("not a save of this game")
+
+    offset = HEADER.size
+    removed_coins = unpack_bits(data[offset:offset + (coins + 7) // 8], coins)
+    offset += (coins + 7) // 8
+    removed_enemies = unpack_bits(data[offset:offset + (enemies + 7) // 8], enemies)
+    offset += (enemies + 7) // 8
+    enemy_list = [ENEMY.unpack_from(data, offset + i * ENEMY.size) for i in range(removed_enemies.count(False))]
+    offset += len(enemy_list) * ENEMY.size
+    if len(data) != offset + bullets * BULLET.size:
+        raise ValueError("the save is damaged")
+    bullet_list = [BULLET.unpack_from(data, offset + i * BULLET.size) for i in range(bullets)]
+    return SaveState(level, endless_seed if endless else None, score, life, deaths, frame_count, total_time,
+                     (x, y, change_x, change_y), (view_left, view_bottom), removed_coins, removed_enemies,
+                     enemy_list, bullet_list)
+
+
+def load(file_name):
+    with open(file_name, "rb") as file:
+        return decode(file.read())
+
+
+def check_map(game, state):
+    """ Raise ValueError when the save was made on another version of the map of its level """
+    if state.endless_seed is None:
+        my_map = level_data.read_level(game.level_map_name(state.level))
+        counts = [0 if layer is None else layer.count()
+                  for layer in (my_map.layer(COINS_LAYER), my_map.layer(ENEMIES_LAYER))]
+    else:
+        # The coins and enemies of the endless chunks are generated again, none is in the bitsets
+        counts = [0, 0]
+    if counts != [len(state.removed_coins), len(state.removed_enemies)]:
+        raise ValueError(f"the save doesn't match the map of level {state.level}")
+
+
+def apply(game, state):
+    """ Set up the level of the save and put the game in the saved state """
+    # Checked first: the game is left as it is when the save can't be used
+    check_map(game, state)
+    game.level = state.level
+    game.setup(state.level, endless_seed=state.endless_seed)
+
+    for coin, removed in zip(game.level_coins, state.removed_coins):
+        if removed:
+            coin.remove_from_sprite_lists()
+    alive = [enemy for enemy, removed in zip(game.level_enemies, state.removed_enemies) if not removed]
+    for enemy, removed in zip(game.level_enemies, state.removed_enemies):
+        if removed:
+            game.world.destroy(enemy.properties["entity"])
+    for enemy, (x, y, row, left, right, speed, chase_speed) in zip(alive, state.enemies):
+        entity = enemy.properties["entity"]
+        game.positions.set(entity, "x", x)
+        game.positions.set(entity, "y", y)
+        game.patrols.set(entity, "row", row)
+        game.patrols.set(entity, "left", left)
+        game.patrols.set(entity, "right", right)
+        game.patrols.set(entity, "speed", speed)
+        game.chasers.set(entity, "speed", chase_speed)
+        enemy.position = (x, y)
+
+    for kind, x, y, dx, dy, frames in state.bullets:
+        entity = game.spawn_bullet(kind, x, y, math.atan2(dy, dx))
+        game.velocities.set(entity, "dx", dx)
+        game.velocities.set(entity, "dy", dy)
+        game.lifetimes.set(entity, "frames", frames)
+    game.world.flush()
+
+    game.score = state.score
+    game.life = state.life
+    game.deaths = state.deaths
+    game.frame_count = state.frame_count
+    game.total_time = state.total_time
+    player = game.player_sprite
+    player.center_x, player.center_y, player.change_x, player.change_y = state.player
+
+    # Endless mode: the chunks around the player and the place where he restarts
+    game.endless_system(0)
+
+    game.view_left, game.view_bottom = state.view
+    game.view_changed = True
+    game.stream_tiles()
+# ======================================================================================================================
+
+# Writing
+# ======================================================================================================================
+class SaveWriter(threading.Thread):
+    """
+    Writes the saves in the background. Only the last save waiting is written, an older one that wasn't
+    written yet is dropped.
+    """
+
+    def __init__(self, file_name):
+        super().__init__(name="quick save", daemon=True)
+        self.file_name = file_name
+        self.condition = threading.Condition()
+        self.pending = None
+        self.stopping = False
+        self.saves = 0
+
+    def write(self, data):
+        """ Queue the bytes of a save (returns at once) """
+        with self.condition:
+            self.pending = data
+            self.condition.notify()
+
+    def stop(self):
+        """ Write the save waiting, if any, and end the thread """
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        self.join()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending is None and not self.stopping:
+                    self.condition.wait()
+                data, self.pending = self.pending, None
+                if data is None:
+                    return
+            temporary_name = self.file_name + ".tmp"
+            with open(temporary_name, "wb") as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temporary_name, self.file_name)
+            self.saves += 1
+# ======================================================================================================================
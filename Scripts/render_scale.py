@@ -0,0 +1,107 @@
+"""
+Render scale
+
+The scene is drawn in an offscreen framebuffer at a fraction of the window size, then stretched over the window
+(nearest filtering: sharp pixels, linear: smooth). On software renderers and small GPUs a frame costs mostly the
+pixels it fills, a scale of 0.5 fills 4 times fewer. The HUD is drawn on the window afterwards, at full resolution.
+
+In the dynamic mode the scale follows the GPU time of the scene: it goes down while the scene takes longer than
+the target, and back up when there is room. The time is measured with OpenGL queries, each one is read a frame
+later so the CPU never waits for the GPU.
+"""
+from arcade.gl import geometry
+
+# Constants
+# ======================================================================================================================
+MIN_SCALE = 0.25
+SCALE_STEP = 0.05
+
+# Frames averaged before the dynamic mode changes the scale
+ADJUST_FRAMES = 30
+
+# The dynamic mode scales up when the scene takes less than this fraction of the target
+HEADROOM = 0.7
+# ======================================================================================================================
+
+# Render scale
+# ======================================================================================================================
+class RenderScaler:
+    """
+    Offscreen framebuffer of scale * window_size where the scene is drawn.
+    target_time (seconds of GPU time per frame) turns on the dynamic mode.
+    """
+
+    def __init__(self, ctx, window_size, scale=1.0, linear=False, target_time=None):
+        self.ctx = ctx
+        self.window_size = window_size
+        self.linear = linear
+        self.target_time = target_time
+        self.program = ctx.load_program(vertex_shader=":resources:shaders/texture_default_projection_vs.glsl",
+                                        fragment_shader=":resources:shaders/texture_fs.glsl")
+        self.quad = geometry.quad_2d_fs()
+
+        # Two queries used in turn, the one of the previous frame is read
+        self.queries = [ctx.query(), ctx.query()] if target_time else None
+        self.frame = 0
+        self.scene_times = []
+        self.last_scene_time = None
+
+        self.scale = None
+        self.texture = None
+        self.framebuffer = None
+        self.set_scale(scale)
+
+    def set_scale(self, scale):
+        """ Change the scale (rounded to SCALE_STEP), the framebuffer is made again when its size changes """
+        scale = min(1.0, max(MIN_SCALE, round(scale / SCALE_STEP) * SCALE_STEP))
+        size = (max(1, int(self.window_size[0] * scale)), max(1, int(self.window_size[1] * scale)))
+        self.scale = scale
+        if self.texture is not None and self.texture.size == size:
+            return
+        texture_filter = (self.ctx.LINEAR, self.ctx.LINEAR) if self.linear else (self.ctx.NEAREST, self.ctx.NEAREST)
+        self.texture = self.ctx.texture(size, components=4, filter=texture_filter)
+        self.framebuffer = self.ctx.framebuffer(color_attachments=[self.texture])
+
+    def draw(self, draw_scene, background_color):
+        """ Call draw_scene (it draws in the current projection) in the framebuffer, then upscale it on the window """
+        # clear() binds the framebuffer itself, inside "with" it would forget the screen
+        self.framebuffer.clear(background_color)
+        with self.framebuffer:
+            if self.queries is None:
+                draw_scene()
+            else:
+                with self.queries[self.frame % 2]:
+                    draw_scene()
+
+        # Copy as is, the framebuffer already has the background
+        self.ctx.disable(self.ctx.BLEND)
+        self.texture.use(0)
+        self.quad.render(self.program)
+        self.ctx.enable(self.ctx.BLEND)
+
+        if self.queries is not None:
+            self.frame += 1
+            if self.frame >= 2:
+                self.adjust(self.queries[self.frame % 2].time_elapsed / 1e9)
+
+    def adjust(self, scene_time):
+        """ Dynamic mode: change the scale every ADJUST_FRAMES from the average GPU time of the scene """
+        self.scene_times.append(scene_time)
+        if len(self.scene_times) < ADJUST_FRAMES:
+            return
+        average = sum(self.scene_times) / len(self.scene_times)
+        self.scene_times.clear()
+        self.last_scene_time = average
+        if average > self.target_time and self.scale > MIN_SCALE:
+            # The time goes with the number of pixels, the area of the framebuffer
+            self.set_scale(min(self.scale - SCALE_STEP, self.scale * (self.target_time / average) ** 0.5))
+        elif average < self.target_time * HEADROOM and self.scale < 1:
+            self.set_scale(self.scale + SCALE_STEP)
+
+    def report(self):
+        width, height = self.texture.size
+        text = f"Render scale {self.scale:.2f} ({width}x{height}, {'linear' if self.linear else 'nearest'})"
+        if self.last_scene_time is not None:
+            text += f", scene {self.last_scene_time * 1000:.1f} ms (target {self.target_time * 1000:.1f} ms)"
+        return text
+# ======================================================================================================================
@@ -0,0 +1,190 @@
+"""
+Run the simulation on its own thread
+
+The simulation thread runs the game logic at a fixed rate. After each update it publishes an immutable
+snapshot of what must be drawn (sprites as texture index, position, angle, alpha and scale, the camera and
+the HUD values). on_draw renders the latest snapshot with sprites that belong to the main thread only,
+so a slow draw doesn't delay the simulation and a slow setup() doesn't freeze the window.
+Only the main thread calls OpenGL.
+"""
+import threading
+import time
+import arcade
+
+# Constants
+# ======================================================================================================================
+
+# Sprites further than this from the screen are not put in the snapshot
+SNAPSHOT_MARGIN = 128
+
+# When the simulation is late by more than this number of updates, it gives up catching up
+MAX_LATE_UPDATES = 5
+# ======================================================================================================================
+
+# Snapshots
+# ======================================================================================================================
+class Snapshot:
+    """ Drawable state after one update. Every field is a tuple or a number, nothing is changed after creation. """
+    __slots__ = ("sequence", "view_left", "view_bottom", "hud", "layers")
+
+    def __init__(self, sequence, view_left, view_bottom, hud, layers):
+        self.sequence = sequence
+        self.view_left = view_left
+        self.view_bottom = view_bottom
+        # (total_time, score, life)
+        self.hud = hud
+        # One tuple per layer, in drawing order, of (texture index, x, y, angle, alpha, scale)
+        self.layers = layers
+
+
+class SnapshotBuffer:
+    """
+    Double buffer: the simulation publishes into the back slot, then the slots are swapped.
+    The renderer always reads a complete snapshot from the front slot.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.front = None
+        self.back = None
+
+    def publish(self, snapshot):
+        self.back = snapshot
+        with self.lock:
+            self.front, self.back = self.back, self.front
+
+    def latest(self):
+        with self.lock:
+            return self.front
+
+
+class TextureTable:
+    """ Textures seen in the snapshots, referred to by index """
+
+    def __init__(self):
+        self.textures = []
+        self.indexes = {}
+
+    def index(self, texture):
+        index = self.indexes.get(id(texture))
+        if index is None:
+            index = len(self.textures)
+            # Appended before the index is known to the snapshots, so the renderer always finds it
+            self.textures.append(texture)
+            self.indexes[id(texture)] = index
+        return index
+
+
+def build_snapshot(sequence, game, textures, view_width, view_height):
+    """ Copy the drawable state of the game (the sprites close to the screen only) """
+    left = game.view_left - SNAPSHOT_MARGIN
+    right = game.view_left + view_width + SNAPSHOT_MARGIN
+    bottom = game.view_bottom - SNAPSHOT_MARGIN
+    top = game.view_bottom + view_height + SNAPSHOT_MARGIN
+    layers = []
+    for sprite_list in game.draw_layers():
+        entries = []
+        for sprite in sprite_list:
+            x, y = sprite.position
+            if left <= x <= right and bottom <= y <= top and sprite.alpha and sprite.texture is not None:
+                entries.append((textures.index(sprite.texture), x, y, sprite.angle, sprite.alpha, sprite.scale))
+        layers.append(tuple(entries))
+    return Snapshot(sequence, game.view_left, game.view_bottom, (game.total_time, game.score, game.life),
+                    tuple(layers))
+# ======================================================================================================================
+
+# Drawing the snapshots (main thread)
+# ======================================================================================================================
+class SnapshotRenderer:
+    """ Sprites owned by the main thread, updated from the snapshots. They are reused from one frame to the next. """
+
+    def __init__(self, textures):
+        self.textures = textures
+        self.layers = []
+        self.used = []
+        self.sequence = -1
+
+    def update(self, snapshot):
+        if snapshot.sequence == self.sequence:
+            return
+        self.sequence = snapshot.sequence
+        while len(self.layers) < len(snapshot.layers):
+            self.layers.append(arcade.SpriteList())
+            self.used.append(0)
+
+        for layer, sprite_list in enumerate(self.layers):
+            entries = snapshot.layers[layer] if layer < len(snapshot.layers) else ()
+            while len(sprite_list) < len(entries):
+                sprite_list.append(arcade.Sprite())
+            for sprite, (texture, x, y, angle, alpha, scale) in zip(sprite_list, entries):
+                sprite.texture = self.textures.textures[texture]
+                sprite.scale = scale
+                sprite.position = (x, y)
+                sprite.angle = angle
+                sprite.alpha = alpha
+
+            # Hide the sprites that were used by the previous snapshot only
+            for i in range(len(entries), self.used[layer]):
+                sprite_list[i].alpha = 0
+            self.used[layer] = len(entries)
+
+    def draw(self):
+        for sprite_list in self.layers:
+            sprite_list.draw()
+# ======================================================================================================================
+
+# Simulation thread
+# ======================================================================================================================
+class SimulationThread(threading.Thread):
+    """
+    Call game.simulate(delta_time) at a fixed rate and publish a snapshot after each update.
+    game.state_lock is held during the update, the input handlers take it too.
+    """
+
+    def __init__(self, game, rate, view_width, view_height):
+        super().__init__(name="simulation", daemon=True)
+        self.game = game
+        self.delta_time = 1 / rate
+        self.view_width = view_width
+        self.view_height = view_height
+        self.textures = TextureTable()
+        self.buffer = SnapshotBuffer()
+        self.running = True
+
+        # Timing statistics
+        self.updates = 0
+        self.update_time = 0.0
+        self.worst_update = 0.0
+        self.skipped = 0
+
+    def run(self):
+        next_time = time.perf_counter()
+        while self.running:
+            start = time.perf_counter()
+            with self.game.state_lock:
+                self.game.simulate(self.delta_time)
+                snapshot = build_snapshot(self.updates, self.game, self.textures, self.view_width, self.view_height)
+            self.buffer.publish(snapshot)
+
+            spent = time.perf_counter() - start
+            self.updates += 1
+            self.update_time += spent
+            self.worst_update = max(self.worst_update, spent)
+
+            next_time += self.delta_time
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            elif -delay > MAX_LATE_UPDATES * self.delta_time:
+                # Too late: drop the missed updates instead of running them back to back
+                self.skipped += int(-delay / self.delta_time)
+                next_time = time.perf_counter()
+
+    def stop(self):
+        self.running = False
+
+    def report(self):
+        average = self.update_time / max(self.updates, 1)
+        return (f"Simulation thread: {self.updates} updates, average {average * 1000:.3f} ms, "
+                f"worst {self.worst_update * 1000:.3f} ms, {self.skipped} updates skipped")
+# ======================================================================================================================
@@ -0,0 +1,209 @@
+"""
+Sprite lists kept from one level to the next
+
+arcade gives a SpriteList a texture atlas (the images of its sprites) and five GPU buffers (positions, sizes,
+angles, colors, texture coordinates), and makes new buffers every time a sprite is added or removed. setup()
+used to create new lists for every level and drop the old ones: each level change built every atlas again, and
+the old lists, their sprites and their buffers were left to the garbage collector, which could run in the middle
+of a later frame.
+
+The game now takes its lists from a SpriteListManager. reset() empties them in place: a list keeps its atlas
+(the levels share the tileset) and its GPU buffers, which are refilled instead of created, with room for the
+number of sprites reserved from the map. What the previous level leaves behind (its sprites, tile stores,
+navigation grids, ...) is retired: kept alive until an idle moment, where it is all dropped and collected at
+once. Once a level is set up its objects are frozen (gc.freeze): the automatic collections during the game
+only go through the objects made since, not the thousands of sprites and tiles of the level.
+"""
+import gc
+import time
+import arcade
+
+# Sprite lists
+# ======================================================================================================================
+class SpriteBuffers:
+    """
+    Stands for the context of one sprite list while arcade builds its buffers: buffer() hands out the buffers
+    of the previous build again, refilled and grown when they are too small, and geometry() the vertex array
+    made for them. Everything else (the atlas texture, ...) goes to the context.
+    """
+
+    def __init__(self, ctx):
+        self.ctx = ctx
+        self.buffers = []
+        self.geometry_object = None
+        self.next_buffer = 0
+        self.count = 0
+        self.reserved = 0
+        # Buffers made and grown, the other builds only wrote in them
+        self.created = 0
+        self.grown = 0
+
+    def rewind(self, count, reserved):
+        """ A build of count sprites starts, the buffers get room for reserved sprites """
+        self.next_buffer = 0
+        self.count = count
+        self.reserved = reserved
+        return self
+
+    def buffer(self, *, data, usage="static"):
+        size = memoryview(data).nbytes
+        # Bytes per sprite times the sprites reserved
+        room = max(size, size // max(self.count, 1) * self.reserved)
+        if self.next_buffer < len(self.buffers):
+            buffer = self.buffers[self.next_buffer]
+            if buffer.size < size:
+                buffer.orphan(max(room, buffer.size * 2))
+                self.grown += 1
+        else:
+            buffer = self.ctx.buffer(reserve=room, usage=usage)
+            self.buffers.append(buffer)
+            self.created += 1
+        buffer.write(data)
+        self.next_buffer += 1
+        return buffer
+
+    def geometry(self, content):
+        # Same buffers as the last build: its vertex array still points to them
+        if self.geometry_object is None:
+            self.geometry_object = self.ctx.geometry(content)
+        return self.geometry_object
+
+    def __getattr__(self, name):
+        return getattr(self.ctx, name)
+
+
+class ReusableSpriteList(arcade.SpriteList):
+    """ SpriteList that keeps its GPU buffers when its sprites change, and can be emptied in place """
+
+    def __init__(self, use_spatial_hash=None):
+        super().__init__(use_spatial_hash=use_spatial_hash)
+        self.gpu_buffers = None
+        self.reserved = 0
+
+    def reserve(self, count):
+        """ The next builds of the buffers make room for count sprites """
+        self.reserved = count
+
+    def clear(self):
+        """ Remove every sprite (SpriteList.remove() goes through the whole list for each one). Return them. """
+        sprites = self.sprite_list
+        for sprite in sprites:
+            sprite.sprite_lists.remove(self)
+        self.sprite_list = []
+        self.sprite_idx = {}
+        if self.spatial_hash is not None:
+            self.spatial_hash.reset()
+        self._vao1 = None
+        return sprites
+
+    def set_spatial_hash(self, use_spatial_hash):
+        if use_spatial_hash and self.spatial_hash is None:
+            self.enable_spatial_hashing()
+        elif not use_spatial_hash and self.spatial_hash is not None:
+            self.disable_spatial_hashing()
+
+    def _calculate_sprite_buffer(self):
+        # arcade sets the context at the first draw, the builds come after it
+        if self.gpu_buffers is None:
+            self.gpu_buffers = SpriteBuffers(self.ctx)
+        self.ctx = self.gpu_buffers.rewind(len(self.sprite_list), self.reserved)
+        try:
+            super()._calculate_sprite_buffer()
+        finally:
+            self.ctx = self.gpu_buffers.ctx
+# ======================================================================================================================
+
+# Manager
+# ======================================================================================================================
+class SpriteListManager:
+    """
+    The sprite lists of the game by name, kept across setup() calls, and the objects retired by the level
+    changes until they can be dropped.
+    """
+
+    def __init__(self, freeze=True):
+        self.lists = {}
+        self.retired = []
+        self.freeze = freeze
+        # Releases done and time of the last one (seconds)
+        self.releases = 0
+        self.release_time = 0.0
+
+    def get(self, name, use_spatial_hash=None, reserve=0):
+        """ The list called name, empty (after a reset()) """
+        sprite_list = self.lists.get(name)
+        if sprite_list is None:
+            sprite_list = self.lists[name] = ReusableSpriteList(use_spatial_hash=use_spatial_hash)
+        else:
+            sprite_list.set_spatial_hash(use_spatial_hash)
+        sprite_list.reserve(reserve)
+        return sprite_list
+
+    def reset(self):
+        """ A level change starts: empty every list, what the last one still retires is dropped now """
+        gc.unfreeze()
+        self.retired.clear()
+        for sprite_list in self.lists.values():
+            self.retired.append(sprite_list.clear())
+
+    def retire(self, *objects):
+        """ Keep objects of the previous level until release() """
+        self.retired.extend(objects)
+
+    def level_ready(self):
+        """ The level is set up: freeze its objects (and the retired ones) """
+        if self.freeze:
+            gc.freeze()
+
+    def release(self):
+        """ Call at an idle moment: drop the retired objects, collect the garbage and freeze what is left """
+        if not self.retired:
+            return
+        start = time.perf_counter()
+        gc.unfreeze()
+        self.retired.clear()
+        gc.collect()
+        if self.freeze:
+            gc.freeze()
+        self.release_time = time.perf_counter() - start
+        self.releases += 1
+
+    def report(self):
+        sprite_buffers = [sprite_list.gpu_buffers for sprite_list in self.lists.values()
+                          if sprite_list.gpu_buffers is not None]
+        return (f"Sprite lists: {len(self.lists)}, GPU buffers {sum(len(b.buffers) for b in sprite_buffers)}"
+                f" (grown {sum(b.grown for b in sprite_buffers)} times), {len(self.retired)} retired objects,"
+                f" {self.releases} releases (last {self.release_time * 1000:.1f} ms)")
+# ======================================================================================================================
+
+# Garbage collector pauses
+# ======================================================================================================================
+class GcMonitor:
+    """ Number and duration of the collections of the garbage collector, by generation """
+
+    def __init__(self):
+        self.counts = [0, 0, 0]
+        self.times = [0.0, 0.0, 0.0]
+        self.longest = 0.0
+        self.start = None
+        gc.callbacks.append(self.callback)
+
+    def callback(self, phase, info):
+        if phase == "start":
+            self.start = time.perf_counter()
+        elif self.start is not None:
+            pause = time.perf_counter() - self.start
+            generation = info["generation"]
+            self.counts[generation] += 1
+            self.times[generation] += pause
+            self.longest = max(self.longest, pause)
+            self.start = None
+
+    def close(self):
+        gc.callbacks.remove(self.callback)
+
+    def report(self):
+        generations = ", ".join(f"gen {generation}: {count} ({time_sum * 1000:.1f} ms)"
+                                for generation, (count, time_sum) in enumerate(zip(self.counts, self.times)))
+        return f"Garbage collections {generations}, longest {self.longest * 1000:.1f} ms"
+# ======================================================================================================================
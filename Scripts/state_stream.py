@@ -0,0 +1,878 @@
+"""
+State stream for spectators and replays
+
+After each update the game state is packed in a frame and sent to the spectators connected to a local port,
+and written to a recording file if there is one. Most frames are deltas against the previous one:
+- positions are integers in 1/16 of a pixel, and the spectators move the player and every enemy by its velocity
+  of the previous update: a delta only has the velocities that changed (an enemy that turns around, the player
+  under gravity, ...), an enemy walking at constant speed costs nothing
+- the coins and enemies removed, by their index in the map layer (as in the quick saves) or in the chunks
+- the bullets created (with their velocity) and removed, the spectators move them
+- the pose of the player, the view and the HUD when they change
+A keyframe has the whole state. One is sent every KEYFRAME_INTERVAL updates, at each level change, when the
+player reaches another chunk in endless mode and when a spectator connects, so it can start from it; a spectator
+that misses a delta waits for the next keyframe.
+Enemy angles and explosions are not sent, the spectators compute them.
+
+The frames are packed on the game thread (a few microseconds, nothing when nobody watches and nothing is
+recorded) and sent by a background thread, a spectator that can't keep up is disconnected.
+
+In endless mode the spectators generate the chunks from the seed and the chunk of the player in the keyframes.
+The coins and enemies of the chunks in memory are numbered in the order of the chunks, then of their layers,
+and streamed like those of a map.
+
+Watch a game (STATE_STREAM_PORT in the game), play back or measure a recording (STATE_STREAM_RECORD):
+    python state_stream.py [--port 7411] [--replay FILE] [--stats FILE]
+"""
+import argparse
+import atexit
+import importlib
+import math
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+import arcade
+
+import bundle
+import endless
+import hit_boxes
+import level_data
+from entities import SpritePool, TileStore, load_layer
+from particles import ExplosionPool
+from quick_save import pack_bits, unpack_bits
+
+# Constants
+# ======================================================================================================================
+STREAM_PORT = 7411
+MAGIC = b"PLTSTRM2"
+
+# Updates between two keyframes
+KEYFRAME_INTERVAL = 120
+
+# Positions are sent in 1/SUBPIXELS of a pixel
+SUBPIXELS = 16
+
+# Frames waiting for the sender thread, past this they are dropped (and a keyframe follows)
+MAX_QUEUED = 240
+
+# A spectator that doesn't take a frame in this time is disconnected (seconds)
+SEND_TIMEOUT = 1.0
+
+# The accept thread checks if the stream is closed at this interval (seconds)
+ACCEPT_INTERVAL = 0.5
+
+# Replays are played at this number of updates per second
+REPLAY_RATE = 60
+
+# Kind of frame, tick (number of the update), size of what follows
+HEADER = struct.Struct("<BII")
+KEYFRAME = 1
+DELTA = 2
+
+# Keyframe: level, endless (0/1), endless seed, chunk of the player (endless), view left, view bottom,
+# total time, score, life, player x, y, pose, number of groups and bullets.
+# Then for each group (the map, or a chunk in memory) a GROUP record and its removed coins and enemies
+# (bitsets), then the POINT position of each enemy left.
+KEY_STATE = struct.Struct("<HBQiiidiiiiBHH")
+POINT = struct.Struct("<ii")
+
+# Chunk (0 for a map), number of coins and enemies
+GROUP = struct.Struct("<iHH")
+
+# Id, kind, x, y, dx, dy of a bullet
+BULLET = struct.Struct("<IBiiff")
+
+# A delta starts with a byte of these flags, the sections follow in this order
+REMOVED = 1         # COUNTS of coins and enemies, then their INDEX
+ENEMIES_MOVED = 2   # COUNT, then a VELOCITY record per enemy
+PLAYER_MOVED = 4    # VECTOR, the new velocity of the player
+PLAYER_POSE = 8     # POSE
+BULLETS_REMOVED = 16  # COUNT, then a BULLET_ID per bullet
+BULLETS_ADDED = 32  # COUNT, then a BULLET per bullet
+VIEW = 64           # POINT (view left, bottom)
+HUD = 128           # HUD_VALUES
+
+FLAGS = struct.Struct("<B")
+COUNT = struct.Struct("<H")
+COUNTS = struct.Struct("<HH")
+INDEX = struct.Struct("<H")
+VELOCITY = struct.Struct("<Hhh")
+VECTOR = struct.Struct("<hh")
+POSE = struct.Struct("<B")
+BULLET_ID = struct.Struct("<I")
+HUD_VALUES = struct.Struct("<dii")
+
+# Velocities are sent as int16, a bigger jump (player respawned, ...) is sent as a keyframe
+VELOCITY_LIMIT = 2 ** 15 - 1
+# ======================================================================================================================
+
+# Frames
+# ======================================================================================================================
+def to_subpixels(value):
+    return round(value * SUBPIXELS)
+
+
+def split_frames(data):
+    """ (frames, rest): the complete frames at the start of data as (kind, tick, payload), and the bytes left """
+    frames = []
+    offset = 0
+    while len(data) - offset >= HEADER.size:
+        kind, tick, size = HEADER.unpack_from(data, offset)
+        end = offset + HEADER.size + size
+        if end > len(data):
+            break
+        frames.append((kind, tick, bytes(data[offset + HEADER.size:end])))
+        offset = end
+    return frames, data[offset:]
+
+
+def entity_groups(endless_level, level_coins, level_enemies):
+    """ [(chunk, coins, enemies)] of a level: the layers of its map, or the chunks in memory in endless mode """
+    if endless_level is None:
+        return [(0, level_coins, level_enemies)]
+    return [(index, chunk.coins, chunk.enemies) for index, chunk in sorted(endless_level.chunks.items())]
+# ======================================================================================================================
+
+# Encoding (game thread)
+# ======================================================================================================================
+class StateEncoder:
+    """
+    Packs the state of the game after an update in a frame. Keeps what the spectators know from the frames
+    already sent, the deltas are computed against it.
+    """
+
+    def __init__(self, keyframe_interval=KEYFRAME_INTERVAL):
+        self.keyframe_interval = keyframe_interval
+        self.tick = 0
+        self.keyframe_requested = True
+        self.last_keyframe = 0
+
+        # The coins of the level streamed (a new list means a new level) and the chunk of the player (endless)
+        self.level_coins = None
+        self.chunk = None
+        # Coins and enemies of the groups of the last keyframe, which coins are still there
+        self.coin_sprites = []
+        self.enemy_sprites = []
+        self.coins = []
+        self.coin_count = 0
+        self.enemy_count = 0
+        # Enemies left: index in the layer -> [x, y, velocity x, velocity y] (subpixels)
+        self.enemies = {}
+        # [x, y, velocity x, velocity y] and pose of the player, the index of each of his textures
+        self.player = [0, 0, 0, 0]
+        self.pose = 0
+        self.player_sprite = None
+        self.poses = {}
+        self.view = (0, 0)
+        # (seconds, score, life)
+        self.hud = (0, 0, 0)
+        # Ids of the bullet entities
+        self.bullets = set()
+
+    def request_keyframe(self):
+        """ The next frame is a keyframe (a spectator connected, a frame was dropped, ...) """
+        self.keyframe_requested = True
+
+    def encode(self, game):
+        """ Frame of the state of game after an update """
+        self.tick += 1
+        if (self.keyframe_requested or game.level_coins is not self.level_coins
+                or (game.endless is not None and game.endless.current != self.chunk)
+                or self.tick - self.last_keyframe >= self.keyframe_interval):
+            return self.keyframe(game)
+        frame = self.delta(game)
+        return frame if frame is not None else self.keyframe(game)
+
+    def keyframe(self, game):
+        self.keyframe_requested = False
+        self.last_keyframe = self.tick
+        self.level_coins = game.level_coins
+        self.chunk = game.endless.current if game.endless is not None else None
+        groups = entity_groups(game.endless, game.level_coins, game.level_enemies)
+        self.coin_sprites = [coin for _, coins, _ in groups for coin in coins]
+        self.enemy_sprites = [enemy for _, _, enemies in groups for enemy in enemies]
+        self.coins = [bool(coin.sprite_lists) for coin in self.coin_sprites]
+        self.coin_count = len(game.coin_list)
+        self.enemy_count = len(game.enemy_list)
+        self.enemies = {index: [to_subpixels(enemy.center_x), to_subpixels(enemy.center_y), 0, 0]
+                        for index, enemy in enumerate(self.enemy_sprites) if enemy.sprite_lists}
+
+        player = game.player_sprite
+        if player is not self.player_sprite:
+            self.player_sprite = player
+            self.poses = {id(texture): index for index, texture in enumerate(player.pose_textures)}
+        self.player = [to_subpixels(player.center_x), to_subpixels(player.center_y), 0, 0]
+        self.pose = self.poses.get(id(player.texture), 0)
+        self.view = (int(game.view_left), int(game.view_bottom))
+        self.hud = (int(game.total_time), game.score, game.life)
+        self.bullets = set(game.colliders.entities)
+
+        endless_seed = game.endless.generator.seed if game.endless is not None else None
+        parts = [KEY_STATE.pack(game.level, endless_seed is not None, endless_seed or 0, self.chunk or 0, *self.view,
+                                game.total_time, game.score, game.life, self.player[0], self.player[1], self.pose,
+                                len(groups), len(self.bullets))]
+        for group, coins, enemies in groups:
+            parts.append(GROUP.pack(group, len(coins), len(enemies)))
+            parts.append(pack_bits([not coin.sprite_lists for coin in coins]))
+            parts.append(pack_bits([not enemy.sprite_lists for enemy in enemies]))
+        parts.extend(POINT.pack(x, y) for x, y, _, _ in self.enemies.values())
+        parts.extend(self.bullet_records(game, self.bullets))
+        return self.frame(KEYFRAME, parts)
+
+    def delta(self, game):
+        """ Frame of what changed since the last one, None when a value doesn't fit (a keyframe is sent instead) """
+        flags = 0
+        parts = [b""]
+
+        # Coins and enemies removed (their lists only get smaller between two level changes)
+        if len(game.coin_list) != self.coin_count or len(game.enemy_list) != self.enemy_count:
+            self.coin_count = len(game.coin_list)
+            self.enemy_count = len(game.enemy_list)
+            removed_coins = [index for index, coin in enumerate(self.coin_sprites)
+                             if self.coins[index] and not coin.sprite_lists]
+            removed_enemies = [index for index in self.enemies if not self.enemy_sprites[index].sprite_lists]
+            if removed_coins or removed_enemies:
+                flags |= REMOVED
+                parts.append(COUNTS.pack(len(removed_coins), len(removed_enemies)))
+                parts.extend(INDEX.pack(index) for index in removed_coins + removed_enemies)
+                for index in removed_coins:
+                    self.coins[index] = False
+                for index in removed_enemies:
+                    del self.enemies[index]
+
+        # Enemies that didn't move by their last velocity
+        moves = []
+        enemy_sprites = self.enemy_sprites
+        for index, enemy in self.enemies.items():
+            x, y = enemy_sprites[index].position
+            x = round(x * SUBPIXELS)
+            y = round(y * SUBPIXELS)
+            velocity_x = x - enemy[0]
+            velocity_y = y - enemy[1]
+            if velocity_x != enemy[2] or velocity_y != enemy[3]:
+                if abs(velocity_x) > VELOCITY_LIMIT or abs(velocity_y) > VELOCITY_LIMIT:
+                    return None
+                moves.append(VELOCITY.pack(index, velocity_x, velocity_y))
+            enemy[:] = x, y, velocity_x, velocity_y
+        if moves:
+            flags |= ENEMIES_MOVED
+            parts.append(COUNT.pack(len(moves)))
+            parts.extend(moves)
+
+        # The player, same thing
+        player = game.player_sprite
+        x = to_subpixels(player.center_x)
+        y = to_subpixels(player.center_y)
+        velocity_x = x - self.player[0]
+        velocity_y = y - self.player[1]
+        if velocity_x != self.player[2] or velocity_y != self.player[3]:
+            if abs(velocity_x) > VELOCITY_LIMIT or abs(velocity_y) > VELOCITY_LIMIT:
+                return None
+            flags |= PLAYER_MOVED
+            parts.append(VECTOR.pack(velocity_x, velocity_y))
+        self.player = [x, y, velocity_x, velocity_y]
+        pose = self.poses.get(id(player.texture), 0)
+        if pose != self.pose:
+            self.pose = pose
+            flags |= PLAYER_POSE
+            parts.append(POSE.pack(pose))
+
+        # Bullets destroyed and created
+        bullets = set(game.colliders.entities)
+        if bullets != self.bullets:
+            removed = sorted(self.bullets - bullets)
+            if removed:
+                flags |= BULLETS_REMOVED
+                parts.append(COUNT.pack(len(removed)))
+                parts.extend(BULLET_ID.pack(entity) for entity in removed)
+            added = bullets - self.bullets
+            if added:
+                flags |= BULLETS_ADDED
+                parts.append(COUNT.pack(len(added)))
+                parts.extend(self.bullet_records(game, added))
+            self.bullets = bullets
+
+        view = (int(game.view_left), int(game.view_bottom))
+        if view != self.view:
+            self.view = view
+            flags |= VIEW
+            parts.append(POINT.pack(*view))
+
+        # The HUD shows whole seconds
+        hud = (int(game.total_time), game.score, game.life)
+        if hud != self.hud:
+            self.hud = hud
+            flags |= HUD
+            parts.append(HUD_VALUES.pack(game.total_time, game.score, game.life))
+
+        parts[0] = FLAGS.pack(flags)
+        return self.frame(DELTA, parts)
+
+    def bullet_records(self, game, entities):
+        """ BULLET records of the bullet entities, in the order of the colliders """
+        position_index = game.positions.index
+        xs = game.positions.columns["x"]
+        ys = game.positions.columns["y"]
+        records = []
+        for entity, kind in zip(game.colliders.entities, game.colliders.columns["kind"]):
+            if entity in entities:
+                slot = position_index[entity]
+                records.append(BULLET.pack(entity, kind, to_subpixels(xs[slot]), to_subpixels(ys[slot]),
+                                           game.velocities.get(entity, "dx"), game.velocities.get(entity, "dy")))
+        return records
+
+    def frame(self, kind, parts):
+        payload = b"".join(parts)
+        return HEADER.pack(kind, self.tick, len(payload)) + payload
+# ======================================================================================================================
+
+# Decoding
+# ======================================================================================================================
+class StreamState:
+    """ The state of the game rebuilt from the frames """
+
+    def __init__(self):
+        # Tick of the last frame applied (None: waiting for a keyframe)
+        self.tick = None
+        self.level = 0
+        self.endless_seed = None
+        self.chunk = 0
+        # (chunk, number of coins, number of enemies) of the groups of the last keyframe
+        self.groups = []
+        self.view = (0, 0)
+        self.total_time = 0.0
+        self.score = 0
+        self.life = 0
+        # [x, y, velocity x, velocity y] of the player (subpixels) and the index of his texture
+        self.player = [0, 0, 0, 0]
+        self.pose = 0
+        # One bool per coin of the groups
+        self.coins = []
+        # Enemies left: index in the groups -> [x, y, velocity x, velocity y] (subpixels)
+        self.enemies = {}
+        # id -> [kind, x, y, dx, dy] (pixels)
+        self.bullets = {}
+        # Coins and (index, x, y) of the enemies removed by the last frame
+        self.removed_coins = []
+        self.removed_enemies = []
+        # Deltas ignored because one before them is missing
+        self.skipped = 0
+
+    def level_key(self):
+        return self.level, self.endless_seed
+
+    def apply(self, kind, tick, payload):
+        """ Update the state with a frame. Return False when it is a delta that doesn't follow the last frame. """
+        self.removed_coins = []
+        self.removed_enemies = []
+        if kind == KEYFRAME:
+            self.read_keyframe(payload)
+        elif self.tick is not None and tick == self.tick + 1:
+            self.read_delta(payload)
+        else:
+            self.tick = None
+            self.skipped += 1
+            return False
+        self.tick = tick
+        return True
+
+    def read_keyframe(self, payload):
+        (self.level, endless, endless_seed, self.chunk, view_left, view_bottom, self.total_time, self.score,
+         self.life, x, y, self.pose, groups, bullets) = KEY_STATE.unpack_from(payload)
+        self.endless_seed = endless_seed if endless else None
+        self.view = (view_left, view_bottom)
+        self.player = [x, y, 0, 0]
+
+        offset = KEY_STATE.size
+        self.groups = []
+        self.coins = []
+        removed_enemies = []
+        for _ in range(groups):
+            group, coins, enemies = GROUP.unpack_from(payload, offset)
+            offset += GROUP.size
+            self.groups.append((group, coins, enemies))
+            self.coins.extend(not removed for removed in unpack_bits(payload[offset:offset + (coins + 7) // 8], coins))
+            offset += (coins + 7) // 8
+            removed_enemies.extend(unpack_bits(payload[offset:offset + (enemies + 7) // 8], enemies))
+            offset += (enemies + 7) // 8
+        self.enemies = {}
+        for index, removed in enumerate(removed_enemies):
+            if not removed:
+                self.enemies[index] = [*POINT.unpack_from(payload, offset), 0, 0]
+                offset += POINT.size
+        self.bullets = {}
+        self.read_bullets(payload, offset, bullets)
+
+    def read_delta(self, payload):
+        (flags,) = FLAGS.unpack_from(payload)
+        offset = FLAGS.size
+        if flags & REMOVED:
+            coins, enemies = COUNTS.unpack_from(payload, offset)
+            offset += COUNTS.size
+            for _ in range(coins):
+                (index,) = INDEX.unpack_from(payload, offset)
+                offset += INDEX.size
+                self.coins[index] = False
+                self.removed_coins.append(index)
+            for _ in range(enemies):
+                (index,) = INDEX.unpack_from(payload, offset)
+                offset += INDEX.size
+                x, y, _, _ = self.enemies.pop(index)
+                self.removed_enemies.append((index, x / SUBPIXELS, y / SUBPIXELS))
+
+        # New velocities, then everything moves by its velocity
+        if flags & ENEMIES_MOVED:
+            (count,) = COUNT.unpack_from(payload, offset)
+            offset += COUNT.size
+            for _ in range(count):
+                index, velocity_x, velocity_y = VELOCITY.unpack_from(payload, offset)
+                offset += VELOCITY.size
+                self.enemies[index][2:] = velocity_x, velocity_y
+        for enemy in self.enemies.values():
+            enemy[0] += enemy[2]
+            enemy[1] += enemy[3]
+
+        player = self.player
+        if flags & PLAYER_MOVED:
+            player[2:] = VECTOR.unpack_from(payload, offset)
+            offset += VECTOR.size
+        player[0] += player[2]
+        player[1] += player[3]
+        if flags & PLAYER_POSE:
+            (self.pose,) = POSE.unpack_from(payload, offset)
+            offset += POSE.size
+
+        # The bullets created by this update are already at their new position
+        if flags & BULLETS_REMOVED:
+            (count,) = COUNT.unpack_from(payload, offset)
+            offset += COUNT.size
+            for _ in range(count):
+                (entity,) = BULLET_ID.unpack_from(payload, offset)
+                offset += BULLET_ID.size
+                del self.bullets[entity]
+        for bullet in self.bullets.values():
+            bullet[1] += bullet[3]
+            bullet[2] += bullet[4]
+        if flags & BULLETS_ADDED:
+            (count,) = COUNT.unpack_from(payload, offset)
+            offset += COUNT.size
+            offset = self.read_bullets(payload, offset, count)
+
+        if flags & VIEW:
+            self.view = POINT.unpack_from(payload, offset)
+            offset += POINT.size
+        if flags & HUD:
+            self.total_time, self.score, self.life = HUD_VALUES.unpack_from(payload, offset)
+
+    def read_bullets(self, payload, offset, count):
+        for _ in range(count):
+            entity, kind, x, y, dx, dy = BULLET.unpack_from(payload, offset)
+            offset += BULLET.size
+            self.bullets[entity] = [kind, x / SUBPIXELS, y / SUBPIXELS, dx, dy]
+        return offset
+# ======================================================================================================================
+
+# Publishing
+# ======================================================================================================================
+class StatePublisher:
+    """
+    Sends the frames to the spectators connected to port (localhost) and writes them to record_name.
+    publish(game) is called after each update, on the thread running them.
+    """
+
+    def __init__(self, port=STREAM_PORT, record_name=None, keyframe_interval=KEYFRAME_INTERVAL):
+        self.encoder = StateEncoder(keyframe_interval)
+        self.queue = queue.Queue(MAX_QUEUED)
+        self.clients = []
+        self.clients_lock = threading.Lock()
+        self.stopping = False
+
+        # Statistics
+        self.frames = 0
+        self.keyframes = 0
+        self.sent_bytes = 0
+        self.delta_bytes = 0
+        self.dropped = 0
+        self.encode_time = 0.0
+
+        self.record = None
+        if record_name:
+            self.record = open(record_name, "wb")
+            self.record.write(MAGIC)
+        self.server = None
+        if port is not None:
+            self.server = socket.create_server(("127.0.0.1", port))
+            self.server.settimeout(ACCEPT_INTERVAL)
+            threading.Thread(target=self.accept, name="state stream accept", daemon=True).start()
+        self.thread = threading.Thread(target=self.run, name="state stream", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    # Game thread
+    # ==================================================================================================================
+    def publish(self, game):
+        if not self.clients and self.record is None:
+            # Nobody watches: the first one gets a keyframe
+            self.encoder.request_keyframe()
+            return
+        start = time.perf_counter()
+        data = self.encoder.encode(game)
+        self.encode_time += time.perf_counter() - start
+        try:
+            self.queue.put_nowait(data)
+        except queue.Full:
+            # The spectators miss a delta, they can start again from a keyframe
+            self.dropped += 1
+            self.encoder.request_keyframe()
+            return
+        self.frames += 1
+        self.sent_bytes += len(data)
+        if data[0] == KEYFRAME:
+            self.keyframes += 1
+        else:
+            self.delta_bytes += len(data)
+
+    def report(self):
+        deltas = self.frames - self.keyframes
+        return (f"State stream: {len(self.clients)} spectators, {self.frames} frames ({self.keyframes} keyframes, "
+                f"{self.dropped} dropped), {self.sent_bytes / max(self.frames, 1):.1f} bytes per frame "
+                f"({self.delta_bytes / max(deltas, 1):.1f} per delta), "
+                f"encoding {self.encode_time / max(self.frames, 1) * 1e6:.1f} us per frame")
+    # ==================================================================================================================
+
+    # Background threads
+    # ==================================================================================================================
+    def accept(self):
+        while not self.stopping:
+            try:
+                client, _ = self.server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            client.settimeout(SEND_TIMEOUT)
+            try:
+                client.sendall(MAGIC)
+            except OSError:
+                client.close()
+                continue
+            with self.clients_lock:
+                self.clients.append(client)
+            self.encoder.request_keyframe()
+
+    def run(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                return
+            if self.record is not None:
+                self.record.write(data)
+            with self.clients_lock:
+                clients = list(self.clients)
+            for client in clients:
+                try:
+                    client.sendall(data)
+                except OSError:
+                    # Gone, or too slow
+                    with self.clients_lock:
+                        self.clients.remove(client)
+                    client.close()
+
+    def close(self):
+        """ Send the frames waiting, disconnect the spectators and close the recording """
+        if self.stopping:
+            return
+        self.stopping = True
+        self.queue.put(None)
+        self.thread.join()
+        if self.server is not None:
+            self.server.close()
+        with self.clients_lock:
+            for client in self.clients:
+                client.close()
+            self.clients = []
+        if self.record is not None:
+            self.record.close()
+    # ==================================================================================================================
+
+
+class NullPublisher:
+    """ Used when the state isn't streamed: publish() returns at once """
+
+    def publish(self, game):
+        pass
+
+    def report(self):
+        return "State stream: off"
+
+    def close(self):
+        pass
+
+
+NULL_PUBLISHER = NullPublisher()
+
+# The publisher of the game (NULL_PUBLISHER: none)
+_publisher = NULL_PUBLISHER
+
+
+def open_stream(port=STREAM_PORT, record_name=None):
+    """ Stream the state of the games created from now on (port None: only record it) """
+    global _publisher
+    _publisher = StatePublisher(port, record_name)
+    return _publisher
+
+
+def current_publisher():
+    return _publisher
+# ======================================================================================================================
+
+# Spectator
+# ======================================================================================================================
+class Source:
+    """ Frames from a connection to the game, or from a recording played at REPLAY_RATE """
+
+    def __init__(self, connection=None, recording=None):
+        self.connection = connection
+        self.data = bytearray()
+        self.closed = False
+        self.frames = []
+        self.replay_time = 0.0
+        if recording is not None:
+            self.frames, _ = split_frames(recording)
+            self.frames.reverse()
+
+    def read(self, delta_time):
+        """ The frames due """
+        if self.connection is None:
+            self.replay_time += delta_time
+            frames = []
+            while self.frames and self.replay_time >= 1 / REPLAY_RATE:
+                self.replay_time -= 1 / REPLAY_RATE
+                frames.append(self.frames.pop())
+            return frames
+        while not self.closed:
+            try:
+                data = self.connection.recv(65536)
+            except BlockingIOError:
+                break
+            except OSError:
+                data = b""
+            if not data:
+                self.closed = True
+                print("The game closed the stream")
+            self.data += data
+        frames, self.data = split_frames(self.data)
+        return frames
+
+
+class SpectatorWindow(arcade.Window):
+    """ Draws the state rebuilt from the frames of a Source like the game does, with the sprites of its module """
+
+    def __init__(self, game, source):
+        super().__init__(game.SCREEN_WIDTH, game.SCREEN_HEIGHT, f"{game.SCREEN_TITLE} - spectator")
+        self.game = game
+        self.source = source
+        self.state = StreamState()
+        self.level_key = None
+
+        self.tile_stores = []
+        self.endless = None
+        # ground, background, foreground, hazards, trampolines and ladders
+        self.static_lists = [arcade.SpriteList() for _ in range(6)]
+        self.coin_list = arcade.SpriteList()
+        self.enemy_list = arcade.SpriteList()
+        # Coins and enemies of the map, and those of the groups of the last keyframe (the map, or the chunks)
+        self.map_coins = []
+        self.map_enemies = []
+        self.level_coins = []
+        self.level_enemies = []
+        self.player_sprite = game.PlayerCharacter()
+        self.player_list = arcade.SpriteList()
+        self.player_list.append(self.player_sprite)
+        self.explosions = ExplosionPool(low_memory=game.EXPLOSION_LOW_MEMORY)
+        self.bullet_pools = {game.PLAYER_SHOT: SpritePool(game.BULLET_IMAGE, game.SPRITE_LASER_SCALING),
+                             game.ENEMY_SHOT: SpritePool(game.BULLET_IMAGE)}
+        # Bullet id -> (kind, sprite)
+        self.bullet_sprites = {}
+        arcade.set_background_color(arcade.csscolor.CORNFLOWER_BLUE)
+
+    def load_level(self):
+        game = self.game
+        state = self.state
+        self.level_key = state.level_key()
+        self.explosions.clear()
+        self.coin_list = arcade.SpriteList(use_spatial_hash=False)
+        self.enemy_list = arcade.SpriteList()
+        self.map_coins = []
+        self.map_enemies = []
+        if state.endless_seed is not None:
+            # The chunks come from the seed, the keyframes say which ones are in memory
+            self.tile_stores = []
+            self.static_lists = [arcade.SpriteList() for _ in range(6)]
+            ground, background, _, hazards, trampolines, ladders = self.static_lists
+            layers = {endless.GROUND: ground, endless.BACKGROUND: background, endless.HAZARDS: hazards,
+                      endless.TRAMPOLINES: trampolines, endless.LADDERS: ladders,
+                      endless.COINS: self.coin_list, endless.ENEMIES: self.enemy_list}
+            self.endless = endless.EndlessLevel(state.endless_seed, game.TILE_SCALING, layers, arcade.SpriteList(),
+                                                lambda enemy, patrol_areas: None,
+                                                lambda enemy: enemy.remove_from_sprite_lists())
+            return
+
+        self.endless = None
+        my_map = level_data.read_level(f"map2_level_{state.level}.tmx")
+        self.tile_stores = [TileStore(my_map, name, game.TILE_SCALING)
+                            for name in ("ground", "Background", "Foreground", "Don't touch", "Trampoline", "Ladder")]
+        self.static_lists = [store.sprite_list for store in self.tile_stores]
+        self.map_coins = list(load_layer(my_map, "Coins", game.TILE_SCALING, sprite_list=self.coin_list))
+        self.map_enemies = list(load_layer(my_map, "Enemies", game.TILE_SCALING, sprite_list=self.enemy_list))
+        if my_map.background_color:
+            arcade.set_background_color(my_map.background_color)
+
+    def sync(self, kind):
+        """ Sprites from the state after a frame """
+        state = self.state
+        if kind == KEYFRAME:
+            if state.level_key() != self.level_key:
+                self.load_level()
+            if self.endless is not None:
+                self.endless.move_to(state.chunk)
+            groups = entity_groups(self.endless, self.map_coins, self.map_enemies)
+            if [(group, len(coins), len(enemies)) for group, coins, enemies in groups] != state.groups:
+                print(f"Warning, the coins and enemies of level {state.level} aren't the ones of the game")
+            self.level_coins = [coin for _, coins, _ in groups for coin in coins]
+            self.level_enemies = [enemy for _, _, enemies in groups for enemy in enemies]
+            enemies_left = [index in state.enemies for index in range(len(self.level_enemies))]
+            for sprite_list, sprites, present in ((self.coin_list, self.level_coins, state.coins),
+                                                  (self.enemy_list, self.level_enemies, enemies_left)):
+                for sprite, shown in zip(sprites, present):
+                    if shown and not sprite.sprite_lists:
+                        sprite_list.append(sprite)
+                    elif not shown and sprite.sprite_lists:
+                        sprite.remove_from_sprite_lists()
+        else:
+            for index in state.removed_coins:
+                if index < len(self.level_coins):
+                    self.level_coins[index].remove_from_sprite_lists()
+            for index, x, y in state.removed_enemies:
+                if index < len(self.level_enemies):
+                    self.level_enemies[index].remove_from_sprite_lists()
+                self.explosions.emit(x, y)
+        self.explosions.update()
+
+        player_x = state.player[0] / SUBPIXELS
+        player_y = state.player[1] / SUBPIXELS
+        self.player_sprite.position = (player_x, player_y)
+        self.player_sprite.texture = self.player_sprite.pose_textures[state.pose]
+
+        # Enemies face the player
+        for index, (x, y, _, _) in state.enemies.items():
+            if index < len(self.level_enemies):
+                enemy = self.level_enemies[index]
+                enemy.position = (x / SUBPIXELS, y / SUBPIXELS)
+                enemy.angle = math.degrees(math.atan2(player_y - enemy.center_y, player_x - enemy.center_x)) - 180
+
+        for entity in [entity for entity in self.bullet_sprites if entity not in state.bullets]:
+            kind, sprite = self.bullet_sprites.pop(entity)
+            self.bullet_pools[kind].release(sprite)
+        for entity, (kind, x, y, dx, dy) in state.bullets.items():
+            if entity in self.bullet_sprites:
+                self.bullet_sprites[entity][1].position = (x, y)
+            else:
+                sprite = self.bullet_pools[kind].acquire(x, y, math.degrees(math.atan2(dy, dx)))
+                self.bullet_sprites[entity] = (kind, sprite)
+
+    def on_update(self, delta_time):
+        for kind, tick, payload in self.source.read(delta_time):
+            if self.state.apply(kind, tick, payload):
+                self.sync(kind)
+        view_left, view_bottom = self.state.view
+        for store in self.tile_stores:
+            store.update(view_left, view_bottom, self.game.SCREEN_WIDTH, self.game.SCREEN_HEIGHT)
+
+    def on_draw(self):
+        arcade.start_render()
+        if self.level_key is None:
+            return
+        width = self.game.SCREEN_WIDTH
+        height = self.game.SCREEN_HEIGHT
+        view_left, view_bottom = self.state.view
+        arcade.set_viewport(view_left, width + view_left, view_bottom, height + view_bottom)
+
+        # Same order as the game
+        ground, background, foreground, hazards, trampolines, ladders = self.static_lists
+        for sprite_list in (ground, background, foreground, hazards, trampolines, self.player_list, self.enemy_list,
+                            ladders, self.coin_list, self.explosions.sprite_list,
+                            self.bullet_pools[self.game.PLAYER_SHOT].sprite_list,
+                            self.bullet_pools[self.game.ENEMY_SHOT].sprite_list):
+            sprite_list.draw()
+
+        minutes, seconds = divmod(int(self.state.total_time), 60)
+        arcade.draw_text(f"Time: {minutes:02d}:{seconds:02d}", 10 + view_left, 30 + view_bottom, arcade.color.BLACK, 20)
+        arcade.draw_text(f"Score: {self.state.score}", 10 + view_left, 10 + view_bottom, arcade.csscolor.WHITE, 18)
+        arcade.draw_text(f"Life: {self.state.life}", 10 + view_left, 600 + view_bottom, arcade.csscolor.WHITE, 18)
+        status = "waiting for a keyframe" if self.state.tick is None else f"update {self.state.tick}"
+        arcade.draw_text(f"Spectator, {status}", width - 300 + view_left, 600 + view_bottom, arcade.csscolor.WHITE, 14)
+# ======================================================================================================================
+
+# Recordings
+# ======================================================================================================================
+def print_stats(data):
+    """ Size of the frames of a recording """
+    frames, rest = split_frames(data)
+    keyframes = [len(payload) + HEADER.size for kind, _, payload in frames if kind == KEYFRAME]
+    deltas = [len(payload) + HEADER.size for kind, _, payload in frames if kind == DELTA]
+    total = sum(keyframes) + sum(deltas)
+    print(f"{len(frames)} frames, {total} bytes, {total / max(len(frames), 1):.1f} bytes per update "
+          f"({total / max(len(frames), 1) * REPLAY_RATE / 1024:.2f} KiB/s at {REPLAY_RATE} updates per second)")
+    for name, sizes in (("keyframes", keyframes), ("deltas", deltas)):
+        if sizes:
+            sizes.sort()
+            print(f"  {name:<9} {len(sizes):>7}  mean {sum(sizes) / len(sizes):>7.1f}"
+                  f"  median {sizes[len(sizes) // 2]:>5}  max {sizes[-1]:>6} bytes")
+    if rest:
+        print(f"  {len(rest)} bytes of an incomplete frame at the end")
+# ======================================================================================================================
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch a game from its state stream, or play back a recording")
+    parser.add_argument("--port", type=int, default=STREAM_PORT, help="port of the game (STATE_STREAM_PORT)")
+    parser.add_argument("--replay", metavar="FILE", help="play back a recording (STATE_STREAM_RECORD)")
+    parser.add_argument("--stats", metavar="FILE", help="print the size of the frames of a recording")
+    args = parser.parse_args()
+
+    if args.stats or args.replay:
+        with open(args.stats or args.replay, "rb") as file:
+            data = file.read()
+        if not data.startswith(MAGIC):
+            parser.error(f"{args.stats or args.replay} is not a recording of the state stream")
+        if args.stats:
+            print_stats(data[len(MAGIC):])
+            return
+        source = Source(recording=data[len(MAGIC):])
+    else:
+        try:
+            connection = socket.create_connection(("127.0.0.1", args.port))
+        except OSError as error:
+            parser.error(f"can't connect to the game on port {args.port}: {error}")
+        connection.settimeout(SEND_TIMEOUT)
+        if connection.recv(len(MAGIC), socket.MSG_WAITALL) != MAGIC:
+            parser.error(f"port {args.port} isn't a state stream")
+        connection.setblocking(False)
+        source = Source(connection=connection)
+
+    # The game module gives the sprites, the assets are read the same way
+    game = importlib.import_module("2D_Platform")
+    if os.path.exists(game.ASSET_BUNDLE):
+        bundle.use_bundle(game.ASSET_BUNDLE)
+    if game.HIT_BOX_CACHE:
+        hit_boxes.use_cache(game.HIT_BOX_CACHE)
+    SpectatorWindow(game, source)
+    arcade.run()
+
+
+if __name__ == "__main__":
+    main()
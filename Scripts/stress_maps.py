@@ -0,0 +1,381 @@
+"""
+Synthetic maps for scaling tests
+
+The generate command writes maps of any size that setup() can load: every layer it reads, the tileset of a real
+map (copied as is) and, in each layer, the tiles that layer uses in that map, as often as it uses them. The ground
+is a random walk with lava gaps, with floating platforms (some reached by a ladder), and the coins, spikes,
+trampolines, decorations and enemies are put on the ground and the platforms with the given densities. The
+player starts on a flat and safe ground, the same seed always gives the same map.
+
+The bench command loads each map in a new process and measures the time and memory of setup() and the time of
+the updates (headless, drawing is not measured), so the cost of the game can be plotted against the map size.
+
+Run this file from the directory of the maps:
+    python stress_maps.py generate --width 250 500 1000 2000 4000 [--height 70] [--enemies 100] [--seed 1] ...
+    python stress_maps.py bench stress_*.tmx [--frames 600] [--json results.json]
+"""
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import random
+import re
+import sys
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import quoteattr
+
+import headless
+import hit_boxes
+import level_data
+from batch_runner import DELTA_TIME, ScriptedPolicy
+from map_analysis import EXPECTED_LAYERS, GROUND_LAYER, TILE_SCALING
+from map_encoding import ENCODINGS, encode_layer_data
+
+# Constants
+# ======================================================================================================================
+TEMPLATE_MAP = "map2_level_6.tmx"
+# Maps giving the tiles of the layers the template doesn't use, the last levels first
+LEVEL_MAPS = "map2_level_*.tmx"
+OUTPUT_NAME = "stress_{width}x{height}.tmx"
+
+# Same as the game: where the player starts (pixels)
+PLAYER_START_X = 250
+PLAYER_START_Y = 2700
+
+# Flat columns without hazards or enemies at both ends of the map
+SAFE_COLUMNS = 8
+
+# Lowest ground (rows from the bottom), rows kept free above the highest ground
+GROUND_BASE = 4
+HEADROOM_ROWS = 8
+
+# Chance that the ground goes one row up or down at each column, width of the lava gaps
+STEP_CHANCE = 0.2
+GAP_COLUMNS = (1, 2)
+
+# Platforms: length, rows above the ground
+PLATFORM_LENGTH = (3, 6)
+PLATFORM_HEIGHT = (3, 5)
+
+# Default densities, about those of the template
+DENSITIES = {
+    "platforms": 0.05,    # chance that a platform starts at a column
+    "ladders": 0.5,       # chance that a platform has a ladder
+    "gaps": 0.03,         # chance of a lava gap at a column
+    "spikes": 0.03,       # chance of spikes on a free ground cell
+    "trampolines": 0.01,  # chance of a trampoline on a free ground cell
+    "coins": 0.3,         # chance of a coin above a free ground or platform cell
+    "decoration": 0.3,    # chance of a background or foreground tile on a free ground cell
+    "ground_fill": 1.0,   # fraction of the rows under the surface that are filled (1: solid to the bottom)
+}
+
+# Enemies per 100 columns when their number isn't given (the template has 17 on 200 columns)
+ENEMIES_PER_100_COLUMNS = 8
+
+# Tilesets of the template, copied as they are
+TILESET_ELEMENT = re.compile(rb"<tileset\b.*?</tileset>|<tileset\b[^>]*/>", re.DOTALL)
+
+# Bench: updates timed after the setup
+BENCH_FRAMES = 600
+# ======================================================================================================================
+
+# Tiles of the template
+# ======================================================================================================================
+def read_palettes(template, other_maps=()):
+    """
+    {name: (gids, counts)} of the tiles used by each layer of the template, the ground is split in
+    "ground top" (nothing above) and "ground fill". A layer empty in the template takes the tiles of the same
+    layer in the other maps, when they have the same images in the tileset of the template.
+    """
+    template_level = level_data.read_level(template)
+    counts = {}
+    done = set()
+    for map_name in [template, *other_maps]:
+        level = template_level if map_name == template else level_data.read_level(map_name)
+        for name in EXPECTED_LAYERS:
+            layer = level.layer(name)
+            if layer is None or name in done:
+                continue
+            for column, row, gid in layer.cells():
+                tile = template_level.tiles.get(gid)
+                if tile is None or os.path.basename(tile.source) != os.path.basename(level.tiles[gid].source):
+                    continue
+                if name == GROUND_LAYER:
+                    covered = row > 0 and layer.gid(column, row - 1)
+                    key = "ground fill" if covered else "ground top"
+                else:
+                    key = name
+                counts.setdefault(key, {})
+                counts[key][gid] = counts[key].get(gid, 0) + 1
+                done.add(name)
+    missing = [name for name in EXPECTED_LAYERS if name not in done]
+    if missing:
+        raise ValueError(f"No tiles found for the layers {missing}")
+    palettes = {key: (list(gid_counts), list(gid_counts.values())) for key, gid_counts in counts.items()}
+    # A template whose ground is one row thick
+    palettes.setdefault("ground fill", palettes["ground top"])
+    return palettes
+# ======================================================================================================================
+
+# Generation
+# ======================================================================================================================
+def generate_layers(width, height, tile_height, palettes, densities, enemies, seed):
+    """ {layer name: gids} of a map, rows from the top as in the files """
+    rng = random.Random(seed)
+    layers = {name: [0] * (width * height) for name in EXPECTED_LAYERS}
+
+    def put(name, column, row, gid):
+        # row counted from the bottom
+        layers[name][(height - 1 - row) * width + column] = gid
+
+    def pick(name):
+        gids, counts = palettes[name]
+        return rng.choices(gids, counts)[0]
+
+    # Ground heights (0: lava gap), the ground starts just under the player as in the real maps
+    start_row = int(PLAYER_START_Y / (tile_height * TILE_SCALING))
+    top = max(GROUND_BASE, min(height - HEADROOM_ROWS, start_row - 2))
+    heights = []
+    height_now = top
+    gap_left = 0
+    for column in range(width):
+        safe = column < SAFE_COLUMNS or column >= width - SAFE_COLUMNS
+        if gap_left:
+            gap_left -= 1
+            heights.append(0)
+            continue
+        if not safe and heights[-1] and rng.random() < densities["gaps"]:
+            gap_left = rng.randint(*GAP_COLUMNS) - 1
+            heights.append(0)
+            continue
+        if not safe and rng.random() < STEP_CHANCE:
+            height_now = min(max(height_now + rng.choice((-1, 1)), GROUND_BASE), top)
+        heights.append(height_now)
+
+    # Cells where something can stand: (column, row) above the ground and the platforms
+    ground_cells = []
+    platform_cells = []
+    for column, surface in enumerate(heights):
+        if surface == 0:
+            put("Don't touch", column, 0, pick("Don't touch"))
+            continue
+        bottom = surface - 1 - round((surface - 1) * densities["ground_fill"])
+        for row in range(bottom, surface):
+            put(GROUND_LAYER, column, row, pick("ground top" if row == surface - 1 else "ground fill"))
+        if SAFE_COLUMNS <= column < width - SAFE_COLUMNS:
+            ground_cells.append((column, surface))
+
+    ladders = set()
+    column = SAFE_COLUMNS
+    while column < width - SAFE_COLUMNS - PLATFORM_LENGTH[1]:
+        if rng.random() >= densities["platforms"]:
+            column += 1
+            continue
+        length = rng.randint(*PLATFORM_LENGTH)
+        row = max(heights[column:column + length]) + rng.randint(*PLATFORM_HEIGHT)
+        if row < height - 2:
+            for platform_column in range(column, column + length):
+                put(GROUND_LAYER, platform_column, row, pick("ground top"))
+                platform_cells.append((platform_column, row + 1))
+            # A ladder from the ground next to the platform up to its level
+            ladder_column = column - 1
+            if heights[ladder_column] and rng.random() < densities["ladders"]:
+                for ladder_row in range(heights[ladder_column], row + 1):
+                    put("Ladder", ladder_column, ladder_row, pick("Ladder"))
+                ladders.add(ladder_column)
+        column += length + 2
+    ground_cells = [(column, row) for column, row in ground_cells if column not in ladders]
+
+    # Enemies first, on cells of their own
+    free_cells = ground_cells + platform_cells
+    rng.shuffle(free_cells)
+    enemy_count = min(enemies, len(free_cells))
+    for column, row in free_cells[:enemy_count]:
+        put("Enemies", column, row, pick("Enemies"))
+    taken = set(free_cells[:enemy_count])
+
+    for column, row in ground_cells:
+        if (column, row) in taken:
+            continue
+        chance = rng.random()
+        if chance < densities["spikes"]:
+            put("Don't touch", column, row, pick("Don't touch"))
+            continue
+        if chance < densities["spikes"] + densities["trampolines"]:
+            put("Trampoline", column, row, pick("Trampoline"))
+            continue
+        if rng.random() < densities["decoration"]:
+            name = rng.choice(("Background", "Foreground"))
+            put(name, column, row, pick(name))
+    for column, row in ground_cells + platform_cells:
+        if (column, row) not in taken and row + 1 < height and rng.random() < densities["coins"]:
+            put("Coins", column, row + 1, pick("Coins"))
+    return layers
+
+
+def map_source(template_source, template_root, width, height, layers, encoding_name):
+    """ Bytes of a .tmx file with the tilesets of the template and these layers """
+    encoding, compression = ENCODINGS[encoding_name]
+    attributes = f' encoding="{encoding}"' + (f' compression="{compression}"' if compression else "")
+    background = template_root.get("backgroundcolor")
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>',
+             f'<map version="1.5" tiledversion="1.7.0" orientation="orthogonal" renderorder="right-down" '
+             f'width="{width}" height="{height}" tilewidth="{template_root.get("tilewidth")}" '
+             f'tileheight="{template_root.get("tileheight")}" infinite="0"'
+             + (f' backgroundcolor="{background}"' if background else "")
+             + f' nextlayerid="{len(layers) + 1}" nextobjectid="1">']
+    lines.extend(" " + tileset.decode("utf-8") for tileset in TILESET_ELEMENT.findall(template_source))
+    for layer_id, (name, gids) in enumerate(layers.items(), start=1):
+        lines.append(f' <layer id="{layer_id}" name={quoteattr(name)} width="{width}" height="{height}">')
+        lines.append(f"  <data{attributes}>{encode_layer_data(gids, width, encoding, compression)}</data>")
+        lines.append(" </layer>")
+    lines.append("</map>")
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def generate(template, width, height, densities, enemies, seed, encoding_name, output_name):
+    """ Write a map, read it back to check it. Return its LevelData. """
+    with open(template, "rb") as file:
+        template_source = file.read()
+    template_root = ET.fromstring(template_source)
+    other_maps = sorted(glob.glob(os.path.join(os.path.dirname(template), LEVEL_MAPS)), reverse=True)
+    palettes = read_palettes(template, other_maps)
+    layers = generate_layers(width, height, int(template_root.get("tileheight")), palettes, densities, enemies,
+                             seed)
+    with open(output_name, "wb") as file:
+        file.write(map_source(template_source, template_root, width, height, layers, encoding_name))
+
+    level = level_data.read_level(output_name)
+    for name, gids in layers.items():
+        if list(level.layer(name).gids) != gids:
+            raise ValueError(f"{output_name}: the layer '{name}' doesn't read back")
+        unknown = {gid for _, _, gid in level.layer(name).cells() if gid not in level.tiles}
+        if unknown:
+            raise ValueError(f"{output_name}: tiles {sorted(unknown)} of '{name}' are not in the tileset")
+    return level
+# ======================================================================================================================
+
+# Bench
+# ======================================================================================================================
+def init_worker(quiet):
+    if quiet:
+        # The game prints while it loads
+        sys.stdout = open(os.devnull, "w")
+    hit_boxes.use_cache(hit_boxes.CACHE_NAME)
+    headless.game_class()
+
+
+def bench_map(task):
+    """
+    Load a map and play frames updates with the scripted policy. task is (map name, frames, trace).
+    With trace, only the memory of setup() is measured (tracing slows everything down).
+    """
+    map_name, frames, trace = task
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    game = headless.make_game(1, map_name=map_name)
+    setup_time = time.perf_counter() - start
+    if trace:
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return {"map": map_name, "memory_mb": current / 1024 ** 2, "setup_peak_mb": peak / 1024 ** 2}
+
+    # The map is played until the end of the frames, the lives are not counted
+    game.life = frames
+    policy = ScriptedPolicy(0)
+    player = game.player_sprite
+    times = []
+    for frame in range(frames):
+        policy.act(game, frame)
+        start = time.perf_counter()
+        game.on_update(DELTA_TIME)
+        times.append(time.perf_counter() - start)
+        if game.player_sprite is not player:
+            # End of the map: setup() loaded the next level
+            break
+    times.sort()
+    return {
+        "map": map_name,
+        "setup_ms": setup_time * 1000,
+        "frames": len(times),
+        "update_ms": sum(times) / len(times) * 1000,
+        "update_p95_ms": times[int(len(times) * 0.95)] * 1000,
+        "update_max_ms": times[-1] * 1000,
+    }
+
+
+def bench(map_names, frames, quiet=True):
+    """ One result per map, each run in a new process """
+    tasks = [(map_name, frames, trace) for map_name in map_names for trace in (False, True)]
+    results = {}
+    with multiprocessing.Pool(1, initializer=init_worker, initargs=(quiet,), maxtasksperchild=1) as pool:
+        for result in pool.imap(bench_map, tasks):
+            results.setdefault(result["map"], {}).update(result)
+    for map_name, result in results.items():
+        level = level_data.read_level(map_name)
+        result.update(width=level.width, height=level.height,
+                      tiles=sum(layer.count() for layer in level.layers.values()))
+    return list(results.values())
+
+
+def format_bench(results):
+    lines = [f"{'map':<24} {'columns':>7} {'rows':>4} {'tiles':>8} {'setup ms':>9} {'memory MB':>9} "
+             f"{'peak MB':>8} {'update ms':>9} {'p95 ms':>7} {'max ms':>7}"]
+    for result in results:
+        lines.append(f"{os.path.basename(result['map']):<24} {result['width']:>7} {result['height']:>4} "
+                     f"{result['tiles']:>8} {result['setup_ms']:>9.0f} {result['memory_mb']:>9.1f} "
+                     f"{result['setup_peak_mb']:>8.1f} {result['update_ms']:>9.3f} {result['update_p95_ms']:>7.3f} "
+                     f"{result['update_max_ms']:>7.2f}")
+    return "\n".join(lines)
+# ======================================================================================================================
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate large maps and measure how the game scales with them")
+    commands = parser.add_subparsers(dest="command", required=True)
+    generate_parser = commands.add_parser("generate", help="write synthetic maps")
+    generate_parser.add_argument("--width", type=int, nargs="+", default=[1000], help="columns, one map per width")
+    generate_parser.add_argument("--height", type=int, default=70, help="rows")
+    generate_parser.add_argument("--enemies", type=int,
+                                 help=f"enemies per map (default: {ENEMIES_PER_100_COLUMNS} per 100 columns)")
+    generate_parser.add_argument("--seed", type=int, default=0)
+    for name, value in DENSITIES.items():
+        generate_parser.add_argument("--" + name.replace("_", "-"), type=float, default=value, dest=name)
+    generate_parser.add_argument("--template", default=TEMPLATE_MAP, help="map giving the tileset and the tiles")
+    generate_parser.add_argument("--encoding", choices=list(ENCODINGS), default="base64+zlib")
+    generate_parser.add_argument("--output", default=OUTPUT_NAME, help="name of the maps ({width}, {height})")
+    bench_parser = commands.add_parser("bench", help="setup time, memory and update time of maps")
+    bench_parser.add_argument("maps", nargs="*")
+    bench_parser.add_argument("--frames", type=int, default=BENCH_FRAMES, help="updates timed per map")
+    bench_parser.add_argument("--json", help="also write the results to this file")
+    bench_parser.add_argument("--verbose", action="store_true", help="keep the output of the game")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        if min(args.width) < 3 * SAFE_COLUMNS or args.height < GROUND_BASE + HEADROOM_ROWS:
+            parser.error(f"maps must have at least {3 * SAFE_COLUMNS} columns and {GROUND_BASE + HEADROOM_ROWS} rows")
+        densities = {name: getattr(args, name) for name in DENSITIES}
+        for width in args.width:
+            enemies = args.enemies if args.enemies is not None else width * ENEMIES_PER_100_COLUMNS // 100
+            output_name = args.output.format(width=width, height=args.height)
+            start = time.perf_counter()
+            level = generate(args.template, width, args.height, densities, enemies, args.seed, args.encoding,
+                             output_name)
+            counts = ", ".join(f"{name} {layer.count()}" for name, layer in level.layers.items())
+            print(f"{output_name}: {width}x{args.height}, {os.path.getsize(output_name) / 1024:.0f} KB in "
+                  f"{time.perf_counter() - start:.1f} s ({counts})")
+    else:
+        map_names = args.maps or sorted(glob.glob(OUTPUT_NAME.format(width="*", height="*")))
+        results = bench(map_names, args.frames, quiet=not args.verbose)
+        print(format_bench(results))
+        if args.json:
+            with open(args.json, "w") as file:
+                json.dump(results, file, indent=1)
+
+
+if __name__ == "__main__":
+    main()
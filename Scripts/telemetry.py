@@ -0,0 +1,274 @@
+"""
+Statistics of the play sessions, kept in a SQLite database
+
+During a session the game only updates counters in memory: for each level played, its time, the deaths by
+cause, the coins, shots and kills, and the time between every two frames drawn. When a level ends its record is
+queued, and a background thread writes the queued records every few seconds in one transaction (with the frame
+time percentiles), so the game never waits for the database.
+
+Aggregates of every session, by level (or the last sessions):
+    python telemetry.py [telemetry.db] [--sessions 10]
+"""
+import argparse
+import array
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+import event_log
+
+# Constants
+# ======================================================================================================================
+DATABASE_NAME = "telemetry.db"
+
+# The writer thread commits the queued records at this interval (seconds)
+FLUSH_INTERVAL = 5.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    ended REAL
+);
+CREATE TABLE IF NOT EXISTS levels (
+    session INTEGER NOT NULL REFERENCES sessions(id),
+    level INTEGER NOT NULL,
+    outcome TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    coins INTEGER NOT NULL,
+    shots INTEGER NOT NULL,
+    kills INTEGER NOT NULL,
+    deaths_fall INTEGER NOT NULL,
+    deaths_hazard INTEGER NOT NULL,
+    deaths_enemy_bullet INTEGER NOT NULL,
+    frames INTEGER NOT NULL,
+    frame_p50_ms REAL,
+    frame_p95_ms REAL,
+    frame_p99_ms REAL,
+    frame_max_ms REAL
+);
+"""
+# ======================================================================================================================
+
+# Counters
+# ======================================================================================================================
+class LevelRecord:
+    """ Counters of one level played """
+
+    def __init__(self, level):
+        self.level = level
+        self.seconds = 0.0
+        self.coins = 0
+        self.shots = 0
+        self.kills = 0
+        self.deaths = [0] * len(event_log.DEATH_CAUSES)
+        self.frame_times = array.array('f')
+        self.outcome = None
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+class SessionTelemetry:
+    """
+    Counters of a session, fed with the events of the game (same arguments as EventLog.emit) and the frame times.
+    The records are written to database by a background thread.
+    """
+
+    def __init__(self, database, flush_interval=FLUSH_INTERVAL):
+        self.database = database
+        self.flush_interval = flush_interval
+        self.started = time.time()
+        self.record = None
+        self.game_over = False
+        self.queue = queue.SimpleQueue()
+        self.stop_event = threading.Event()
+        self.session_id = None
+        self.batches = 0
+        self.thread = threading.Thread(target=self.run, name="telemetry", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    # Game thread
+    # ==================================================================================================================
+    def emit(self, level, kind, x=0.0, y=0.0, value=0.0):
+        record = self.record
+        if record is None and kind != event_log.LEVEL:
+            return
+        if kind == event_log.SHOT:
+            record.shots += 1
+        elif kind == event_log.PICKUP:
+            record.coins += 1
+        elif kind == event_log.KILL:
+            record.kills += 1
+        elif kind == event_log.DEATH:
+            record.deaths[int(value)] += 1
+        elif kind == event_log.GAME_OVER:
+            self.game_over = True
+        elif kind == event_log.LEVEL:
+            # x is the level that starts
+            if record is not None:
+                if self.game_over:
+                    outcome = "game over"
+                elif x == record.level + 1:
+                    outcome = "completed"
+                else:
+                    outcome = "restarted"
+                self.end_level(outcome)
+            self.record = LevelRecord(int(x))
+            self.game_over = False
+
+    def tick(self, delta_time):
+        """ Called once per update with the game time it simulated """
+        record = self.record
+        if record is not None:
+            record.seconds += delta_time
+
+    def frame(self, frame_time):
+        """ Called once per frame drawn with the real time since the last one (can be another thread) """
+        record = self.record
+        if record is not None:
+            record.frame_times.append(frame_time)
+
+    def end_level(self, outcome):
+        self.record.outcome = outcome
+        self.queue.put(self.record)
+        self.record = None
+
+    def close(self):
+        """ End the session and write everything left """
+        if self.stop_event.is_set():
+            return
+        if self.record is not None:
+            self.end_level("quit")
+        self.stop_event.set()
+        self.thread.join()
+    # ==================================================================================================================
+
+    # Writer thread
+    # ==================================================================================================================
+    def run(self):
+        connection = sqlite3.connect(self.database)
+        with connection:
+            connection.executescript(SCHEMA)
+            self.session_id = connection.execute("INSERT INTO sessions (started) VALUES (?)",
+                                                 (self.started,)).lastrowid
+        while not self.stop_event.wait(self.flush_interval):
+            self.write_records(connection)
+        self.write_records(connection)
+        with connection:
+            connection.execute("UPDATE sessions SET ended = ? WHERE id = ?", (time.time(), self.session_id))
+        connection.close()
+
+    def write_records(self, connection):
+        """ Every queued level in one transaction """
+        rows = []
+        while True:
+            try:
+                record = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            frame_times = sorted(record.frame_times)
+            rows.append((self.session_id, record.level, record.outcome, record.seconds, record.coins,
+                         record.shots, record.kills, *record.deaths, len(frame_times),
+                         *(None if value is None else value * 1000 for value in
+                           (percentile(frame_times, 0.5), percentile(frame_times, 0.95),
+                            percentile(frame_times, 0.99), frame_times[-1] if frame_times else None))))
+        if rows:
+            with connection:
+                connection.executemany("INSERT INTO levels VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.batches += 1
+    # ==================================================================================================================
+
+
+class NullTelemetry:
+    """ Used when there is no database: nothing is counted """
+
+    def emit(self, level, kind, x=0.0, y=0.0, value=0.0):
+        pass
+
+    def tick(self, delta_time):
+        pass
+
+    def frame(self, frame_time):
+        pass
+
+    def close(self):
+        pass
+
+
+NULL_TELEMETRY = NullTelemetry()
+
+# The telemetry of the game (NULL_TELEMETRY: none)
+_telemetry = NULL_TELEMETRY
+
+
+def open_database(database):
+    """ Count the sessions of the games created from now on in this database """
+    global _telemetry
+    _telemetry = SessionTelemetry(database)
+    return _telemetry
+
+
+def current_telemetry():
+    return _telemetry
+# ======================================================================================================================
+
+# Queries
+# ======================================================================================================================
+LEVEL_SUMMARY = """
+SELECT level, COUNT(*), SUM(outcome = 'completed'), AVG(seconds), SUM(deaths_fall), SUM(deaths_hazard),
+       SUM(deaths_enemy_bullet), SUM(coins), SUM(shots), SUM(kills), AVG(frame_p95_ms), MAX(frame_max_ms)
+FROM levels GROUP BY level ORDER BY level
+"""
+
+LAST_SESSIONS = """
+SELECT sessions.id, datetime(sessions.started, 'unixepoch', 'localtime'), COUNT(levels.level),
+       COALESCE(SUM(levels.seconds), 0), COALESCE(MAX(levels.level), 0),
+       COALESCE(SUM(levels.deaths_fall + levels.deaths_hazard + levels.deaths_enemy_bullet), 0),
+       COALESCE(SUM(levels.coins), 0)
+FROM sessions LEFT JOIN levels ON levels.session = sessions.id
+GROUP BY sessions.id ORDER BY sessions.id DESC LIMIT ?
+"""
+
+
+def print_levels(connection):
+    print(f"{'level':>5} {'plays':>5} {'done':>5} {'avg time':>9} {'falls':>6} {'hazards':>7} {'bullets':>7} "
+          f"{'coins':>6} {'shots':>6} {'kills':>6} {'p95 ms':>7} {'max ms':>7}")
+    for (level, plays, completed, seconds, falls, hazards, bullets, coins, shots, kills, p95,
+         worst) in connection.execute(LEVEL_SUMMARY):
+        print(f"{level:>5} {plays:>5} {completed:>5} {seconds:>8.1f}s {falls:>6} {hazards:>7} {bullets:>7} "
+              f"{coins:>6} {shots:>6} {kills:>6} {p95 or 0:>7.1f} {worst or 0:>7.1f}")
+
+
+def print_sessions(connection, count):
+    print(f"{'session':>7} {'started':<19} {'levels':>6} {'time':>8} {'best':>4} {'deaths':>6} {'coins':>6}")
+    for session, started, levels, seconds, best, deaths, coins in connection.execute(LAST_SESSIONS, (count,)):
+        print(f"{session:>7} {started:<19} {levels:>6} {seconds:>7.0f}s {best:>4} {deaths:>6} {coins:>6}")
+# ======================================================================================================================
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Statistics of the play sessions")
+    parser.add_argument("database", nargs="?", default=DATABASE_NAME)
+    parser.add_argument("--sessions", type=int, metavar="N", help="list the last N sessions instead")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        parser.error(f"{args.database} doesn't exist (play a game first)")
+    connection = sqlite3.connect(args.database)
+    if args.sessions:
+        print_sessions(connection, args.sessions)
+    else:
+        print_levels(connection)
+    connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Lower the frame rate when nothing happens
+
+pyglet draws the window after every update, so the update rate is the draw rate. Three states:
+- active: one update (and one draw) per frame at the normal rate
+- idle: nothing has moved on the screen for IDLE_DELAY seconds, the window is updated at IDLE_RATE only and each
+  update runs the 1/60 s steps of the simulation that are due, the game runs the same, it is just drawn less often
+- paused: the window is unfocused or minimized, the updates are unscheduled, the process sleeps until an event
+  and the game time doesn't advance
+The first input, or anything moving again, goes back to the active state.
+"""
+import pyglet
+
+# Constants
+# ======================================================================================================================
+
+# Seconds without anything moving on the screen before the idle state
+IDLE_DELAY = 2.0
+
+# Updates (and draws) per second in the idle state
+IDLE_RATE = 10
+
+# Longest update, a stall (window dragged, breakpoint, ...) is not counted as game time
+MAX_DELTA_TIME = 0.25
+# ======================================================================================================================
+
+# Throttle
+# ======================================================================================================================
+ACTIVE = "active"
+IDLE = "idle"
+PAUSED = "paused"
+
+
+class FrameThrottle:
+    """ Update rate of a window, update_rate is the normal one (updates per second) """
+
+    def __init__(self, window, update_rate=60, idle_rate=IDLE_RATE, idle_delay=IDLE_DELAY):
+        self.window = window
+        self.update_rate = update_rate
+        self.idle_rate = idle_rate
+        self.idle_delay = idle_delay
+        self.state = ACTIVE
+        self.static_time = 0.0
+        # Game time not simulated yet in the idle state
+        self.pending_time = 0.0
+
+    def steps(self, delta_time):
+        """ delta_time of each simulation step to run for an update """
+        delta_time = min(delta_time, MAX_DELTA_TIME)
+        if self.state != IDLE:
+            return [delta_time]
+        self.pending_time += delta_time
+        count = int(self.pending_time * self.update_rate)
+        self.pending_time -= count / self.update_rate
+        return [1 / self.update_rate] * count
+
+    def check(self, static, delta_time):
+        """ Called after an update: static is True when nothing moved on the screen """
+        if not static:
+            self.static_time = 0.0
+            self.wake()
+        elif self.state == ACTIVE:
+            self.static_time += delta_time
+            if self.static_time >= self.idle_delay:
+                self.set_state(IDLE)
+
+    def wake(self):
+        """ Back to the normal rate (input, or something moves) """
+        self.static_time = 0.0
+        if self.state != ACTIVE:
+            self.set_state(ACTIVE)
+
+    def pause(self):
+        """ Stop updating (window unfocused or minimized) """
+        if self.state != PAUSED:
+            self.set_state(PAUSED)
+
+    def set_state(self, state):
+        self.state = state
+        self.pending_time = 0.0
+        if state == PAUSED:
+            # What arcade.Window.close does to stop the updates
+            pyglet.clock.unschedule(self.window._dispatch_updates)
+        else:
+            # The first update comes one interval later: the pause isn't counted
+            self.window.set_update_rate(1 / (self.idle_rate if state == IDLE else self.update_rate))
+# ======================================================================================================================